@@ -1,15 +1,28 @@
-from fastapi import FastAPI
-from fastapi.responses import Response
-from datetime import datetime
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse, FileResponse
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from sqlalchemy import create_engine, text
 import requests
-import csv
+import httpx
+import json
+import hashlib
 import os
+import zlib
 from pathlib import Path
 from typing import Optional
 import asyncio
+import queue
+import threading
+import time
+from collections import deque
 from contextlib import asynccontextmanager
+import ts_store
+import rollups
+import instance_metrics
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from metrics_bus import Publisher, Subscriber, SAMPLES_EXCHANGE, SNAPSHOTS_EXCHANGE
 
 # ======================================
 # CONFIGURACIÓN
@@ -28,33 +41,85 @@ MONITORING_URL = os.getenv("MONITORING_URL", "http://monitoring_service:5010/met
 METRICS_STORAGE_DIR = Path("/app/metrics_storage")
 METRICS_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
-# Variable global para controlar la tarea de recolección
+# El store binario (ts_store) es la fuente principal; el CSV diario se sigue
+# escribiendo mientras otros servicios lo lean directo del volumen (vm_placement)
+METRICS_CSV_MIRROR = os.getenv("METRICS_CSV_MIRROR", "true").lower() == "true"
+
+# Intervalo de recolección (segundos) = resolución de las muestras crudas
+COLLECTION_INTERVAL = 10
+
+# Puntos por serie que /metrics/history intenta no superar
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "300"))
+
+# Exportación en streaming
+EXPORT_MAX_DAYS = int(os.getenv("EXPORT_MAX_DAYS", "31"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Contadores worker_uso: cada cuánto se recalculan desde cero (segundos)
+USAGE_RECOMPUTE_INTERVAL = int(os.getenv("USAGE_RECOMPUTE_INTERVAL", "60"))
+recalculo_uso_lock = threading.Lock()
+ultimo_recalculo_uso = float("-inf")
+detalle_slices_por_worker = {}
+
+# Push: muestras de monitoring por RabbitMQ (fanout) y snapshots hacia vm_placement
+METRICS_PUSH_ENABLED = os.getenv("METRICS_PUSH_ENABLED", "true").lower() == "true"
+PUSH_STALE_SECONDS = int(os.getenv("PUSH_STALE_SECONDS", "30"))
+muestras_push = {}
+samples_subscriber = None
+
+# Backfill: muestras reenviadas desde el spool de un daemon (header replay).
+# Se archivan en el store/CSV con su propio timestamp; el hilo escritor las
+# vacía en cada ciclo. Si se acumulan más de BACKFILL_MAX, se descartan las más viejas.
+BACKFILL_MAX = int(os.getenv("BACKFILL_MAX", "20000"))
+backfill_pendiente = deque()
+backfill_lock = threading.Lock()
+snapshot_publisher = None
+
+# /resources/summary servido desde memoria
+RESUMEN_MAX_AGE = COLLECTION_INTERVAL * 2          # vencido → se reconstruye en el request
+WORKER_CAPACITY_TTL = int(os.getenv("WORKER_CAPACITY_TTL", "300"))
+resumen_cache = {"cuerpo": None, "etag": None, "construido": float("-inf")}
+resumen_lock = threading.Lock()
+capacidades_cache = None
+capacidades_leidas = float("-inf")
+ultimos_recursos_bd = {}
+
+# Instancias (idinstancia, process_id, worker, zona) para asociar los procesos qemu
+INSTANCE_MAP_TTL = int(os.getenv("INSTANCE_MAP_TTL", "30"))
+instancias_cache = None
+instancias_leidas = float("-inf")
+
+# Snapshots pendientes de escribir (cola → hilo escritor, fuera del event loop)
+SNAPSHOT_QUEUE_SIZE = int(os.getenv("SNAPSHOT_QUEUE_SIZE", "60"))
+
+# Prometheus: /metrics/prometheus
+PROM_REGISTRY = CollectorRegistry()
+duracion_recoleccion = Histogram(
+    "analytics_collection_duration_seconds", "Duración de cada recolección (BD + monitoring + resumen)",
+    ["fuente"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), registry=PROM_REGISTRY
+)
+
+# Variables globales para controlar la tarea de recolección
 collection_task = None
+http_client = None
+snapshot_queue = queue.Queue(maxsize=SNAPSHOT_QUEUE_SIZE)
+writer_thread = None
+
+# Tiempos por etapa de la última recolección (ms) + contadores
+collector_stats = {
+    "recolecciones": 0,
+    "ticks_saltados": 0,
+    "snapshots_descartados": 0,
+    "backfill_archivadas": 0,
+    "backfill_descartadas": 0,
+    "ultima": {}
+}
 
 # ======================================
 # FUNCIONES AUXILIARES
 # ======================================
 
 
-def parse_resource_value(value: str, resource_type: str) -> float:
-    """Parsear valores como '8GB', '100GB', '4' a números"""
-    if not value:
-        return 0.0
-    
-    value = str(value).upper().strip()
-    
-    # CPU es solo número
-    if resource_type == 'cpu':
-        return float(value)
-    
-    # RAM y Storage pueden tener GB/MB
-    if 'GB' in value:
-        return float(value.replace('GB', '').strip())
-    elif 'MB' in value:
-        return float(value.replace('MB', '').strip()) / 1024
-    else:
-        return float(value)
-
 def obtener_capacidad_total_workers():
     """Obtiene la capacidad TOTAL configurada de cada worker desde la BD"""
     try:
@@ -63,9 +128,9 @@ def obtener_capacidad_total_workers():
                 SELECT 
                     nombre,
                     ip,
-                    cpu,
-                    ram,
-                    storage
+                    cpu_count,
+                    ram_mb,
+                    storage_gb
                 FROM worker
                 WHERE nombre IN ('server2', 'server3', 'server4','worker1','worker2','worker3')
             """)
@@ -76,9 +141,9 @@ def obtener_capacidad_total_workers():
             for row in result:
                 capacidades[row.nombre] = {
                     "ip": row.ip,
-                    "cpu_total": int(parse_resource_value(row.cpu, 'cpu')),
-                    "ram_total_gb": parse_resource_value(row.ram, 'ram'),
-                    "storage_total_gb": parse_resource_value(row.storage, 'storage')
+                    "cpu_total": int(row.cpu_count or 0),
+                    "ram_total_gb": (row.ram_mb or 0) / 1024,
+                    "storage_total_gb": float(row.storage_gb or 0)
                 }
             
             return capacidades
@@ -87,55 +152,189 @@ def obtener_capacidad_total_workers():
         print(f"❌ Error obteniendo capacidades: {e}")
         return {}
 
+def _calcular_uso_agregado(conn):
+    """
+    Agregado completo sobre instancia/slice/worker (instancias de slices RUNNING).
+    Costoso: solo se usa en el recálculo periódico de worker_uso.
+    """
+    query = text("""
+        SELECT 
+            w.idworker as worker_id,
+            w.nombre as worker_nombre,
+            w.ip as worker_ip,
+            SUM(i.cpu_count) as cpu_utilizado,
+            SUM(i.ram_mb) / 1024 as ram_utilizado_gb,
+            SUM(i.storage_gb) as storage_utilizado_gb,
+            COUNT(i.idinstancia) as num_instancias_running,
+            GROUP_CONCAT(CONCAT(s.nombre, ' (', i.nombre, ')') SEPARATOR ', ') as slices_instancias
+        FROM instancia i
+        JOIN slice s ON i.slice_idslice = s.idslice
+        LEFT JOIN worker w ON i.worker_idworker = w.idworker
+        WHERE s.estado = 'RUNNING'
+          AND w.nombre IS NOT NULL
+        GROUP BY w.idworker, w.nombre, w.ip
+    """)
+    
+    recursos_utilizados = {}
+    for row in conn.execute(query):
+        recursos_utilizados[row.worker_nombre] = {
+            "worker_id": row.worker_id,
+            "ip": row.worker_ip,
+            "cpu_utilizado": float(row.cpu_utilizado or 0),
+            "ram_utilizado_gb": float(row.ram_utilizado_gb or 0),
+            "storage_utilizado_gb": float(row.storage_utilizado_gb or 0),
+            "num_instancias_running": int(row.num_instancias_running or 0),
+            "slices_instancias": row.slices_instancias or ""
+        }
+    return recursos_utilizados
+
+def recalcular_uso_workers():
+    """
+    Recalcula worker_uso desde cero (corrección de deriva de los deltas).
+    Bloquea las filas de worker_uso antes de leer el agregado: un delta
+    concurrente de slice_manager espera y se aplica encima del resultado.
+    """
+    global ultimo_recalculo_uso
+    
+    with engine.begin() as conn:
+        actuales = {
+            row.worker_idworker: row
+            for row in conn.execute(text("SELECT * FROM worker_uso FOR UPDATE"))
+        }
+        recursos_utilizados = _calcular_uso_agregado(conn)
+        
+        vistos = set()
+        for worker_nombre, uso in recursos_utilizados.items():
+            vistos.add(uso["worker_id"])
+            previo = actuales.get(uso["worker_id"])
+            if previo is not None and (
+                int(previo.instancias_running) != uso["num_instancias_running"]
+                or abs(float(previo.ram_reservado_gb) - uso["ram_utilizado_gb"]) > 0.01
+                or int(previo.cpu_reservado) != int(uso["cpu_utilizado"])
+            ):
+                print(f"⚠️ Deriva en worker_uso de {worker_nombre}: corrigiendo")
+            conn.execute(text("""
+                INSERT INTO worker_uso (worker_idworker, cpu_reservado, ram_reservado_gb, storage_reservado_gb, instancias_running)
+                VALUES (:wid, :cpu, :ram, :sto, :n)
+                ON DUPLICATE KEY UPDATE
+                    cpu_reservado = VALUES(cpu_reservado),
+                    ram_reservado_gb = VALUES(ram_reservado_gb),
+                    storage_reservado_gb = VALUES(storage_reservado_gb),
+                    instancias_running = VALUES(instancias_running)
+            """), {
+                "wid": uso["worker_id"],
+                "cpu": int(uso["cpu_utilizado"]),
+                "ram": uso["ram_utilizado_gb"],
+                "sto": uso["storage_utilizado_gb"],
+                "n": uso["num_instancias_running"]
+            })
+        
+        # Workers sin instancias RUNNING quedan en cero
+        for worker_id in set(actuales) - vistos:
+            conn.execute(text("""
+                UPDATE worker_uso 
+                SET cpu_reservado = 0, ram_reservado_gb = 0, storage_reservado_gb = 0, instancias_running = 0
+                WHERE worker_idworker = :wid
+            """), {"wid": worker_id})
+    
+    detalle_slices_por_worker.clear()
+    detalle_slices_por_worker.update({
+        nombre: uso["slices_instancias"] for nombre, uso in recursos_utilizados.items()
+    })
+    ultimo_recalculo_uso = time.monotonic()
+    return recursos_utilizados
+
+def leer_contadores_uso():
+    """Lee worker_uso: una fila por worker, sin parseo de strings"""
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT 
+                w.nombre as worker_nombre,
+                w.ip as worker_ip,
+                u.cpu_reservado,
+                u.ram_reservado_gb,
+                u.storage_reservado_gb,
+                u.instancias_running
+            FROM worker_uso u
+            JOIN worker w ON u.worker_idworker = w.idworker
+            WHERE u.instancias_running > 0
+        """))
+        
+        recursos_utilizados = {}
+        for row in result:
+            recursos_utilizados[row.worker_nombre] = {
+                "ip": row.worker_ip,
+                "cpu_utilizado": float(row.cpu_reservado or 0),
+                "ram_utilizado_gb": float(row.ram_reservado_gb or 0),
+                "storage_utilizado_gb": float(row.storage_reservado_gb or 0),
+                "num_instancias_running": int(row.instancias_running or 0),
+                # El detalle de slices se refresca con cada recálculo
+                "slices_instancias": detalle_slices_por_worker.get(row.worker_nombre, "")
+            }
+        return recursos_utilizados
+
 def obtener_recursos_utilizados_bd():
     """
     Calcula recursos UTILIZADOS por instancias en slices RUNNING únicamente
+    
+    Lee los contadores materializados worker_uso (O(workers)); cada
+    USAGE_RECOMPUTE_INTERVAL segundos los recalcula con el agregado completo.
     """
     try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT 
-                    w.nombre as worker_nombre,
-                    w.ip as worker_ip,
-                    SUM(CAST(REPLACE(i.cpu, ' ', '') AS UNSIGNED)) as cpu_utilizado,
-                    SUM(
-                        CASE 
-                            WHEN i.ram LIKE '%GB%' THEN CAST(REPLACE(REPLACE(i.ram, 'GB', ''), ' ', '') AS DECIMAL(10,2))
-                            WHEN i.ram LIKE '%MB%' THEN CAST(REPLACE(REPLACE(i.ram, 'MB', ''), ' ', '') AS DECIMAL(10,2)) / 1024
-                            ELSE CAST(i.ram AS DECIMAL(10,2))
-                        END
-                    ) as ram_utilizado_gb,
-                    SUM(
-                        CAST(REPLACE(REPLACE(i.storage, 'GB', ''), ' ', '') AS DECIMAL(10,2))
-                    ) as storage_utilizado_gb,
-                    COUNT(i.idinstancia) as num_instancias_running,
-                    GROUP_CONCAT(CONCAT(s.nombre, ' (', i.nombre, ')') SEPARATOR ', ') as slices_instancias
-                FROM instancia i
-                JOIN slice s ON i.slice_idslice = s.idslice
-                LEFT JOIN worker w ON i.worker_idworker = w.idworker
-                WHERE s.estado = 'RUNNING'
-                  AND w.nombre IS NOT NULL
-                GROUP BY w.nombre, w.ip
-            """)
-            
-            result = conn.execute(query)
-            recursos_utilizados = {}
-            
-            for row in result:
-                recursos_utilizados[row.worker_nombre] = {
-                    "ip": row.worker_ip,
-                    "cpu_utilizado": float(row.cpu_utilizado or 0),
-                    "ram_utilizado_gb": float(row.ram_utilizado_gb or 0),
-                    "storage_utilizado_gb": float(row.storage_utilizado_gb or 0),
-                    "num_instancias_running": int(row.num_instancias_running or 0),
-                    "slices_instancias": row.slices_instancias or ""
+        with recalculo_uso_lock:
+            if time.monotonic() - ultimo_recalculo_uso >= USAGE_RECOMPUTE_INTERVAL:
+                return {
+                    nombre: {k: v for k, v in uso.items() if k != "worker_id"}
+                    for nombre, uso in recalcular_uso_workers().items()
                 }
-            
-            return recursos_utilizados
-            
+        return leer_contadores_uso()
+        
     except Exception as e:
-        print(f"❌ Error obteniendo recursos utilizados: {e}")
-        return {}
+        print(f"⚠️ Contadores worker_uso no disponibles ({e}), usando agregado completo")
+        try:
+            with engine.connect() as conn:
+                return {
+                    nombre: {k: v for k, v in uso.items() if k != "worker_id"}
+                    for nombre, uso in _calcular_uso_agregado(conn).items()
+                }
+        except Exception as e:
+            print(f"❌ Error obteniendo recursos utilizados: {e}")
+            return {}
+
+def obtener_instancias_bd():
+    """Instancias de slices RUNNING con su worker, PID y recursos reservados"""
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT 
+                i.idinstancia,
+                i.nombre,
+                i.process_id,
+                i.slice_idslice,
+                s.nombre as slice_nombre,
+                s.zonadisponibilidad,
+                w.nombre as worker_nombre,
+                i.cpu_count,
+                i.ram_mb,
+                i.storage_gb
+            FROM instancia i
+            JOIN slice s ON i.slice_idslice = s.idslice
+            JOIN worker w ON i.worker_idworker = w.idworker
+            WHERE s.estado = 'RUNNING'
+        """))
+        return [dict(row._mapping) for row in result]
+
+def obtener_instancias_cacheadas():
+    """El mapeo PID → instancia solo cambia al desplegar/borrar: se relee cada INSTANCE_MAP_TTL"""
+    global instancias_cache, instancias_leidas
+    if instancias_cache is None or time.monotonic() - instancias_leidas >= INSTANCE_MAP_TTL:
+        try:
+            instancias_cache = obtener_instancias_bd()
+            instancias_leidas = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ No se pudieron leer las instancias: {e}")
+            if instancias_cache is None:
+                return []
+    return instancias_cache
 
 def obtener_metricas_actuales():
     """Obtiene métricas en tiempo real del monitoring service"""
@@ -150,102 +349,184 @@ def obtener_metricas_actuales():
         print(f"❌ No se pudo conectar con monitoring service: {e}")
         return None
 
-def guardar_metricas_snapshot(metricas: dict, recursos_utilizados: dict):
+def instante_muestra(data: dict):
+    """timestamp_sent (UTC, lo pone el daemon al enviar) como datetime de Lima, o None si no viene"""
+    try:
+        instante = datetime.fromisoformat(data["timestamp_sent"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    return instante.astimezone(ZoneInfo("America/Lima"))
+
+def timestamp_enviado(data: dict):
+    """Epoch de timestamp_sent o None si no viene"""
+    instante = instante_muestra(data)
+    return instante.timestamp() if instante else None
+
+def recibir_muestra_push(data: dict, headers: dict):
+    """
+    Callback del suscriptor: mantiene la última muestra por worker (no la
+    reemplaza por una más vieja). Las marcadas como replay (backfill del spool
+    de un daemon) no son el estado actual: solo se encolan para archivarlas.
+    """
+    if headers.get("replay"):
+        with backfill_lock:
+            if len(backfill_pendiente) >= BACKFILL_MAX:
+                backfill_pendiente.popleft()
+                collector_stats["backfill_descartadas"] += 1
+            backfill_pendiente.append(data)
+        return
+    hostname = data.get("hostname", "unknown")
+    actual = muestras_push.get(hostname)
+    if actual is not None:
+        nuevo, previo = timestamp_enviado(data), timestamp_enviado(actual)
+        if nuevo is not None and previo is not None and nuevo < previo:
+            return
+    muestras_push[hostname] = data
+
+def metricas_desde_push():
     """
-    Guarda un snapshot de las métricas actuales en CSV
+    Mismo formato que GET /metrics de monitoring, armado con las muestras
+    recibidas por push. None si el push no está activo o dejó de llegar.
     """
+    if not samples_subscriber or not samples_subscriber.connected or not muestras_push:
+        return None
+    ultimo = samples_subscriber.last_message_at
+    if ultimo is None or time.time() - ultimo > PUSH_STALE_SECONDS:
+        return None
+    metrics = dict(muestras_push)
+    return {
+        "timestamp": datetime.now(ZoneInfo("America/Lima")).isoformat(),
+        "workers_count": len(metrics),
+        "metrics": metrics
+    }
+
+async def obtener_metricas_actuales_async(client: httpx.AsyncClient):
+    """Igual que obtener_metricas_actuales, sin bloquear el event loop"""
     try:
-        ahora = datetime.now(ZoneInfo("America/Lima"))
+        resp = await client.get(MONITORING_URL, timeout=5)
+        if resp.status_code == 200:
+            return resp.json()
+        else:
+            print(f"⚠️ Error {resp.status_code}: {resp.text}")
+            return None
+    except Exception as e:
+        print(f"❌ No se pudo conectar con monitoring service: {e}")
+        return None
+
+def guardar_metricas_snapshot(metricas: dict, recursos_utilizados: dict, ahora: Optional[datetime] = None,
+                              backfill: bool = False):
+    """
+    Guarda un snapshot de las métricas actuales en el store de series de tiempo
+    (y en el CSV diario si METRICS_CSV_MIRROR está activo)
+    
+    ahora: instante de la recolección (por defecto, el momento de escribir)
+    backfill: muestra atrasada; solo se archiva (sin métricas por VM ni push a placement)
+    """
+    try:
+        ahora = ahora or datetime.now(ZoneInfo("America/Lima"))
         fecha = ahora.strftime("%Y-%m-%d")
         timestamp = ahora.strftime("%Y-%m-%d %H:%M:%S")
+        # Misma resolución de segundos que el CSV
+        ts = float(int(ahora.timestamp()))
         
-        # Archivo CSV por día
-        csv_file = METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv"
-        
-        # Verificar si el archivo existe para escribir header
-        file_exists = csv_file.exists()
-        
-        with open(csv_file, 'a', newline='') as f:
-            fieldnames = [
-                'timestamp', 'worker_nombre', 'worker_ip',
-                # Capacidad total (real desde métricas)
-                'cpu_total', 'ram_total_gb', 'storage_total_gb',
-                # Recursos utilizados (BD - RUNNING slices)
-                'cpu_utilizado_bd', 'ram_utilizado_bd_gb', 'storage_utilizado_bd_gb', 
-                'instancias_running', 'slices_detalle',
-                # Métricas del sistema (USO REAL)
-                'cpu_percent_sistema', 'ram_percent_sistema', 'disk_percent_sistema',
-                'ram_sistema_gb', 'disk_free_gb', 'qemu_count'
-            ]
-            
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
-            
-            if not file_exists:
-                writer.writeheader()
-            
-            # Escribir una fila por worker
-            if metricas and 'metrics' in metricas:
-                for worker_nombre, data in metricas['metrics'].items():
-                    utilizados = recursos_utilizados.get(worker_nombre, {})
-                    
-                    ram_total = data.get('ram_total_gb', 0)
-                    ram_percent = data.get('ram_percent', 0)
-                    ram_sistema = (ram_total * ram_percent / 100) if ram_total > 0 else 0
-                    
-                    # Calcular disco total real
-                    disk_free = data.get('disk_free_gb', 0)
-                    disk_percent = data.get('disk_percent', 0)
-                    if disk_percent < 100 and disk_percent > 0:
-                        disk_total = disk_free / (1 - disk_percent / 100)
-                    else:
-                        disk_total = 10
-                    
-                    writer.writerow({
-                        'timestamp': timestamp,
-                        'worker_nombre': worker_nombre,
-                        'worker_ip': utilizados.get('ip', 'N/A'),
-                        # Capacidad real
-                        'cpu_total': data.get('cpu_count', 0),
-                        'ram_total_gb': ram_total,
-                        'storage_total_gb': round(disk_total, 2),
-                        # Utilizados según BD
-                        'cpu_utilizado_bd': utilizados.get('cpu_utilizado', 0),
-                        'ram_utilizado_bd_gb': utilizados.get('ram_utilizado_gb', 0),
-                        'storage_utilizado_bd_gb': utilizados.get('storage_utilizado_gb', 0),
-                        'instancias_running': utilizados.get('num_instancias_running', 0),
-                        'slices_detalle': utilizados.get('slices_instancias', ''),
-                        # Métricas del sistema (USO REAL)
-                        'cpu_percent_sistema': data.get('cpu_percent', 0),
-                        'ram_percent_sistema': ram_percent,
-                        'disk_percent_sistema': disk_percent,
-                        'ram_sistema_gb': round(ram_sistema, 2),
-                        'disk_free_gb': disk_free,
-                        'qemu_count': data.get('qemu_count', 0)
-                    })
-        
-        print(f"💾 Snapshot guardado en {csv_file} - {timestamp}")
-        return str(csv_file)
+        rows = []
+        # Una fila por worker
+        if metricas and 'metrics' in metricas:
+            for worker_nombre, data in metricas['metrics'].items():
+                utilizados = recursos_utilizados.get(worker_nombre, {})
+                
+                ram_total = data.get('ram_total_gb', 0)
+                ram_percent = data.get('ram_percent', 0)
+                ram_sistema = (ram_total * ram_percent / 100) if ram_total > 0 else 0
+                
+                # Calcular disco total real
+                disk_free = data.get('disk_free_gb', 0)
+                disk_percent = data.get('disk_percent', 0)
+                if disk_percent < 100 and disk_percent > 0:
+                    disk_total = disk_free / (1 - disk_percent / 100)
+                else:
+                    disk_total = 10
+                
+                rows.append({
+                    'worker_nombre': worker_nombre,
+                    'worker_ip': utilizados.get('ip', 'N/A'),
+                    # Capacidad real
+                    'cpu_total': data.get('cpu_count', 0),
+                    'ram_total_gb': ram_total,
+                    'storage_total_gb': round(disk_total, 2),
+                    # Utilizados según BD
+                    'cpu_utilizado_bd': utilizados.get('cpu_utilizado', 0),
+                    'ram_utilizado_bd_gb': utilizados.get('ram_utilizado_gb', 0),
+                    'storage_utilizado_bd_gb': utilizados.get('storage_utilizado_gb', 0),
+                    'instancias_running': utilizados.get('num_instancias_running', 0),
+                    'slices_detalle': utilizados.get('slices_instancias', ''),
+                    # Métricas del sistema (USO REAL)
+                    'cpu_percent_sistema': data.get('cpu_percent', 0),
+                    'ram_percent_sistema': ram_percent,
+                    'disk_percent_sistema': disk_percent,
+                    'ram_sistema_gb': round(ram_sistema, 2),
+                    'disk_free_gb': disk_free,
+                    'qemu_count': data.get('qemu_count', 0)
+                })
+        
+        segmento = ts_store.append_snapshot(ts, rows)
+        rollups.add_snapshot(ts, rows)
+        
+        if backfill:
+            if METRICS_CSV_MIRROR:
+                ts_store.write_csv_mirror(METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv", ts, rows)
+            return segmento
+        
+        # Métricas por VM (lista "vms" del daemon) asociadas a su instancia
+        try:
+            instance_metrics.registrar(ts, metricas, obtener_instancias_cacheadas())
+        except Exception as e:
+            print(f"⚠️ Error guardando métricas por instancia: {e}")
+        
+        if snapshot_publisher:
+            snapshot_publisher.publish({"timestamp": ts, "rows": rows, "uso_zonas": instance_metrics.uso_por_zona()})
+        
+        if METRICS_CSV_MIRROR:
+            ts_store.write_csv_mirror(METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv", ts, rows)
+        
+        print(f"💾 Snapshot guardado en {segmento} - {timestamp} ({len(rows)} workers)")
+        return segmento
         
     except Exception as e:
         print(f"❌ Error guardando snapshot: {e}")
         return None
 
 def listar_archivos_metricas():
-    """Lista todos los archivos CSV de métricas disponibles"""
+    """Lista los días con métricas (segmentos del store y CSV diarios)"""
     try:
-        archivos = []
+        archivos = {}
+        for fecha in ts_store.available_days():
+            info = ts_store.segment_info(fecha)
+            archivos[fecha] = {
+                "nombre": f"metrics_{fecha}.tsdb",
+                "fecha": fecha,
+                "tamano_kb": info["tamano_kb"],
+                "registros": info["registros"],
+                "ruta": info["ruta"],
+                "formato": "tsdb"
+            }
+        
         for csv_file in METRICS_STORAGE_DIR.glob("metrics_snapshot_*.csv"):
+            fecha = csv_file.stem.replace("metrics_snapshot_", "")
             stats = csv_file.stat()
-            archivos.append({
+            entrada = archivos.setdefault(fecha, {
                 "nombre": csv_file.name,
-                "fecha": csv_file.stem.replace("metrics_snapshot_", ""),
+                "fecha": fecha,
                 "tamano_kb": round(stats.st_size / 1024, 2),
-                "ruta": str(csv_file)
+                "ruta": str(csv_file),
+                "formato": "csv"
             })
+            entrada["csv"] = csv_file.name
         
         # Ordenar por fecha descendente
-        archivos.sort(key=lambda x: x['fecha'], reverse=True)
-        return archivos
+        return sorted(archivos.values(), key=lambda x: x['fecha'], reverse=True)
         
     except Exception as e:
         print(f"❌ Error listando archivos: {e}")
@@ -255,36 +536,111 @@ def listar_archivos_metricas():
 # TAREA DE RECOLECCIÓN AUTOMÁTICA
 # ======================================
 
-async def recolectar_metricas_periodicamente():
+def escribir_snapshots():
     """
-    Tarea en background que recolecta métricas cada 10 segundos
+    Hilo escritor: consume la cola de snapshots y los persiste en lote
+    (store + rollups + CSV espejo). Un None en la cola lo detiene.
     """
-    print("🔄 Iniciando recolección automática de métricas cada 10 segundos...")
+    while True:
+        lote = [snapshot_queue.get()]
+        while True:
+            try:
+                lote.append(snapshot_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        inicio = time.perf_counter()
+        escritos = 0
+        for item in lote:
+            if item is None:
+                return
+            metricas, recursos_utilizados, ahora = item
+            if guardar_metricas_snapshot(metricas, recursos_utilizados, ahora):
+                escritos += 1
+            else:
+                print(f"   ⚠️ Error al guardar snapshot")
+        escribir_backfill()
+        collector_stats["ultima"]["write_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        collector_stats["ultima"]["write_batch"] = escritos
+
+def escribir_backfill():
+    """
+    Archiva las muestras de backfill pendientes, cada una con su timestamp_sent.
+    Los recursos reservados en BD no se conocen para ese momento: se usan los
+    de la última recolección.
+    """
+    with backfill_lock:
+        pendientes = list(backfill_pendiente)
+        backfill_pendiente.clear()
+    if not pendientes:
+        return
+    archivadas = 0
+    for data in sorted(pendientes, key=lambda d: timestamp_enviado(d) or 0):
+        instante = instante_muestra(data)
+        if instante is None:
+            continue
+        metricas = {"metrics": {data.get("hostname", "unknown"): data}}
+        if guardar_metricas_snapshot(metricas, ultimos_recursos_bd, instante, backfill=True):
+            archivadas += 1
+    collector_stats["backfill_archivadas"] += archivadas
+    print(f"💾 Backfill: {archivadas} muestra(s) atrasadas archivadas")
+
+async def _medir(etapa: str, tiempos: dict, coro):
+    inicio = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        tiempos[f"{etapa}_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+
+async def recolectar_metricas_periodicamente(client: httpx.AsyncClient):
+    """
+    Tarea en background que recolecta métricas cada COLLECTION_INTERVAL segundos
+    
+    BD (executor) y monitoring (HTTP async) se consultan en paralelo; la
+    escritura va a un hilo aparte. El siguiente tick se agenda sobre el reloj
+    monotónico (sin deriva): si una recolección se atrasa, se saltan ticks.
+    """
+    print(f"🔄 Iniciando recolección automática de métricas cada {COLLECTION_INTERVAL} segundos...")
     print(f"📍 Guardando en: {METRICS_STORAGE_DIR}")
     
+    loop = asyncio.get_running_loop()
+    
     # Esperar 5 segundos antes de empezar (dar tiempo a que todo arranque)
     await asyncio.sleep(5)
     
-    contador = 0
+    proximo_tick = loop.time()
     while True:
+        tiempos = {}
+        inicio = time.perf_counter()
+        ahora = datetime.now(ZoneInfo("America/Lima"))
         try:
-            contador += 1
-            print(f"\n🔍 Recolección #{contador} - {datetime.now(ZoneInfo('America/Lima')).strftime('%Y-%m-%d %H:%M:%S')}")
-            
-            # Obtener datos
-            recursos_utilizados = obtener_recursos_utilizados_bd()
-            print(f"   📊 Recursos utilizados obtenidos: {len(recursos_utilizados)} workers")
+            collector_stats["recolecciones"] += 1
             
-            metricas = obtener_metricas_actuales()
+            metricas_push = metricas_desde_push()
+            if metricas_push:
+                # Push activo: monitoring ya entregó las muestras, solo falta la BD
+                tiempos["fuente"] = "push"
+                tiempos["http_ms"] = 0
+                metricas = metricas_push
+                recursos_utilizados = await _medir(
+                    "db", tiempos, loop.run_in_executor(None, obtener_recursos_utilizados_bd)
+                )
+            else:
+                tiempos["fuente"] = "http"
+                recursos_utilizados, metricas = await asyncio.gather(
+                    _medir("db", tiempos, loop.run_in_executor(None, obtener_recursos_utilizados_bd)),
+                    _medir("http", tiempos, obtener_metricas_actuales_async(client))
+                )
             
-            # Guardar snapshot
             if metricas:
-                print(f"   📡 Métricas recibidas de monitoring service")
-                archivo = guardar_metricas_snapshot(metricas, recursos_utilizados)
-                if archivo:
-                    print(f"   ✅ Snapshot guardado exitosamente")
-                else:
-                    print(f"   ⚠️ Error al guardar snapshot")
+                await _medir("summary", tiempos, loop.run_in_executor(
+                    None, actualizar_cache_resumen, metricas, recursos_utilizados
+                ))
+                try:
+                    snapshot_queue.put_nowait((metricas, recursos_utilizados, ahora))
+                except queue.Full:
+                    collector_stats["snapshots_descartados"] += 1
+                    print(f"   ⚠️ Cola de escritura llena, snapshot descartado")
             else:
                 print(f"   ⚠️ No se pudieron obtener métricas del monitoring service")
             
@@ -293,9 +649,21 @@ async def recolectar_metricas_periodicamente():
             import traceback
             traceback.print_exc()
         
-        # Esperar 10 segundos
-        print(f"   ⏳ Esperando 10 segundos hasta próxima recolección...")
-        await asyncio.sleep(10)
+        tiempos["total_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+        duracion_recoleccion.labels(tiempos.get("fuente", "error")).observe(tiempos["total_ms"] / 1000)
+        tiempos["cola"] = snapshot_queue.qsize()
+        collector_stats["ultima"].update(tiempos)
+        print(f"🔍 Recolección #{collector_stats['recolecciones']} - {ahora.strftime('%H:%M:%S')} "
+              f"({tiempos.get('fuente')}, bd {tiempos.get('db_ms')}ms, http {tiempos.get('http_ms')}ms, total {tiempos['total_ms']}ms)")
+        
+        # Próximo tick alineado a la cadencia original
+        proximo_tick += COLLECTION_INTERVAL
+        ahora_loop = loop.time()
+        if proximo_tick <= ahora_loop:
+            saltados = int((ahora_loop - proximo_tick) // COLLECTION_INTERVAL) + 1
+            collector_stats["ticks_saltados"] += saltados
+            proximo_tick += saltados * COLLECTION_INTERVAL
+        await asyncio.sleep(proximo_tick - ahora_loop)
 
 # ======================================
 # LIFECYCLE MANAGEMENT
@@ -307,11 +675,20 @@ async def lifespan(app: FastAPI):
     Maneja el ciclo de vida de la aplicación
     Inicia y detiene la tarea de recolección automática
     """
-    global collection_task
+    global collection_task, http_client, writer_thread, samples_subscriber, snapshot_publisher
     
-    # Startup: Iniciar tarea de recolección
+    # Startup: Abrir store e iniciar tarea de recolección
     print("🚀 Iniciando Analytics Service...")
-    collection_task = asyncio.create_task(recolectar_metricas_periodicamente())
+    ts_store.init_store(METRICS_STORAGE_DIR)
+    instance_metrics.init_store(METRICS_STORAGE_DIR)
+    rollups.rebuild(ts_store.query_range(datetime.now(ZoneInfo("America/Lima")).timestamp() - rollups.ROLLUP_REBUILD_HOURS * 3600))
+    if METRICS_PUSH_ENABLED:
+        samples_subscriber = Subscriber(SAMPLES_EXCHANGE, recibir_muestra_push)
+        snapshot_publisher = Publisher(SNAPSHOTS_EXCHANGE)
+    writer_thread = threading.Thread(target=escribir_snapshots, name="metrics-writer", daemon=True)
+    writer_thread.start()
+    http_client = httpx.AsyncClient()
+    collection_task = asyncio.create_task(recolectar_metricas_periodicamente(http_client))
     
     yield
     
@@ -323,6 +700,12 @@ async def lifespan(app: FastAPI):
             await collection_task
         except asyncio.CancelledError:
             print("✅ Tarea de recolección detenida")
+    if http_client:
+        await http_client.aclose()
+    # Vaciar la cola pendiente antes de salir
+    if writer_thread:
+        snapshot_queue.put(None)
+        writer_thread.join(timeout=10)
 
 # ======================================
 # INICIALIZACIÓN DE FASTAPI
@@ -347,10 +730,13 @@ def root():
         "auto_collection": "enabled (every 10 seconds)",
         "endpoints": {
             "/resources/summary": "GET - Resumen completo de recursos (Dashboard Admin)",
-            "/metrics/files": "GET - Listar archivos CSV disponibles",
+            "/resources/instances": "GET - Uso real por instancia/VM (?worker=&slice_id=&zona=)",
+            "/metrics/prometheus": "GET - Métricas en formato Prometheus",
+            "/metrics/files": "GET - Listar días con métricas disponibles",
+            "/metrics/export": "GET - Exportar rango en streaming (?start=&end=&columns=&workers=&gzip=true)",
             "/metrics/export/{fecha}": "GET - Exportar métricas por fecha (YYYY-MM-DD)",
             "/metrics/latest": "GET - Obtener últimas métricas guardadas",
-            "/metrics/history": "GET - Obtener histórico de métricas"
+            "/metrics/history": "GET - Histórico de métricas (?minutes=30&resolution=auto&max_points=300&downsample=lttb)"
         }
     }
 
@@ -361,135 +747,312 @@ def health_check():
         "timestamp": datetime.now(ZoneInfo("America/Lima")).isoformat(),
         "database": "connected" if engine else "disconnected",
         "metrics_storage": str(METRICS_STORAGE_DIR),
-        "auto_collection": "running" if collection_task and not collection_task.done() else "stopped"
+        "rollups": rollups.status(),
+        "instancias": instance_metrics.status(),
+        "auto_collection": "running" if collection_task and not collection_task.done() else "stopped",
+        "collector": {**collector_stats, "cola_pendiente": snapshot_queue.qsize()},
+        "push": {
+            "muestras": samples_subscriber.stats() if samples_subscriber else {"enabled": False},
+            "snapshots": snapshot_publisher.stats() if snapshot_publisher else {"enabled": False}
+        }
+    }
+
+def construir_resumen(capacidades: dict, recursos_utilizados: dict, metricas: dict):
+    """Arma el resumen de recursos (capacidad, reservado en BD, uso real) por worker y del cluster"""
+    resumen = {
+        "timestamp": datetime.now(ZoneInfo("America/Lima")).isoformat(),
+        "workers": {},
+        "cluster_totals": {
+            "cpu_total": 0,
+            "cpu_utilizado": 0,
+            "cpu_disponible": 0,
+            "ram_total_gb": 0,
+            "ram_utilizado_gb": 0,
+            "ram_disponible_gb": 0,
+            "storage_total_gb": 0,
+            "storage_utilizado_gb": 0,
+            "storage_disponible_gb": 0,
+            "instancias_running_total": 0
+        }
+    }
+    
+    if metricas and "metrics" in metricas:
+        for worker_nombre, metric_data in metricas["metrics"].items():
+            if worker_nombre in capacidades:
+                capacidad = capacidades[worker_nombre]
+            else:
+                disk_free = metric_data.get('disk_free_gb', 0)
+                disk_percent = metric_data.get('disk_percent', 0)
+                if disk_percent < 100 and disk_percent > 0:
+                    disk_total = disk_free / (1 - disk_percent / 100)
+                else:
+                    disk_total = 10
+                
+                capacidad = {
+                    "ip": f"N/A",
+                    "cpu_total": int(metric_data.get('cpu_count', 4)),
+                    "ram_total_gb": float(metric_data.get('ram_total_gb', 8)),
+                    "storage_total_gb": round(disk_total, 2)
+                }
+            
+            utilizados = recursos_utilizados.get(worker_nombre, {
+                "cpu_utilizado": 0,
+                "ram_utilizado_gb": 0,
+                "storage_utilizado_gb": 0,
+                "num_instancias_running": 0,
+                "ip": capacidad.get("ip", "N/A"),
+                "slices_instancias": ""
+            })
+            
+            cpu_disponible = capacidad["cpu_total"] - utilizados["cpu_utilizado"]
+            ram_disponible = capacidad["ram_total_gb"] - utilizados["ram_utilizado_gb"]
+            storage_disponible = capacidad["storage_total_gb"] - utilizados["storage_utilizado_gb"]
+            
+            metricas_rt = {
+                "cpu_percent_sistema": metric_data.get("cpu_percent", 0),
+                "ram_percent_sistema": metric_data.get("ram_percent", 0),
+                "disk_percent_sistema": metric_data.get("disk_percent", 0),
+                "disk_free_gb": metric_data.get("disk_free_gb", 0),
+                "qemu_count": metric_data.get("qemu_count", 0),
+                "timestamp_sent": metric_data.get("timestamp_sent", ""),
+                "received_at": metric_data.get("received_at", "")
+            }
+            
+            resumen["workers"][worker_nombre] = {
+                "ip": capacidad.get("ip", "N/A"),
+                "capacidad": {
+                    "cpu_total": capacidad["cpu_total"],
+                    "ram_total_gb": round(capacidad["ram_total_gb"], 2),
+                    "storage_total_gb": round(capacidad["storage_total_gb"], 2)
+                },
+                "utilizado_bd": {
+                    "cpu": utilizados["cpu_utilizado"],
+                    "ram_gb": round(utilizados["ram_utilizado_gb"], 2),
+                    "storage_gb": round(utilizados["storage_utilizado_gb"], 2),
+                    "instancias_running": utilizados["num_instancias_running"],
+                    "slices_detalle": utilizados["slices_instancias"]
+                },
+                "disponible": {
+                    "cpu": max(0, cpu_disponible),
+                    "ram_gb": round(max(0, ram_disponible), 2),
+                    "storage_gb": round(max(0, storage_disponible), 2)
+                },
+                "utilizacion_percent": {
+                    "cpu": round((utilizados["cpu_utilizado"] / capacidad["cpu_total"]) * 100, 2) if capacidad["cpu_total"] > 0 else 0,
+                    "ram": round((utilizados["ram_utilizado_gb"] / capacidad["ram_total_gb"]) * 100, 2) if capacidad["ram_total_gb"] > 0 else 0,
+                    "storage": round((utilizados["storage_utilizado_gb"] / capacidad["storage_total_gb"]) * 100, 2) if capacidad["storage_total_gb"] > 0 else 0
+                },
+                "metricas_sistema": metricas_rt,
+                "estado": "online"
+            }
+            
+            resumen["cluster_totals"]["cpu_total"] += capacidad["cpu_total"]
+            resumen["cluster_totals"]["cpu_utilizado"] += utilizados["cpu_utilizado"]
+            resumen["cluster_totals"]["cpu_disponible"] += max(0, cpu_disponible)
+            resumen["cluster_totals"]["ram_total_gb"] += capacidad["ram_total_gb"]
+            resumen["cluster_totals"]["ram_utilizado_gb"] += utilizados["ram_utilizado_gb"]
+            resumen["cluster_totals"]["ram_disponible_gb"] += max(0, ram_disponible)
+            resumen["cluster_totals"]["storage_total_gb"] += capacidad["storage_total_gb"]
+            resumen["cluster_totals"]["storage_utilizado_gb"] += utilizados["storage_utilizado_gb"]
+            resumen["cluster_totals"]["storage_disponible_gb"] += max(0, storage_disponible)
+            resumen["cluster_totals"]["instancias_running_total"] += utilizados["num_instancias_running"]
+    
+    for key in ["ram_total_gb", "ram_utilizado_gb", "ram_disponible_gb", 
+                "storage_total_gb", "storage_utilizado_gb", "storage_disponible_gb"]:
+        resumen["cluster_totals"][key] = round(resumen["cluster_totals"][key], 2)
+    
+    resumen["cluster_totals"]["utilizacion_percent"] = {
+        "cpu": round((resumen["cluster_totals"]["cpu_utilizado"] / resumen["cluster_totals"]["cpu_total"]) * 100, 2) if resumen["cluster_totals"]["cpu_total"] > 0 else 0,
+        "ram": round((resumen["cluster_totals"]["ram_utilizado_gb"] / resumen["cluster_totals"]["ram_total_gb"]) * 100, 2) if resumen["cluster_totals"]["ram_total_gb"] > 0 else 0,
+        "storage": round((resumen["cluster_totals"]["storage_utilizado_gb"] / resumen["cluster_totals"]["storage_total_gb"]) * 100, 2) if resumen["cluster_totals"]["storage_total_gb"] > 0 else 0
+    }
+    
+    return resumen
+
+def obtener_capacidades_cacheadas():
+    """La capacidad configurada de los workers casi no cambia: se relee cada WORKER_CAPACITY_TTL"""
+    global capacidades_cache, capacidades_leidas
+    if capacidades_cache is None or time.monotonic() - capacidades_leidas >= WORKER_CAPACITY_TTL:
+        capacidades = obtener_capacidad_total_workers()
+        if capacidades or capacidades_cache is None:
+            capacidades_cache = capacidades
+            capacidades_leidas = time.monotonic()
+    return capacidades_cache
+
+def contenido_sin_marcas_de_tiempo(resumen: dict):
+    """Copia del resumen sin "timestamp" ni timestamp_sent/received_at de cada worker (para el ETag)"""
+    workers = {
+        nombre: {
+            **worker,
+            "metricas_sistema": {
+                k: v for k, v in worker.get("metricas_sistema", {}).items()
+                if k not in ("timestamp_sent", "received_at")
+            }
+        }
+        for nombre, worker in resumen["workers"].items()
+    }
+    return {**{k: v for k, v in resumen.items() if k != "timestamp"}, "workers": workers}
+
+def actualizar_cache_resumen(metricas: dict, recursos_utilizados: dict):
+    """Reconstruye el resumen y lo serializa una vez (cuerpo + ETag) para servirlo desde memoria"""
+    global resumen_cache, ultimos_recursos_bd
+    ultimos_recursos_bd = recursos_utilizados or {}
+    resumen = construir_resumen(obtener_capacidades_cacheadas(), recursos_utilizados, metricas)
+    # El ETag cubre el contenido sin marcas de tiempo (la del resumen y las de
+    # cada muestra, que cambian en cada ciclo): si los valores no cambiaron,
+    # se conserva el cuerpo anterior y los clientes siguen recibiendo 304
+    contenido = json.dumps(contenido_sin_marcas_de_tiempo(resumen), sort_keys=True)
+    etag = f'"{hashlib.sha1(contenido.encode("utf-8")).hexdigest()}"'
+    if etag == resumen_cache["etag"]:
+        resumen_cache = {**resumen_cache, "construido": time.monotonic()}
+        return resumen_cache
+    # Se reemplaza el dict completo: un lector nunca ve cuerpo y ETag de versiones distintas
+    resumen_cache = {
+        "cuerpo": json.dumps(resumen).encode("utf-8"),
+        "etag": etag,
+        "construido": time.monotonic()
     }
+    return resumen_cache
+
+def obtener_resumen_cacheado():
+    """
+    Resumen desde memoria. Si está vencido (collector caído o recién arrancado),
+    un solo request lo reconstruye y los concurrentes esperan ese resultado.
+    """
+    cache = resumen_cache
+    if time.monotonic() - cache["construido"] < RESUMEN_MAX_AGE:
+        return cache
+    
+    with resumen_lock:
+        # Otro request pudo reconstruirlo mientras esperábamos el lock
+        cache = resumen_cache
+        if time.monotonic() - cache["construido"] < RESUMEN_MAX_AGE:
+            return cache
+        try:
+            metricas = metricas_desde_push() or obtener_metricas_actuales()
+            return actualizar_cache_resumen(metricas, obtener_recursos_utilizados_bd())
+        except Exception as e:
+            print(f"❌ Error reconstruyendo resumen: {e}")
+            if cache["cuerpo"] is None:
+                raise
+            return cache  # mejor el último resumen que un error
 
 @app.get("/resources/summary")
-def get_resources_summary():
+def get_resources_summary(request: Request):
     """
     📊 Resumen completo de recursos para el dashboard de administrador
     
-    SOLO LECTURA - Lee del CSV más reciente
+    SOLO LECTURA - Se sirve desde memoria (lo reconstruye cada ciclo del collector).
+    Soporta ETag / If-None-Match → 304 si no cambió.
     """
     try:
-        capacidades = obtener_capacidad_total_workers()
-        recursos_utilizados = obtener_recursos_utilizados_bd()
-        metricas = obtener_metricas_actuales()
+        cache = obtener_resumen_cacheado()
+        headers = {"ETag": cache["etag"], "Cache-Control": "no-cache"}
+        
+        if request.headers.get("if-none-match") == cache["etag"]:
+            return Response(status_code=304, headers=headers)
         
-        # NO guardamos aquí, solo leemos
+        return Response(content=cache["cuerpo"], media_type="application/json", headers=headers)
         
-        resumen = {
+    except Exception as e:
+        return {"error": str(e), "timestamp": datetime.utcnow().isoformat()}
+
+@app.get("/resources/instances")
+def get_resources_instances(worker: Optional[str] = None, slice_id: Optional[int] = None, zona: Optional[str] = None):
+    """
+    🖥️ Uso real por instancia (CPU, RSS, IO de disco y red por proceso qemu)
+    
+    Incluye lo reservado en BD, la última muestra y el resumen de la ventana
+    reciente (estado_uso: idle / normal / hot), más el uso por zona.
+    """
+    try:
+        instancias, sin_mapear = instance_metrics.resumen(worker=worker, slice_id=slice_id, zona=zona)
+        return {
+            "success": True,
             "timestamp": datetime.now(ZoneInfo("America/Lima")).isoformat(),
-            "workers": {},
-            "cluster_totals": {
-                "cpu_total": 0,
-                "cpu_utilizado": 0,
-                "cpu_disponible": 0,
-                "ram_total_gb": 0,
-                "ram_utilizado_gb": 0,
-                "ram_disponible_gb": 0,
-                "storage_total_gb": 0,
-                "storage_utilizado_gb": 0,
-                "storage_disponible_gb": 0,
-                "instancias_running_total": 0
-            }
+            "total": len(instancias),
+            "instancias": sorted(instancias, key=lambda i: i["idinstancia"]),
+            "por_estado": {
+                estado: sum(1 for i in instancias if i["estado_uso"] == estado)
+                for estado in ("idle", "normal", "hot", "sin_datos")
+            },
+            "uso_zonas": instance_metrics.uso_por_zona(),
+            "procesos_sin_instancia": sin_mapear
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+# ======================================
+# PROMETHEUS
+# ======================================
+
+class RecursosCollector:
+    """
+    Gauges leídos del estado en memoria en cada scrape: capacidad y reservado
+    (BD) por worker, uso real por instancia y por zona, y contadores del collector.
+    """
+    
+    def collect(self):
+        capacidad = {
+            "cpu_total": GaugeMetricFamily("worker_cpu_capacity", "vCPU configurados del worker (BD)", labels=["worker"]),
+            "ram_total_gb": GaugeMetricFamily("worker_ram_capacity_gb", "RAM configurada del worker (BD)", labels=["worker"]),
+            "storage_total_gb": GaugeMetricFamily("worker_storage_capacity_gb", "Storage configurado del worker (BD)", labels=["worker"]),
         }
+        for worker, cap in (capacidades_cache or {}).items():
+            for campo, familia in capacidad.items():
+                familia.add_metric([worker], float(cap.get(campo) or 0))
+        yield from capacidad.values()
         
-        if metricas and "metrics" in metricas:
-            for worker_nombre, metric_data in metricas["metrics"].items():
-                if worker_nombre in capacidades:
-                    capacidad = capacidades[worker_nombre]
-                else:
-                    disk_free = metric_data.get('disk_free_gb', 0)
-                    disk_percent = metric_data.get('disk_percent', 0)
-                    if disk_percent < 100 and disk_percent > 0:
-                        disk_total = disk_free / (1 - disk_percent / 100)
-                    else:
-                        disk_total = 10
-                    
-                    capacidad = {
-                        "ip": f"N/A",
-                        "cpu_total": int(metric_data.get('cpu_count', 4)),
-                        "ram_total_gb": float(metric_data.get('ram_total_gb', 8)),
-                        "storage_total_gb": round(disk_total, 2)
-                    }
-                
-                utilizados = recursos_utilizados.get(worker_nombre, {
-                    "cpu_utilizado": 0,
-                    "ram_utilizado_gb": 0,
-                    "storage_utilizado_gb": 0,
-                    "num_instancias_running": 0,
-                    "ip": capacidad.get("ip", "N/A"),
-                    "slices_instancias": ""
-                })
-                
-                cpu_disponible = capacidad["cpu_total"] - utilizados["cpu_utilizado"]
-                ram_disponible = capacidad["ram_total_gb"] - utilizados["ram_utilizado_gb"]
-                storage_disponible = capacidad["storage_total_gb"] - utilizados["storage_utilizado_gb"]
-                
-                metricas_rt = {
-                    "cpu_percent_sistema": metric_data.get("cpu_percent", 0),
-                    "ram_percent_sistema": metric_data.get("ram_percent", 0),
-                    "disk_percent_sistema": metric_data.get("disk_percent", 0),
-                    "disk_free_gb": metric_data.get("disk_free_gb", 0),
-                    "qemu_count": metric_data.get("qemu_count", 0),
-                    "timestamp_sent": metric_data.get("timestamp_sent", ""),
-                    "received_at": metric_data.get("received_at", "")
-                }
-                
-                resumen["workers"][worker_nombre] = {
-                    "ip": capacidad.get("ip", "N/A"),
-                    "capacidad": {
-                        "cpu_total": capacidad["cpu_total"],
-                        "ram_total_gb": round(capacidad["ram_total_gb"], 2),
-                        "storage_total_gb": round(capacidad["storage_total_gb"], 2)
-                    },
-                    "utilizado_bd": {
-                        "cpu": utilizados["cpu_utilizado"],
-                        "ram_gb": round(utilizados["ram_utilizado_gb"], 2),
-                        "storage_gb": round(utilizados["storage_utilizado_gb"], 2),
-                        "instancias_running": utilizados["num_instancias_running"],
-                        "slices_detalle": utilizados["slices_instancias"]
-                    },
-                    "disponible": {
-                        "cpu": max(0, cpu_disponible),
-                        "ram_gb": round(max(0, ram_disponible), 2),
-                        "storage_gb": round(max(0, storage_disponible), 2)
-                    },
-                    "utilizacion_percent": {
-                        "cpu": round((utilizados["cpu_utilizado"] / capacidad["cpu_total"]) * 100, 2) if capacidad["cpu_total"] > 0 else 0,
-                        "ram": round((utilizados["ram_utilizado_gb"] / capacidad["ram_total_gb"]) * 100, 2) if capacidad["ram_total_gb"] > 0 else 0,
-                        "storage": round((utilizados["storage_utilizado_gb"] / capacidad["storage_total_gb"]) * 100, 2) if capacidad["storage_total_gb"] > 0 else 0
-                    },
-                    "metricas_sistema": metricas_rt,
-                    "estado": "online"
-                }
-                
-                resumen["cluster_totals"]["cpu_total"] += capacidad["cpu_total"]
-                resumen["cluster_totals"]["cpu_utilizado"] += utilizados["cpu_utilizado"]
-                resumen["cluster_totals"]["cpu_disponible"] += max(0, cpu_disponible)
-                resumen["cluster_totals"]["ram_total_gb"] += capacidad["ram_total_gb"]
-                resumen["cluster_totals"]["ram_utilizado_gb"] += utilizados["ram_utilizado_gb"]
-                resumen["cluster_totals"]["ram_disponible_gb"] += max(0, ram_disponible)
-                resumen["cluster_totals"]["storage_total_gb"] += capacidad["storage_total_gb"]
-                resumen["cluster_totals"]["storage_utilizado_gb"] += utilizados["storage_utilizado_gb"]
-                resumen["cluster_totals"]["storage_disponible_gb"] += max(0, storage_disponible)
-                resumen["cluster_totals"]["instancias_running_total"] += utilizados["num_instancias_running"]
-        
-        for key in ["ram_total_gb", "ram_utilizado_gb", "ram_disponible_gb", 
-                    "storage_total_gb", "storage_utilizado_gb", "storage_disponible_gb"]:
-            resumen["cluster_totals"][key] = round(resumen["cluster_totals"][key], 2)
-        
-        resumen["cluster_totals"]["utilizacion_percent"] = {
-            "cpu": round((resumen["cluster_totals"]["cpu_utilizado"] / resumen["cluster_totals"]["cpu_total"]) * 100, 2) if resumen["cluster_totals"]["cpu_total"] > 0 else 0,
-            "ram": round((resumen["cluster_totals"]["ram_utilizado_gb"] / resumen["cluster_totals"]["ram_total_gb"]) * 100, 2) if resumen["cluster_totals"]["ram_total_gb"] > 0 else 0,
-            "storage": round((resumen["cluster_totals"]["storage_utilizado_gb"] / resumen["cluster_totals"]["storage_total_gb"]) * 100, 2) if resumen["cluster_totals"]["storage_total_gb"] > 0 else 0
+        reservado = {
+            "cpu_utilizado": GaugeMetricFamily("worker_cpu_booked", "vCPU reservados por instancias RUNNING", labels=["worker"]),
+            "ram_utilizado_gb": GaugeMetricFamily("worker_ram_booked_gb", "RAM reservada por instancias RUNNING (GB)", labels=["worker"]),
+            "storage_utilizado_gb": GaugeMetricFamily("worker_storage_booked_gb", "Storage reservado por instancias RUNNING (GB)", labels=["worker"]),
+            "num_instancias_running": GaugeMetricFamily("worker_instances_running", "Instancias RUNNING en el worker", labels=["worker"]),
         }
+        for worker, uso in ultimos_recursos_bd.items():
+            for campo, familia in reservado.items():
+                familia.add_metric([worker], float(uso.get(campo) or 0))
+        yield from reservado.values()
         
-        return resumen
+        etiquetas = ["instancia", "slice", "worker", "zona"]
+        cpu_uso = GaugeMetricFamily("instance_cpu_usage_percent", "CPU usada sobre vCPU reservados, última muestra (%)", labels=etiquetas)
+        cpu_p95 = GaugeMetricFamily("instance_cpu_usage_p95_percent", "p95 de CPU usada sobre reservada en la ventana (%)", labels=etiquetas)
+        ram_p95 = GaugeMetricFamily("instance_ram_usage_p95_percent", "p95 de RSS sobre RAM reservada en la ventana (%)", labels=etiquetas)
+        instancias, _ = instance_metrics.resumen()
+        for inst in instancias:
+            valores = [inst["nombre"] or str(inst["idinstancia"]), str(inst["slice_id"]), inst["worker"] or "", inst["zona"] or ""]
+            if inst["actual"].get("cpu_percent") is not None:
+                cpu_uso.add_metric(valores, inst["actual"]["cpu_percent"] / inst["reservado"]["cpu"])
+            if inst["ventana"]["cpu_uso_p95"] is not None:
+                cpu_p95.add_metric(valores, inst["ventana"]["cpu_uso_p95"])
+            if inst["ventana"]["ram_uso_p95"] is not None:
+                ram_p95.add_metric(valores, inst["ventana"]["ram_uso_p95"])
+        yield cpu_uso
+        yield cpu_p95
+        yield ram_p95
         
-    except Exception as e:
-        return {"error": str(e), "timestamp": datetime.utcnow().isoformat()}
+        zona_cpu = GaugeMetricFamily("zone_cpu_usage_p95_percent", "p95 de CPU usada sobre reservada por zona (%)", labels=["zona"])
+        zona_ram = GaugeMetricFamily("zone_ram_usage_p95_percent", "p95 de RAM usada sobre reservada por zona (%)", labels=["zona"])
+        for zona, uso in instance_metrics.uso_por_zona().items():
+            zona_cpu.add_metric([zona], uso["cpu_uso_p95"])
+            if uso["ram_uso_p95"] is not None:
+                zona_ram.add_metric([zona], uso["ram_uso_p95"])
+        yield zona_cpu
+        yield zona_ram
+        
+        yield CounterMetricFamily("analytics_collections", "Recolecciones ejecutadas", value=collector_stats["recolecciones"])
+        yield CounterMetricFamily("analytics_ticks_skipped", "Ticks saltados por recolecciones atrasadas", value=collector_stats["ticks_saltados"])
+        yield CounterMetricFamily("analytics_snapshots_dropped", "Snapshots descartados por cola llena", value=collector_stats["snapshots_descartados"])
+        pendientes = GaugeMetricFamily("analytics_snapshot_queue", "Snapshots pendientes de escribir")
+        pendientes.add_metric([], snapshot_queue.qsize())
+        yield pendientes
+
+PROM_REGISTRY.register(RecursosCollector())
+
+@app.get("/metrics/prometheus")
+def prometheus_metrics():
+    """Métricas en formato de exposición de Prometheus (scrape)"""
+    return Response(generate_latest(PROM_REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/metrics/files")
 def list_metrics_files():
@@ -509,36 +1072,129 @@ def list_metrics_files():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-@app.get("/metrics/export/{fecha}")
-def export_metrics(fecha: str):
+def generar_csv_export(fechas, columnas=None, workers=None):
+    """CSV de varios días en orden, un solo header; lee segmento o CSV diario según exista"""
+    header = True
+    for fecha in fechas:
+        if ts_store.segment_exists(fecha):
+            yield from ts_store.export_day_csv(fecha, columnas, workers, header)
+        else:
+            # Días anteriores al store: solo existe el CSV
+            csv_file = METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv"
+            if not csv_file.exists():
+                continue
+            yield from ts_store.iter_csv_file(csv_file, columnas, workers, header)
+        header = False
+
+def agrupar_chunks(lineas, size: int = EXPORT_CHUNK_SIZE):
+    """Junta líneas en bloques de ~size bytes para no emitir un write por fila"""
+    partes = []
+    acumulado = 0
+    for linea in lineas:
+        partes.append(linea)
+        acumulado += len(linea)
+        if acumulado >= size:
+            yield "".join(partes).encode("utf-8")
+            partes = []
+            acumulado = 0
+    if partes:
+        yield "".join(partes).encode("utf-8")
+
+def comprimir_gzip(chunks):
+    """Gzip incremental: memoria constante sin importar el tamaño del export"""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        comprimido = compresor.compress(chunk)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+@app.get("/metrics/export")
+def export_metrics_range(
+    start: str,
+    end: Optional[str] = None,
+    columns: Optional[str] = None,
+    workers: Optional[str] = None,
+    gzip: bool = False
+):
     """
-    📥 Exportar métricas de un día específico
+    📥 Exportar métricas de un rango de días como CSV en streaming
     
-    Parámetro:
-        fecha: Formato YYYY-MM-DD (ejemplo: 2025-11-24)
+    Parámetros:
+        start / end: YYYY-MM-DD (end opcional, por defecto = start)
+        columns: columnas separadas por coma (por defecto todas)
+        workers: workers separados por coma (por defecto todos)
+        gzip: comprimir al vuelo (.csv.gz)
     """
     try:
-        csv_file = METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv"
-        
-        if not csv_file.exists():
+        inicio = datetime.strptime(start, "%Y-%m-%d").date()
+        fin = datetime.strptime(end, "%Y-%m-%d").date() if end else inicio
+    except ValueError:
+        return {"success": False, "error": "Formato de fecha inválido, use YYYY-MM-DD"}
+    
+    if fin < inicio:
+        return {"success": False, "error": "end debe ser posterior o igual a start"}
+    if (fin - inicio).days + 1 > EXPORT_MAX_DAYS:
+        return {"success": False, "error": f"Rango máximo de exportación: {EXPORT_MAX_DAYS} días"}
+    
+    columnas = None
+    if columns:
+        columnas = [c.strip() for c in columns.split(",") if c.strip()]
+        invalidas = [c for c in columnas if c not in ts_store.CSV_FIELDS]
+        if invalidas:
             return {
                 "success": False,
-                "error": f"No se encontró archivo para la fecha {fecha}"
-            }
-        
-        with open(csv_file, 'r') as f:
-            contenido = f.read()
-        
-        return Response(
-            content=contenido,
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename=metrics_{fecha}.csv"
+                "error": f"Columnas inválidas: {', '.join(invalidas)}",
+                "columnas_disponibles": ts_store.CSV_FIELDS
             }
+    lista_workers = {w.strip() for w in workers.split(",") if w.strip()} if workers else None
+    
+    fechas = [
+        inicio.fromordinal(ordinal).strftime("%Y-%m-%d")
+        for ordinal in range(inicio.toordinal(), fin.toordinal() + 1)
+    ]
+    fechas = [
+        f for f in fechas
+        if ts_store.segment_exists(f) or (METRICS_STORAGE_DIR / f"metrics_snapshot_{f}.csv").exists()
+    ]
+    if not fechas:
+        return {
+            "success": False,
+            "error": f"No se encontraron métricas entre {inicio} y {fin}"
+        }
+    
+    nombre = f"metrics_{fechas[0]}" if len(fechas) == 1 else f"metrics_{fechas[0]}_{fechas[-1]}"
+    
+    # Un día pasado sin filtros: el CSV diario tal cual, vía sendfile. El de hoy
+    # se sigue escribiendo (Content-Length quedaría corto), así que va en streaming
+    csv_file = METRICS_STORAGE_DIR / f"metrics_snapshot_{fechas[0]}.csv"
+    hoy = datetime.now(ZoneInfo("America/Lima")).strftime("%Y-%m-%d")
+    sin_filtros = len(fechas) == 1 and fechas[0] < hoy and not columnas and not lista_workers and not gzip
+    if sin_filtros and csv_file.exists() and (METRICS_CSV_MIRROR or not ts_store.segment_exists(fechas[0])):
+        return FileResponse(csv_file, media_type="text/csv", filename=f"{nombre}.csv")
+    
+    chunks = agrupar_chunks(generar_csv_export(fechas, columnas, lista_workers))
+    if gzip:
+        return StreamingResponse(
+            comprimir_gzip(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f"attachment; filename={nombre}.csv.gz"}
         )
-        
-    except Exception as e:
-        return {"success": False, "error": str(e)}
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={nombre}.csv"}
+    )
+
+@app.get("/metrics/export/{fecha}")
+def export_metrics(fecha: str, columns: Optional[str] = None, workers: Optional[str] = None, gzip: bool = False):
+    """
+    📥 Exportar métricas de un día específico (streaming)
+    
+    Parámetro:
+        fecha: Formato YYYY-MM-DD (ejemplo: 2025-11-24)
+    """
+    return export_metrics_range(start=fecha, end=fecha, columns=columns, workers=workers, gzip=gzip)
 
 @app.get("/metrics/latest")
 def get_latest_metrics():
@@ -546,140 +1202,227 @@ def get_latest_metrics():
     📊 Obtener las métricas más recientes guardadas
     """
     try:
-        archivos = listar_archivos_metricas()
+        segmento, filas = ts_store.latest(10)
         
-        if not archivos:
+        if segmento is None:
             return {
                 "success": False,
                 "error": "No hay archivos de métricas disponibles"
             }
         
-        ultimo_archivo = METRICS_STORAGE_DIR / archivos[0]["nombre"]
-        
-        metricas = []
-        with open(ultimo_archivo, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                metricas.append(row)
-        
         return {
             "success": True,
-            "archivo": archivos[0]["nombre"],
-            "fecha": archivos[0]["fecha"],
-            "total_registros": len(metricas),
-            "metricas": metricas[-10:] if len(metricas) > 10 else metricas
+            "archivo": segmento.path.name,
+            "fecha": segmento.fecha,
+            "total_registros": segmento.count,
+            "metricas": [ts_store.to_csv_row(fila) for fila in filas]
         }
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def _nueva_serie():
+    return {
+        "timestamps": [],
+        "cpu_percent": [],
+        "ram_percent": [],
+        "disk_percent": [],
+        "qemu_count": []
+    }
+
+def agrupar_por_step(rows, step: int):
+    """
+    Downsampling en el servidor: un punto por worker cada `step` segundos.
+    Porcentajes = promedio del bucket, qemu_count = máximo del bucket.
+    """
+    buckets = {}
+    for row in rows:
+        key = (row['worker_nombre'], int(row['timestamp'] // step) * step)
+        b = buckets.get(key)
+        if b is None:
+            b = buckets[key] = {"n": 0, "cpu": 0.0, "ram": 0.0, "disk": 0.0, "qemu": 0}
+        b["n"] += 1
+        b["cpu"] += row['cpu_percent_sistema']
+        b["ram"] += row['ram_percent_sistema']
+        b["disk"] += row['disk_percent_sistema']
+        b["qemu"] = max(b["qemu"], row['qemu_count'])
+    
+    for (worker, bucket_ts), b in sorted(buckets.items(), key=lambda item: item[0][1]):
+        yield {
+            'worker_nombre': worker,
+            'timestamp': bucket_ts,
+            'cpu_percent_sistema': round(b["cpu"] / b["n"], 2),
+            'ram_percent_sistema': round(b["ram"] / b["n"], 2),
+            'disk_percent_sistema': round(b["disk"] / b["n"], 2),
+            'qemu_count': b["qemu"]
+        }
+
+def series_desde_filas(rows):
+    """Filas crudas (o agrupadas por step) → series por worker"""
+    from collections import defaultdict
+    
+    history = defaultdict(_nueva_serie)
+    for row in rows:
+        worker = history[row['worker_nombre']]
+        worker["timestamps"].append(row['timestamp'])
+        worker["cpu_percent"].append(row['cpu_percent_sistema'])
+        worker["ram_percent"].append(row['ram_percent_sistema'])
+        worker["disk_percent"].append(row['disk_percent_sistema'])
+        worker["qemu_count"].append(row['qemu_count'])
+    return dict(history)
+
+def series_desde_rollups(puntos_por_worker):
+    """
+    Rollups → series por worker. La serie base es el promedio del bucket
+    (qemu_count: máximo) y se agregan <serie>_min/_max/_p95.
+    """
+    history = {}
+    for worker_nombre, puntos in puntos_por_worker.items():
+        serie = _nueva_serie()
+        serie["samples"] = []
+        for campo, nombre in rollups.ROLLUP_FIELDS.items():
+            for stat in ("min", "max", "p95"):
+                serie[f"{nombre}_{stat}"] = []
+        
+        for punto in puntos:
+            serie["timestamps"].append(punto["timestamp"])
+            serie["samples"].append(punto["samples"])
+            for campo, nombre in rollups.ROLLUP_FIELDS.items():
+                stats = punto[campo]
+                serie[nombre].append(stats["max"] if campo == 'qemu_count' else stats["avg"])
+                for stat in ("min", "max", "p95"):
+                    serie[f"{nombre}_{stat}"].append(stats[stat])
+        history[worker_nombre] = serie
+    return history
+
+def aplicar_lttb(history: dict, max_points: int):
+    """LTTB por worker guiado por cpu_percent; los índices elegidos se aplican a todas las series"""
+    for serie in history.values():
+        indices = rollups.lttb_indices(serie["timestamps"], serie["cpu_percent"], max_points)
+        if len(indices) == len(serie["timestamps"]):
+            continue
+        for nombre, valores in serie.items():
+            serie[nombre] = [valores[i] for i in indices]
+
 @app.get("/metrics/history")
-def get_metrics_history(minutes: int = 30):
+def get_metrics_history(
+    minutes: int = 30,
+    step: Optional[int] = None,
+    resolution: str = "auto",
+    max_points: int = HISTORY_MAX_POINTS,
+    downsample: Optional[str] = None
+):
     """
     📈 Obtener histórico de métricas de los últimos N minutos
     
+    Ventanas recientes salen del ring buffer en memoria; las más antiguas,
+    del store (índice disperso → seek al cutoff, sin parsear el día completo).
+    
+    resolution: "auto" (default) elige la más fina que entra en max_points puntos
+        por serie; o fija "raw", "1m", "5m", "1h" (rollups min/avg/max/p95).
+    step (segundos, opcional): downsampling de las muestras crudas, un punto por bucket.
+    downsample="lttb": reduce cada serie a max_points conservando su forma visual.
     Si no hay suficientes datos para el período solicitado, retorna todos los disponibles.
     """
-    from datetime import timedelta
-    from collections import defaultdict
-    
-    lima_tz = ZoneInfo("America/Lima")
-    fecha = datetime.now(lima_tz).strftime("%Y-%m-%d")
-    csv_file = METRICS_STORAGE_DIR / f"metrics_snapshot_{fecha}.csv"
-    
-    if not csv_file.exists():
+    if resolution != "auto" and resolution != "raw" and resolution not in rollups.RESOLUTIONS:
         return {
             "success": False,
-            "error": f"No hay datos históricos disponibles para {fecha}"
+            "error": f"Resolución inválida: {resolution}. Use auto, raw, {', '.join(rollups.RESOLUTIONS)}"
         }
+    if downsample not in (None, "lttb"):
+        return {"success": False, "error": f"Downsample inválido: {downsample}. Use lttb"}
+    max_points = max(max_points, 3)
     
-    # Leer TODOS los registros primero
-    all_records = []
-    with open(csv_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            all_records.append(row)
+    lima_tz = ZoneInfo("America/Lima")
+    now_ts = datetime.now(lima_tz).timestamp()
+    requested_cutoff = now_ts - minutes * 60
     
-    if not all_records:
-        return {
-            "success": True,
-            "period_minutes": minutes,
-            "warning": "No hay registros disponibles",
-            "data": {}
-        }
+    bounds = [
+        ts_store.day_bounds(dia)
+        for dia in ts_store.days_between(requested_cutoff, now_ts)
+        if ts_store.segment_exists(dia)
+    ]
+    bounds = [b for b in bounds if b["count"]]
     
-    # Obtener timestamps mínimo y máximo
-    try:
-        timestamps_parsed = []
-        for row in all_records:
-            ts = datetime.strptime(row['timestamp'].strip(), '%Y-%m-%d %H:%M:%S')
-            ts = ts.replace(tzinfo=lima_tz)
-            timestamps_parsed.append(ts)
-        
-        oldest_time = min(timestamps_parsed)
-        newest_time = max(timestamps_parsed)
-        available_minutes = (newest_time - oldest_time).total_seconds() / 60
-        
-    except Exception as e:
+    if not bounds:
         return {
             "success": False,
-            "error": f"Error parseando timestamps: {e}"
+            "error": f"No hay datos históricos disponibles para {datetime.now(lima_tz).strftime('%Y-%m-%d')}"
         }
     
-    # Determinar cutoff time
-    now = datetime.now(lima_tz)
-    requested_cutoff = now - timedelta(minutes=minutes)
+    oldest_ts = min(b["oldest_ts"] for b in bounds)
+    newest_ts = max(b["newest_ts"] for b in bounds)
+    total_records = sum(b["count"] for b in bounds)
+    available_minutes = (newest_ts - oldest_ts) / 60
     
     # Si el período solicitado es mayor al disponible, usar todos los datos
-    if available_minutes < minutes:
-        cutoff_time = oldest_time
+    if oldest_ts > requested_cutoff:
+        cutoff_ts = oldest_ts
         actual_minutes = available_minutes
         used_all_data = True
     else:
-        cutoff_time = requested_cutoff
+        cutoff_ts = requested_cutoff
         actual_minutes = minutes
         used_all_data = False
     
-    # Filtrar y organizar datos
-    history = defaultdict(lambda: {
-        "timestamps": [],
-        "cpu_percent": [],
-        "ram_percent": [],
-        "disk_percent": [],
-        "qemu_count": []
-    })
+    # Resolución: step explícito = crudo agrupado; auto = según ventana y presupuesto de puntos
+    if step and step > 0:
+        resolution_used = "raw"
+    elif resolution == "auto":
+        resolution_used = rollups.pick_resolution(now_ts - cutoff_ts, max_points, COLLECTION_INTERVAL)
+    else:
+        resolution_used = resolution
     
-    registros_incluidos = 0
+    history = None
+    source = None
     
-    for i, row in enumerate(all_records):
-        try:
-            row_time = timestamps_parsed[i]
-            
-            if row_time >= cutoff_time:
-                worker = row['worker_nombre']
-                history[worker]["timestamps"].append(row['timestamp'])
-                history[worker]["cpu_percent"].append(float(row.get('cpu_percent_sistema', 0)))
-                history[worker]["ram_percent"].append(float(row.get('ram_percent_sistema', 0)))
-                history[worker]["disk_percent"].append(float(row.get('disk_percent_sistema', 0)))
-                history[worker]["qemu_count"].append(int(row.get('qemu_count', 0)))
-                registros_incluidos += 1
-                
-        except Exception as e:
-            print(f"⚠️ Error procesando fila: {e}")
-            continue
+    if resolution_used != "raw":
+        history = series_desde_rollups(rollups.query(resolution_used, cutoff_ts, now_ts))
+        source = "rollup"
+        if not history:
+            # Rollups vacíos (p.ej. ventana anterior al rebuild): agrupar crudo al mismo paso
+            step = rollups.RESOLUTIONS[resolution_used][0]
+            history = None
+    
+    if history is None:
+        # Fuente: ring buffer si cubre la ventana completa, si no range scan en disco
+        ring_oldest = ts_store.ring_oldest_ts()
+        if ring_oldest is not None and ring_oldest <= cutoff_ts:
+            source = "ring_buffer"
+            rows = (row for serie in ts_store.recent(since_ts=cutoff_ts).values() for row in serie)
+        else:
+            source = "segment"
+            rows = ts_store.query_range(cutoff_ts, now_ts)
+        
+        if step and step > 0:
+            rows = agrupar_por_step(rows, step)
+        history = series_desde_filas(rows)
+    
+    if downsample == "lttb":
+        aplicar_lttb(history, max_points)
+    
+    registros_incluidos = 0
+    for serie in history.values():
+        serie["timestamps"] = [ts_store.format_ts(ts) for ts in serie["timestamps"]]
+        registros_incluidos += len(serie["timestamps"])
     
     response = {
         "success": True,
         "requested_minutes": minutes,
         "actual_minutes": round(actual_minutes, 1),
         "used_all_available_data": used_all_data,
-        "total_records_in_file": len(all_records),
+        "total_records_in_file": total_records,
         "records_returned": registros_incluidos,
-        "oldest_timestamp": oldest_time.strftime('%Y-%m-%d %H:%M:%S'),
-        "newest_timestamp": newest_time.strftime('%Y-%m-%d %H:%M:%S'),
-        "cutoff_timestamp": cutoff_time.strftime('%Y-%m-%d %H:%M:%S'),
+        "oldest_timestamp": ts_store.format_ts(oldest_ts),
+        "newest_timestamp": ts_store.format_ts(newest_ts),
+        "cutoff_timestamp": ts_store.format_ts(cutoff_ts),
+        "resolution": resolution_used,
+        "step_seconds": step if step and step > 0 else None,
+        "downsample": downsample,
+        "max_points": max_points,
+        "source": source,
         "total_workers": len(history),
-        "data": dict(history)
+        "data": history
     }
     
     # Agregar warning si se usaron todos los datos disponibles
@@ -687,6 +1430,7 @@ def get_metrics_history(minutes: int = 30):
         response["warning"] = f"Solo hay {actual_minutes:.1f} minutos de datos disponibles (solicitaste {minutes})"
     
     return response
+
 # ======================================
 # MAIN
 # ======================================
@@ -0,0 +1,190 @@
+"""
+Métricas por instancia (VM) a partir de la lista "vms" que reporta el daemon
+de cada worker (un elemento por proceso qemu: CPU, RSS, IO de disco y red).
+
+Cada proceso se asocia a su fila de `instancia` por (worker, process_id); si
+el PID no coincide (VM relanzada o PID aún no guardado) se usa el nombre de
+la VM. En memoria queda una ventana reciente por instancia; en disco, un
+NDJSON por día (instances_YYYY-MM-DD.jsonl) con una línea por snapshot.
+"""
+import json
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+LIMA_TZ = ZoneInfo("America/Lima")
+
+INSTANCE_WINDOW_SIZE = int(os.getenv("INSTANCE_WINDOW_SIZE", "90"))          # 90 x 10s = 15 min
+IDLE_CPU_PERCENT = float(os.getenv("INSTANCE_IDLE_CPU_PERCENT", "5"))        # % de los vCPU reservados
+HOT_CPU_PERCENT = float(os.getenv("INSTANCE_HOT_CPU_PERCENT", "80"))
+
+# Campos numéricos de cada VM en la muestra del daemon
+VM_FIELDS = ["cpu_percent", "cpu_time_s", "rss_mb", "read_bps", "write_bps", "net_rx_bps", "net_tx_bps"]
+
+_lock = threading.Lock()
+_ventanas = {}        # idinstancia → deque[(ts, {campo: valor})]
+_info = {}            # idinstancia → datos de BD (nombre, slice, worker, zona, reservas)
+_sin_mapear = {}      # worker → [{"pid", "name"}] del último snapshot
+_directory = None
+
+
+def init_store(directory):
+    global _directory
+    _directory = Path(directory)
+    _directory.mkdir(parents=True, exist_ok=True)
+
+
+def _p95(valores):
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(0.95 * len(ordenados)) - 1)]
+
+
+def mapear(metricas, instancias):
+    """
+    Asocia cada proceso qemu reportado con su instancia de BD.
+
+    Args:
+        metricas: respuesta de monitoring ({"metrics": {worker: muestra}})
+        instancias: filas de BD con idinstancia, nombre, process_id, worker_nombre, ...
+
+    Returns:
+        ([(instancia, vm)], {worker: [vm sin instancia]})
+    """
+    por_pid = {(i["worker_nombre"], i["process_id"]): i for i in instancias if i.get("process_id")}
+    por_nombre = {(i["worker_nombre"], i["nombre"]): i for i in instancias}
+
+    asociadas, sin_mapear = [], {}
+    for worker, data in (metricas or {}).get("metrics", {}).items():
+        for vm in data.get("vms") or []:
+            instancia = por_pid.get((worker, vm.get("pid"))) or por_nombre.get((worker, vm.get("name")))
+            if instancia is None:
+                sin_mapear.setdefault(worker, []).append({"pid": vm.get("pid"), "name": vm.get("name")})
+            else:
+                asociadas.append((instancia, vm))
+    return asociadas, sin_mapear
+
+
+def registrar(ts, metricas, instancias):
+    """Guarda las métricas por VM de un snapshot (ventana en memoria + NDJSON diario)"""
+    asociadas, sin_mapear = mapear(metricas, instancias)
+    filas = []
+    with _lock:
+        for instancia, vm in asociadas:
+            idinstancia = instancia["idinstancia"]
+            muestra = {campo: vm.get(campo) for campo in VM_FIELDS}
+            ventana = _ventanas.get(idinstancia)
+            if ventana is None:
+                ventana = _ventanas[idinstancia] = deque(maxlen=INSTANCE_WINDOW_SIZE)
+            ventana.append((ts, muestra))
+            _info[idinstancia] = {**instancia, "pid": vm.get("pid")}
+            filas.append({"idinstancia": idinstancia, "worker": instancia["worker_nombre"], "pid": vm.get("pid"), **muestra})
+
+        # Instancias que ya no están en BD (slice borrado/detenido) salen de memoria
+        vigentes = {i["idinstancia"] for i in instancias}
+        for idinstancia in list(_ventanas):
+            if idinstancia not in vigentes:
+                _ventanas.pop(idinstancia, None)
+                _info.pop(idinstancia, None)
+        _sin_mapear.clear()
+        _sin_mapear.update(sin_mapear)
+
+    if filas and _directory is not None:
+        fecha = datetime.fromtimestamp(ts, LIMA_TZ).strftime("%Y-%m-%d")
+        with open(_directory / f"instances_{fecha}.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps({"timestamp": ts, "instancias": filas}) + "\n")
+    return len(filas)
+
+
+def _estadisticas(idinstancia):
+    """Resumen de la ventana de una instancia (llamar con _lock tomado)"""
+    info = _info[idinstancia]
+    ventana = _ventanas[idinstancia]
+    ultimo_ts, ultima = ventana[-1]
+    vcpus = max(int(info.get("cpu_count") or 1), 1)
+    ram_mb = float(info.get("ram_mb") or 0)
+
+    cpu = [m["cpu_percent"] for _, m in ventana if m["cpu_percent"] is not None]
+    rss = [m["rss_mb"] for _, m in ventana if m["rss_mb"] is not None]
+    # Uso relativo a lo reservado: cpu_percent es % de un núcleo (2 vCPU al 100% = 200%)
+    cpu_uso = [c / vcpus for c in cpu]
+
+    if not cpu_uso:
+        estado = "sin_datos"
+    elif _p95(cpu_uso) < IDLE_CPU_PERCENT:
+        estado = "idle"
+    elif sum(cpu_uso) / len(cpu_uso) >= HOT_CPU_PERCENT:
+        estado = "hot"
+    else:
+        estado = "normal"
+
+    return {
+        "idinstancia": idinstancia,
+        "nombre": info.get("nombre"),
+        "slice_id": info.get("slice_idslice"),
+        "slice_nombre": info.get("slice_nombre"),
+        "zona": info.get("zonadisponibilidad"),
+        "worker": info.get("worker_nombre"),
+        "pid": info.get("pid"),
+        "reservado": {"cpu": vcpus, "ram_mb": ram_mb, "storage_gb": float(info.get("storage_gb") or 0)},
+        "actual": {**ultima, "timestamp": ultimo_ts},
+        "ventana": {
+            "muestras": len(ventana),
+            "desde": ventana[0][0],
+            "cpu_uso_avg": round(sum(cpu_uso) / len(cpu_uso), 2) if cpu_uso else None,
+            "cpu_uso_p95": round(_p95(cpu_uso), 2) if cpu_uso else None,
+            "ram_uso_p95": round(100 * _p95(rss) / ram_mb, 2) if rss and ram_mb else None,
+        },
+        "estado_uso": estado
+    }
+
+
+def resumen(worker=None, slice_id=None, zona=None):
+    """Lista de instancias con su uso actual y de la ventana (filtros opcionales)"""
+    with _lock:
+        instancias = [
+            _estadisticas(idinstancia) for idinstancia in _ventanas
+            if (worker is None or _info[idinstancia].get("worker_nombre") == worker)
+            and (slice_id is None or _info[idinstancia].get("slice_idslice") == slice_id)
+            and (zona is None or _info[idinstancia].get("zonadisponibilidad") == zona)
+        ]
+        sin_mapear = {w: list(vms) for w, vms in _sin_mapear.items()}
+    return instancias, sin_mapear
+
+
+def uso_por_zona():
+    """
+    Uso real de lo reservado por zona de disponibilidad (p95 entre las
+    instancias del p95 de cada una, en % de sus vCPU / RAM reservados).
+    Es lo que VM Placement usa para ajustar los factores de sobreprovisión.
+    """
+    instancias, _ = resumen()
+    zonas = {}
+    for inst in instancias:
+        if inst["ventana"]["cpu_uso_p95"] is None or not inst["zona"]:
+            continue
+        zona = zonas.setdefault(inst["zona"], {"cpu": [], "ram": []})
+        zona["cpu"].append(inst["ventana"]["cpu_uso_p95"])
+        if inst["ventana"]["ram_uso_p95"] is not None:
+            zona["ram"].append(inst["ventana"]["ram_uso_p95"])
+
+    return {
+        zona: {
+            "instancias": len(valores["cpu"]),
+            "cpu_uso_p95": round(_p95(valores["cpu"]), 2),
+            "ram_uso_p95": round(_p95(valores["ram"]), 2) if valores["ram"] else None,
+        }
+        for zona, valores in zonas.items()
+    }
+
+
+def status():
+    with _lock:
+        return {
+            "instancias": len(_ventanas),
+            "ventana_muestras": INSTANCE_WINDOW_SIZE,
+            "procesos_sin_mapear": sum(len(vms) for vms in _sin_mapear.values())
+        }
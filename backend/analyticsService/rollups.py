@@ -0,0 +1,185 @@
+"""
+Rollups incrementales de las métricas por worker (1m / 5m / 1h).
+
+Cada snapshot que entra actualiza el bucket abierto de cada resolución; al
+cambiar de bucket se cierra con min/avg/max/p95 y pasa a una deque con
+retención fija. Así /metrics/history puede servir ventanas largas con pocos
+puntos sin releer las muestras crudas de 10s.
+
+También incluye LTTB (Largest-Triangle-Three-Buckets) para reducir una serie
+a N puntos conservando su forma visual.
+"""
+import math
+import os
+import threading
+from collections import deque
+
+# Resolución → (segundos por bucket, buckets retenidos por worker)
+RESOLUTIONS = {
+    "1m": (60, int(os.getenv("ROLLUP_1M_RETENTION", "1440"))),      # 1 día
+    "5m": (300, int(os.getenv("ROLLUP_5M_RETENTION", "2016"))),     # 7 días
+    "1h": (3600, int(os.getenv("ROLLUP_1H_RETENTION", "720"))),     # 30 días
+}
+ROLLUP_REBUILD_HOURS = int(os.getenv("ROLLUP_REBUILD_HOURS", "48"))
+
+# Columna del store → nombre de la serie en la respuesta de /metrics/history
+ROLLUP_FIELDS = {
+    'cpu_percent_sistema': 'cpu_percent',
+    'ram_percent_sistema': 'ram_percent',
+    'disk_percent_sistema': 'disk_percent',
+    'qemu_count': 'qemu_count',
+}
+
+_lock = threading.Lock()
+_closed = {}     # (resolución, worker) → deque de buckets cerrados
+_open = {}       # (resolución, worker) → {"start": ts, "values": {campo: [..]}}
+
+
+def _p95(sorted_values):
+    rank = max(0, math.ceil(0.95 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def _summarize(bucket):
+    """Bucket abierto → punto con min/avg/max/p95 por campo"""
+    point = {"timestamp": bucket["start"], "samples": 0}
+    for field, values in bucket["values"].items():
+        ordered = sorted(values)
+        point["samples"] = len(ordered)
+        point[field] = {
+            "min": round(ordered[0], 2),
+            "avg": round(sum(ordered) / len(ordered), 2),
+            "max": round(ordered[-1], 2),
+            "p95": round(_p95(ordered), 2),
+        }
+    return point
+
+
+def _add_row(ts, row):
+    worker = row.get('worker_nombre', '')
+    for resolution, (seconds, retention) in RESOLUTIONS.items():
+        key = (resolution, worker)
+        start = int(ts // seconds) * seconds
+        bucket = _open.get(key)
+
+        if bucket is None or bucket["start"] != start:
+            if bucket is not None:
+                if start < bucket["start"]:
+                    continue  # muestra fuera de orden de un bucket ya cerrado
+                closed = _closed.get(key)
+                if closed is None:
+                    closed = _closed[key] = deque(maxlen=retention)
+                closed.append(_summarize(bucket))
+            bucket = _open[key] = {"start": start, "values": {f: [] for f in ROLLUP_FIELDS}}
+
+        for field in ROLLUP_FIELDS:
+            bucket["values"][field].append(float(row.get(field) or 0))
+
+
+def add_snapshot(ts, rows):
+    """Actualiza los rollups con las filas de un snapshot (mismo timestamp epoch)"""
+    with _lock:
+        for row in rows:
+            _add_row(ts, row)
+
+
+def rebuild(rows):
+    """Reconstruye los rollups desde filas del store (ordenadas por timestamp)"""
+    with _lock:
+        _closed.clear()
+        _open.clear()
+        count = 0
+        for row in rows:
+            _add_row(row['timestamp'], row)
+            count += 1
+    print(f"📉 Rollups reconstruidos con {count} muestras")
+
+
+def query(resolution, since_ts, until_ts=None):
+    """
+    Puntos de una resolución con timestamp de bucket >= since_ts (alineado
+    al bucket que contiene since_ts). El bucket en curso se incluye parcial.
+
+    Returns:
+        {worker: [{"timestamp", "samples", campo: {min, avg, max, p95}}, ...]}
+    """
+    seconds = RESOLUTIONS[resolution][0]
+    since_bucket = int(since_ts // seconds) * seconds
+    result = {}
+    with _lock:
+        keys = {key for key in list(_closed) + list(_open) if key[0] == resolution}
+        for _, worker in keys:
+            points = [
+                p for p in _closed.get((resolution, worker), ())
+                if p["timestamp"] >= since_bucket and (until_ts is None or p["timestamp"] <= until_ts)
+            ]
+            bucket = _open.get((resolution, worker))
+            if bucket and bucket["start"] >= since_bucket and (until_ts is None or bucket["start"] <= until_ts):
+                points.append(_summarize(bucket))
+            if points:
+                result[worker] = points
+    return result
+
+
+def pick_resolution(window_seconds, max_points, raw_interval):
+    """
+    Resolución más fina cuyo número de puntos por serie entra en max_points.
+    "raw" si las muestras crudas ya caben; la más gruesa si ninguna cabe.
+    """
+    if window_seconds / raw_interval <= max_points:
+        return "raw"
+    for resolution, (seconds, retention) in sorted(RESOLUTIONS.items(), key=lambda item: item[1][0]):
+        if window_seconds / seconds <= max_points and window_seconds <= seconds * retention:
+            return resolution
+    return max(RESOLUTIONS, key=lambda r: RESOLUTIONS[r][0])
+
+
+def status():
+    with _lock:
+        return {
+            resolution: {
+                "bucket_seconds": seconds,
+                "retention_buckets": retention,
+                "workers": len({w for (r, w) in _open if r == resolution}),
+            }
+            for resolution, (seconds, retention) in RESOLUTIONS.items()
+        }
+
+
+# ======================================
+# LTTB
+# ======================================
+def lttb_indices(xs, ys, threshold):
+    """
+    Índices de los puntos que conserva LTTB al reducir (xs, ys) a threshold
+    puntos. Siempre incluye el primero y el último.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+
+    for i in range(threshold - 2):
+        # Promedio del bucket siguiente (tercer vértice del triángulo)
+        next_start = int(math.floor((i + 1) * every)) + 1
+        next_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        span = max(next_end - next_start, 1)
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        # Punto del bucket actual que forma el triángulo de mayor área
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
@@ -0,0 +1,424 @@
+"""
+Almacén local de series de tiempo para las métricas del collector.
+
+Formato en disco (un segmento por día, hora de Lima):
+    metrics_YYYY-MM-DD.tsdb          → header + registros binarios de ancho fijo (append-only)
+    metrics_YYYY-MM-DD.strings.jsonl → diccionario de strings (worker, ip, slices) [id, "texto"]
+
+Cada registro = timestamp (epoch) + ids de strings + campos numéricos, así que
+el registro k está en HEADER_SIZE + k * RECORD.size: una consulta por rango
+busca el offset inicial en un índice disperso y lee solo lo que necesita.
+
+Los registros se agregan en orden de timestamp salvo el backfill (muestras del
+spool de un daemon que estuvo sin conexión). Para esos casos el índice guarda el
+máximo acumulado y el segmento cuenta sus registros atrasados: mientras haya
+alguno, las lecturas no cortan en end_ts y se ordenan antes de devolverse.
+
+En memoria se guarda además un ring buffer por worker con las muestras recientes.
+"""
+import csv
+import io
+import json
+import os
+import struct
+import threading
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+LIMA_TZ = ZoneInfo("America/Lima")
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+TS_RING_SIZE = int(os.getenv("TS_RING_SIZE", "360"))            # muestras por worker (360 x 10s = 1h)
+TS_INDEX_STRIDE = int(os.getenv("TS_INDEX_STRIDE", "64"))       # 1 entrada de índice cada N registros
+
+# Columnas del CSV histórico (mismo orden que guardar_metricas_snapshot)
+CSV_FIELDS = [
+    'timestamp', 'worker_nombre', 'worker_ip',
+    'cpu_total', 'ram_total_gb', 'storage_total_gb',
+    'cpu_utilizado_bd', 'ram_utilizado_bd_gb', 'storage_utilizado_bd_gb',
+    'instancias_running', 'slices_detalle',
+    'cpu_percent_sistema', 'ram_percent_sistema', 'disk_percent_sistema',
+    'ram_sistema_gb', 'disk_free_gb', 'qemu_count'
+]
+STRING_FIELDS = ['worker_nombre', 'worker_ip', 'slices_detalle']
+NUMERIC_FIELDS = [f for f in CSV_FIELDS if f != 'timestamp' and f not in STRING_FIELDS]
+INT_FIELDS = {'cpu_total', 'instancias_running', 'qemu_count'}
+
+MAGIC = b"TSDB"
+VERSION = 1
+HEADER = struct.Struct("<4sHH8x")                     # magic, versión, tamaño de registro
+HEADER_SIZE = HEADER.size
+RECORD = struct.Struct("<d3I" + "d" * len(NUMERIC_FIELDS))
+
+
+class _Segment:
+    """Un día: archivo binario + diccionario de strings + índice disperso (ts, nº de registro)"""
+
+    def __init__(self, directory, fecha):
+        self.fecha = fecha
+        self.path = Path(directory) / f"metrics_{fecha}.tsdb"
+        self.strings_path = Path(directory) / f"metrics_{fecha}.strings.jsonl"
+        self.strings = []
+        self.string_ids = {}
+        self.index = []          # [(máximo ts hasta record_no, record_no)] cada TS_INDEX_STRIDE registros
+        self.count = 0
+        self.last_ts = 0.0       # máximo timestamp escrito
+        self.late = 0            # registros escritos con ts menor que uno anterior
+        self._load()
+
+    def _load(self):
+        if self.strings_path.exists():
+            with open(self.strings_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        string_id, value = json.loads(line)
+                        self.strings.append(value)
+                        self.string_ids[value] = string_id
+
+        if not self.path.exists():
+            with open(self.path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            return
+
+        size = self.path.stat().st_size
+        with open(self.path, "rb") as f:
+            magic, version, record_size = HEADER.unpack(f.read(HEADER_SIZE))
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f"Segmento incompatible: {self.path}")
+
+            # Un registro parcial (corte a mitad de escritura) se descarta
+            self.count = (size - HEADER_SIZE) // RECORD.size
+            record_no = 0
+            while record_no < self.count:
+                data = f.read(min(self.count - record_no, 1024) * RECORD.size)
+                for offset in range(0, len(data), RECORD.size):
+                    ts = struct.unpack_from("<d", data, offset)[0]
+                    if ts < self.last_ts:
+                        self.late += 1
+                    else:
+                        self.last_ts = ts
+                    if record_no % TS_INDEX_STRIDE == 0:
+                        self.index.append((self.last_ts, record_no))
+                    record_no += 1
+
+        expected = HEADER_SIZE + self.count * RECORD.size
+        if size != expected:
+            with open(self.path, "r+b") as f:
+                f.truncate(expected)
+
+    def intern(self, value, pending):
+        value = str(value if value is not None else "")
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = string_id
+            pending.append([string_id, value])
+        return string_id
+
+    def offset_for(self, start_ts):
+        """Nº de registro desde donde leer para ts >= start_ts (índice disperso)"""
+        pos = bisect_right(self.index, (start_ts, -1)) - 1
+        return self.index[pos][1] if pos >= 0 else 0
+
+    def decode(self, raw):
+        values = RECORD.unpack(raw)
+        row = {'timestamp': values[0]}
+        for field, string_id in zip(STRING_FIELDS, values[1:4]):
+            row[field] = self.strings[string_id] if string_id < len(self.strings) else ""
+        for field, value in zip(NUMERIC_FIELDS, values[4:]):
+            row[field] = int(value) if field in INT_FIELDS else value
+        return row
+
+
+# ======================================
+# ESTADO DEL STORE
+# ======================================
+_base_dir = None
+_segments = {}
+_lock = threading.Lock()
+_rings = {}
+
+
+def init_store(directory):
+    """Abre el segmento del día y precarga el ring buffer desde disco"""
+    global _base_dir
+    _base_dir = Path(directory)
+    _base_dir.mkdir(parents=True, exist_ok=True)
+
+    fecha = datetime.now(LIMA_TZ).strftime("%Y-%m-%d")
+    segment = _segment(fecha)
+    start = max(0, segment.count - TS_RING_SIZE * 16)
+    for row in _scan(segment, start, segment.count):
+        _ring_insert(_ring(row['worker_nombre']), row)
+    print(f"🗄️ TS store listo: {segment.path.name} ({segment.count} registros)")
+
+
+def _segment(fecha):
+    with _lock:
+        segment = _segments.get(fecha)
+        if segment is None:
+            segment = _Segment(_base_dir, fecha)
+            _segments[fecha] = segment
+        return segment
+
+
+def _ring(worker):
+    ring = _rings.get(worker)
+    if ring is None:
+        ring = _rings[worker] = deque(maxlen=TS_RING_SIZE)
+    return ring
+
+
+def _ring_insert(ring, row):
+    """Agrega al ring en orden de timestamp (una fila de backfill va a su posición)"""
+    if not ring or row['timestamp'] >= ring[-1]['timestamp']:
+        ring.append(row)
+        return
+    pos = len(ring)
+    while pos > 0 and ring[pos - 1]['timestamp'] > row['timestamp']:
+        pos -= 1
+    if len(ring) == ring.maxlen:
+        if pos == 0:
+            return  # más vieja que todo el ring lleno
+        ring.popleft()
+        pos -= 1
+    ring.insert(pos, row)
+
+
+def append_snapshot(ts, rows):
+    """
+    Agrega las filas de un snapshot (dicts con las columnas de CSV_FIELDS,
+    sin 'timestamp') con el mismo timestamp epoch ts. Una sola escritura por snapshot.
+    """
+    if not rows:
+        return None
+
+    fecha = datetime.fromtimestamp(ts, LIMA_TZ).strftime("%Y-%m-%d")
+    segment = _segment(fecha)
+
+    with _lock:
+        pending_strings = []
+        buf = bytearray()
+        for row in rows:
+            ids = [segment.intern(row.get(field), pending_strings) for field in STRING_FIELDS]
+            nums = [float(row.get(field) or 0) for field in NUMERIC_FIELDS]
+            buf += RECORD.pack(ts, *ids, *nums)
+
+        # El diccionario se escribe antes que los registros que lo referencian
+        if pending_strings:
+            with open(segment.strings_path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in pending_strings))
+
+        with open(segment.path, "ab") as f:
+            f.write(buf)
+
+        first = segment.count
+        segment.count += len(rows)
+        if ts < segment.last_ts:
+            segment.late += len(rows)
+        segment.last_ts = max(segment.last_ts, ts)
+        next_indexed = -(-first // TS_INDEX_STRIDE) * TS_INDEX_STRIDE
+        for record_no in range(next_indexed, segment.count, TS_INDEX_STRIDE):
+            segment.index.append((segment.last_ts, record_no))
+
+        for row in rows:
+            _ring_insert(_ring(row.get('worker_nombre', '')), {**row, 'timestamp': ts})
+
+    return str(segment.path)
+
+
+def _scan(segment, first, last, start_ts=None, end_ts=None, workers=None):
+    """Lee registros [first, last) del segmento filtrando por tiempo y worker"""
+    if first >= last:
+        return
+    with open(segment.path, "rb") as f:
+        f.seek(HEADER_SIZE + first * RECORD.size)
+        remaining = last - first
+        while remaining > 0:
+            batch = min(remaining, 1024)
+            data = f.read(batch * RECORD.size)
+            remaining -= batch
+            for offset in range(0, len(data) - RECORD.size + 1, RECORD.size):
+                ts = struct.unpack_from("<d", data, offset)[0]
+                if start_ts is not None and ts < start_ts:
+                    continue
+                if end_ts is not None and ts > end_ts:
+                    if not segment.late:
+                        return
+                    continue
+                row = segment.decode(data[offset:offset + RECORD.size])
+                if workers and row['worker_nombre'] not in workers:
+                    continue
+                yield row
+
+
+def query_range(start_ts, end_ts=None, workers=None):
+    """Itera filas con start_ts <= ts <= end_ts (epoch), recorriendo los días necesarios"""
+    end_ts = end_ts if end_ts is not None else datetime.now(LIMA_TZ).timestamp() + 1
+    for fecha in days_between(start_ts, end_ts):
+        if not segment_exists(fecha):
+            continue
+        segment = _segment(fecha)
+        with _lock:
+            last = segment.count
+            late = segment.late
+        rows = _scan(segment, segment.offset_for(start_ts), last, start_ts, end_ts, workers)
+        if late:
+            rows = sorted(rows, key=lambda row: row['timestamp'])
+        yield from rows
+
+
+def recent(worker=None, since_ts=None):
+    """Muestras del ring buffer (más recientes en memoria), opcionalmente desde since_ts"""
+    with _lock:
+        rings = {worker: _rings.get(worker, ())} if worker else dict(_rings)
+        return {
+            name: [row for row in ring if since_ts is None or row['timestamp'] >= since_ts]
+            for name, ring in rings.items()
+        }
+
+
+def ring_oldest_ts():
+    """Timestamp más antiguo que cubren todos los ring buffers (None si están vacíos)"""
+    with _lock:
+        oldest = [ring[0]['timestamp'] for ring in _rings.values() if ring]
+    return max(oldest) if oldest else None
+
+
+def latest(n=10):
+    """Últimas n filas del segmento más reciente"""
+    days = available_days()
+    if not days:
+        return None, []
+    segment = _segment(days[0])
+    with _lock:
+        last = segment.count
+    return segment, list(_scan(segment, max(0, last - n), last))
+
+
+def segment_exists(fecha):
+    return (_base_dir / f"metrics_{fecha}.tsdb").exists()
+
+
+def available_days():
+    """Fechas con segmento, de la más reciente a la más antigua"""
+    return sorted((p.stem.replace("metrics_", "") for p in _base_dir.glob("metrics_*.tsdb")), reverse=True)
+
+
+def segment_info(fecha):
+    segment = _segment(fecha)
+    with _lock:
+        return {
+            "fecha": fecha,
+            "registros": segment.count,
+            "tamano_kb": round(segment.path.stat().st_size / 1024, 2),
+            "ruta": str(segment.path)
+        }
+
+
+def day_bounds(fecha):
+    """Cantidad de registros y primer/último timestamp de un día"""
+    segment = _segment(fecha)
+    with _lock:
+        return {
+            "count": segment.count,
+            "oldest_ts": segment.index[0][0] if segment.index else None,
+            "newest_ts": segment.last_ts if segment.count else None
+        }
+
+
+def days_between(start_ts, end_ts):
+    start = datetime.fromtimestamp(start_ts, LIMA_TZ).date()
+    end = datetime.fromtimestamp(end_ts, LIMA_TZ).date()
+    days = []
+    while start <= end:
+        days.append(start.strftime("%Y-%m-%d"))
+        start = start.fromordinal(start.toordinal() + 1)
+    return days
+
+
+# ======================================
+# EXPORTACIÓN CSV (compatibilidad)
+# ======================================
+def format_ts(ts):
+    return datetime.fromtimestamp(ts, LIMA_TZ).strftime(TS_FORMAT)
+
+
+def to_csv_row(row):
+    return {**row, 'timestamp': format_ts(row['timestamp'])}
+
+
+def iter_csv(rows, fields=None, header=True):
+    """Genera el CSV línea a línea (mismo formato que los CSV diarios)"""
+    fields = fields or CSV_FIELDS
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore')
+    if header:
+        writer.writeheader()
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    for row in rows:
+        writer.writerow(to_csv_row(row))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+
+def export_day_csv(fecha, fields=None, workers=None, header=True):
+    """CSV de un día desde su segmento (opcionalmente solo algunas columnas/workers)"""
+    segment = _segment(fecha)
+    with _lock:
+        last = segment.count
+        late = segment.late
+    rows = _scan(segment, 0, last, workers=workers)
+    if late:
+        rows = sorted(rows, key=lambda row: row['timestamp'])
+    return iter_csv(rows, fields, header)
+
+
+def iter_csv_file(path, fields=None, workers=None, header=True):
+    """Relee un CSV diario fila a fila aplicando proyección y filtro de workers"""
+    fields = fields or CSV_FIELDS
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fields, extrasaction='ignore')
+    if header:
+        writer.writeheader()
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    with open(path, 'rb') as f:
+        # Solo hasta la última línea completa al abrir: el CSV del día puede estar creciendo
+        limite = os.fstat(f.fileno()).st_size
+
+        def lineas_completas():
+            leido = 0
+            for linea in f:
+                leido += len(linea)
+                if leido > limite or not linea.endswith(b"\n"):
+                    return
+                yield linea.decode("utf-8")
+
+        for row in csv.DictReader(lineas_completas()):
+            if workers and row.get('worker_nombre') not in workers:
+                continue
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+
+def write_csv_mirror(path, ts, rows):
+    """Agrega el snapshot al CSV diario (lo leen servicios externos, p.ej. vm_placement)"""
+    path = Path(path)
+    file_exists = path.exists()
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        if not file_exists:
+            writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'timestamp': format_ts(ts)})
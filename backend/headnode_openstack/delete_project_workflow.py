@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Teardown de un proyecto (slice) de OpenStack vía API, sin el CLI.
+
+Reemplaza delete_project.sh: en lugar de un `openstack ... delete` por
+recurso en serie, enumera los recursos del proyecto y los borra en olas
+ordenadas por dependencias, en paralelo dentro de cada ola:
+
+    servidores → puertos → interfaces de router → routers → subredes → redes → proyecto
+
+Devuelve conteos y tiempos por ola en JSON (sin parsear stdout).
+"""
+import sys
+import json
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from openstack_sdk import (
+    http_get,
+    delete_server,
+    delete_port,
+    delete_subnet,
+    delete_network,
+    delete_router,
+    delete_project,
+    remove_router_interface
+)
+from openstack_sf import (
+    get_admin_token,
+    get_project_id_by_name,
+    invalidate_token,
+    KEYSTONE_ENDPOINT,
+    NOVA_ENDPOINT,
+    NEUTRON_ENDPOINT
+)
+
+TEARDOWN_WORKERS = int(os.getenv("TEARDOWN_WORKERS", "10"))
+SERVER_DELETE_TIMEOUT = int(os.getenv("SERVER_DELETE_TIMEOUT", "60"))
+
+# Puertos que Neutron borra solo (con la red/router) o que no se pueden borrar directo
+MANAGED_PORT_OWNERS = ("network:router_interface", "network:router_gateway", "network:dhcp", "network:ha_router")
+
+
+# ================================
+# ENUMERACIÓN
+# ================================
+def _list(url, admin_token, key):
+    """Lista de recursos, o None si la API falló (no es lo mismo que "no hay ninguno")"""
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': admin_token}
+    r = http_get(url, headers=headers)
+    if r.status_code != 200:
+        print(f"⚠️ Error listando {key}: HTTP {r.status_code}")
+        return None
+    return r.json().get(key, [])
+
+
+def listar(name, list_fn, summary):
+    """Enumera una ola; si el listado falla lo registra como error y devuelve None"""
+    items = list_fn()
+    if items is None:
+        summary["errors"].append({"recurso": name, "error": "No se pudo listar (error de la API)"})
+    return items
+
+
+def list_project_servers(admin_token, project_id):
+    return _list(f"{NOVA_ENDPOINT}/servers?all_tenants=1&project_id={project_id}", admin_token, 'servers')
+
+
+def list_project_ports(admin_token, project_id):
+    return _list(f"{NEUTRON_ENDPOINT}/ports?project_id={project_id}", admin_token, 'ports')
+
+
+def list_project_routers(admin_token, project_id):
+    return _list(f"{NEUTRON_ENDPOINT}/routers?project_id={project_id}", admin_token, 'routers')
+
+
+def list_project_subnets(admin_token, project_id):
+    return _list(f"{NEUTRON_ENDPOINT}/subnets?project_id={project_id}", admin_token, 'subnets')
+
+
+def list_project_networks(admin_token, project_id):
+    return _list(f"{NEUTRON_ENDPOINT}/networks?project_id={project_id}", admin_token, 'networks')
+
+
+# ================================
+# OLAS
+# ================================
+def run_wave(name, items, delete_fn, summary):
+    """
+    Ejecuta delete_fn(item) en paralelo. 204/202 = borrado, 404 = ya no existía.
+    Registra conteo, errores y tiempo de la ola en summary.
+    """
+    start = time.time()
+    deleted = 0
+    errors = []
+
+    def safe_delete(item):
+        try:
+            r = delete_fn(item)
+        except Exception as e:
+            return {"recurso": name, "id": item.get("id"), "error": str(e)}
+        if r.status_code in (200, 202, 204, 404):
+            return None
+        return {"recurso": name, "id": item.get("id"), "status": r.status_code, "error": r.text[:200]}
+
+    if items:
+        print(f"🛑 Ola {name}: {len(items)} recurso(s)...")
+        with ThreadPoolExecutor(max_workers=TEARDOWN_WORKERS) as executor:
+            for error in executor.map(safe_delete, items):
+                if error:
+                    errors.append(error)
+                else:
+                    deleted += 1
+
+    summary["details"][name] = deleted
+    summary["timings"][name] = round(time.time() - start, 2)
+    summary["errors"].extend(errors)
+    if items:
+        print(f"✔ {name}: {deleted}/{len(items)} eliminado(s) en {summary['timings'][name]}s")
+    return not errors
+
+
+def wait_servers_gone(admin_token, project_id, timeout):
+    """Los puertos siguen enlazados hasta que Nova termina de borrar la instancia"""
+    start = time.time()
+    interval = 0.5
+    while time.time() - start < timeout:
+        remaining = list_project_servers(admin_token, project_id)
+        if remaining == []:
+            return True
+        time.sleep(interval)
+        interval = min(interval * 1.5, 3)
+    return False
+
+
+# ================================
+# WORKFLOW COMPLETO
+# ================================
+def delete_project_complete(args):
+    """
+    Args:
+        {"project_name": str, "slice_id": int (opcional)}
+
+    Returns:
+        {"success", "project_name", "project_id", "details": {conteos por ola},
+         "timings": {segundos por ola}, "errors": [...]}
+    """
+    project_name = args.get("project_name")
+    slice_id = args.get("slice_id")
+
+    summary = {
+        "success": False,
+        "project_name": project_name,
+        "slice_id": slice_id,
+        "details": {},
+        "timings": {},
+        "errors": []
+    }
+    t0 = time.time()
+
+    if not project_name:
+        summary["error"] = "Falta parámetro: project_name"
+        return summary
+
+    try:
+        admin_token = get_admin_token()
+        if not admin_token:
+            summary["error"] = "No se pudo obtener token de admin"
+            return summary
+
+        print(f"🔍 Obteniendo ID del proyecto '{project_name}'...")
+        project_id = get_project_id_by_name(admin_token, project_name)
+        if not project_id:
+            print(f"ℹ️ Proyecto '{project_name}' no encontrado (posiblemente ya eliminado)")
+            summary["success"] = True
+            summary["not_found"] = True
+            summary["message"] = f"Proyecto {project_name} no existe (posiblemente ya eliminado)"
+            return summary
+        summary["project_id"] = project_id
+
+        # 1. Servidores (y esperar a que desaparezcan: liberan sus puertos)
+        servers = listar("instancias", lambda: list_project_servers(admin_token, project_id), summary)
+        if servers is not None:
+            run_wave("instancias_eliminadas", servers,
+                     lambda s: delete_server(NOVA_ENDPOINT, admin_token, s["id"]), summary)
+            if servers and not wait_servers_gone(admin_token, project_id, SERVER_DELETE_TIMEOUT):
+                summary["errors"].append({"recurso": "instancias", "error": f"Instancias siguen presentes tras {SERVER_DELETE_TIMEOUT}s"})
+
+        if summary["errors"]:
+            # Sin confirmar que no quedan instancias no se tocan sus puertos ni redes
+            summary["error"] = "No se pudo confirmar la eliminación de las instancias; teardown detenido"
+            summary["details"]["proyecto_eliminado"] = False
+            print(f"⚠️ {summary['error']}")
+            return summary
+
+        # 2. Puertos propios (los de router/DHCP los gestiona Neutron)
+        ports = listar("puertos", lambda: list_project_ports(admin_token, project_id), summary) or []
+        own_ports = [p for p in ports if not p.get("device_owner", "").startswith(MANAGED_PORT_OWNERS)]
+        run_wave("puertos_eliminados", own_ports,
+                 lambda p: delete_port(NEUTRON_ENDPOINT, admin_token, p["id"]), summary)
+
+        # 3. Interfaces de router (una por subnet conectada)
+        interfaces = [
+            {"id": p["device_id"], "subnet_id": ip["subnet_id"]}
+            for p in ports if p.get("device_owner") == "network:router_interface"
+            for ip in p.get("fixed_ips", [])
+        ]
+        run_wave("interfaces_router_eliminadas", interfaces,
+                 lambda i: remove_router_interface(NEUTRON_ENDPOINT, admin_token, i["id"], i["subnet_id"]), summary)
+
+        # 4. Routers (el gateway externo se libera con el router)
+        routers = listar("routers", lambda: list_project_routers(admin_token, project_id), summary) or []
+        run_wave("routers_eliminados", routers,
+                 lambda r: delete_router(NEUTRON_ENDPOINT, admin_token, r["id"]), summary)
+
+        # 5. Subredes
+        subnets = listar("subredes", lambda: list_project_subnets(admin_token, project_id), summary) or []
+        run_wave("subredes_eliminadas", subnets,
+                 lambda s: delete_subnet(NEUTRON_ENDPOINT, admin_token, s["id"]), summary)
+
+        # 6. Redes (borra también los puertos DHCP)
+        networks = listar("redes", lambda: list_project_networks(admin_token, project_id), summary) or []
+        run_wave("redes_eliminadas", networks,
+                 lambda n: delete_network(NEUTRON_ENDPOINT, admin_token, n["id"]), summary)
+
+        # 7. Proyecto (solo si todo lo anterior quedó limpio)
+        if summary["errors"]:
+            summary["error"] = f"{len(summary['errors'])} recurso(s) no se pudieron eliminar; proyecto conservado"
+            summary["details"]["proyecto_eliminado"] = False
+            print(f"⚠️ {summary['error']}")
+        else:
+            start = time.time()
+            r = delete_project(KEYSTONE_ENDPOINT, admin_token, project_id)
+            summary["timings"]["proyecto"] = round(time.time() - start, 2)
+            summary["details"]["proyecto_eliminado"] = r.status_code in (204, 404)
+            invalidate_token(f"project:{project_id}")
+
+            if summary["details"]["proyecto_eliminado"]:
+                summary["success"] = True
+                summary["message"] = f"Proyecto {project_name} eliminado completamente"
+                print(f"🎉 Proyecto '{project_name}' eliminado completamente.")
+            else:
+                summary["error"] = f"No se pudo eliminar el proyecto: HTTP {r.status_code}"
+                print(f"⚠ {summary['error']}")
+
+    except Exception as e:
+        summary["error"] = f"Excepción durante teardown: {str(e)}"
+        summary["exception"] = str(type(e).__name__)
+        import traceback
+        summary["traceback"] = traceback.format_exc()
+        print(f"\n❌ ERROR: {summary['error']}")
+
+    finally:
+        summary["timings"]["total_s"] = round(time.time() - t0, 2)
+
+    return summary
+
+# ================================
+# MAIN - PUNTO DE ENTRADA
+# ================================
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        args_json = sys.argv[1]
+    else:
+        args_json = sys.stdin.read()
+
+    try:
+        args = json.loads(args_json)
+        result = delete_project_complete(args)
+        print(json.dumps(result))
+
+    except json.JSONDecodeError as e:
+        print(json.dumps({"success": False, "error": f"Invalid JSON input: {str(e)}"}))
+        sys.exit(1)
+
+    except Exception as e:
+        print(json.dumps({"success": False, "error": f"Unhandled exception: {str(e)}"}))
+        sys.exit(1)
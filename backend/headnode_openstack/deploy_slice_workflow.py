@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Despliegue de un slice completo en OpenStack en dos fases.
+
+FASE 1 (una vez por slice):
+    token admin → proyecto → rol → token del proyecto (secuencial)
+    flavors únicos + redes/subnets únicas + red externa (en paralelo)
+    puertos de todas las VMs en un solo POST /ports (bulk)
+
+FASE 2 (por VM, con más concurrencia):
+    instancia → espera ACTIVE → topología → consola
+
+Así el proyecto, las redes y los flavors se crean una sola vez y las VMs
+del mismo slice ya no compiten por crearlos.
+"""
+import sys
+import json
+import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from openstack_sf import (
+    get_admin_token,
+    get_token_for_project,
+    create_os_project,
+    assign_admin_role_over_os_project,
+    create_os_network,
+    create_os_subnet,
+    create_os_ports_bulk
+)
+from flavor_manager import get_or_create_flavor
+from deploy_vm_workflow import check_network_exists, find_external_network, launch_vm_instance
+
+# Concurrencia de cada fase (fase 2 domina el tiempo total: esperar ACTIVE)
+SLICE_SHARED_WORKERS = int(os.getenv("SLICE_SHARED_WORKERS", "6"))
+SLICE_VM_WORKERS = int(os.getenv("SLICE_VM_WORKERS", "10"))
+
+
+# ================================
+# HELPERS
+# ================================
+def _flavor_key(flavor_spec):
+    """Flavors equivalentes (mismas cpus/ram/disco) se resuelven una sola vez"""
+    return (
+        flavor_spec.get("cpus"),
+        int(float(flavor_spec.get("ram_gb", 0)) * 1024),
+        int(float(flavor_spec.get("disk_gb", 0)))
+    )
+
+
+def _vm_networks(slice_id, vm):
+    """
+    Redes que necesita una VM: [(network_name, subnet_name, cidr, port_suffix, meta)].
+    Sin redes definidas se usa la red por defecto del slice (igual que deploy_vm_complete).
+    """
+    redes = vm.get("redes") or []
+    if not redes:
+        return [(
+            f"net_slice_{slice_id}_default",
+            f"subnet_slice_{slice_id}_default",
+            "10.0.1.0/24",
+            "default",
+            {"tipo": "default"}
+        )]
+
+    return [(
+        red["nombre"],
+        f"subnet_{red['enlace_id']}",
+        red["cidr"],
+        f"link_{red['enlace_id']}",
+        {"enlace_id": red["enlace_id"], "tipo": "enlace"}
+    ) for red in redes]
+
+
+def ensure_network(project_token, network_name, subnet_name, cidr):
+    """Reutiliza la red si ya existe (reintentos del slice) o la crea con su subnet"""
+    existing = check_network_exists(project_token, network_name)
+    if existing:
+        print(f"♻️ Red {network_name} ya existe, reutilizando...")
+        return existing
+
+    print(f"🌐 Creando red {network_name} (CIDR: {cidr})...")
+    network_id = create_os_network(project_token, network_name)
+    if not network_id:
+        return {"error": f"No se pudo crear red {network_name}"}
+
+    subnet_id = create_os_subnet(project_token, subnet_name, network_id, cidr)
+    if not subnet_id:
+        return {"error": f"No se pudo crear subnet {subnet_name}"}
+
+    return {"network_id": network_id, "subnet_id": subnet_id}
+
+
+# ================================
+# FASE 2: INSTANCIA POR VM
+# ================================
+def deploy_vm_phase2(slice_id, vm, vm_ports, shared):
+    """Crea el servidor de una VM con los puertos ya creados en bulk (vm_ports, orden de _vm_networks)"""
+    vm_name = vm.get("nombre_vm")
+    salida_internet = vm.get("salidainternet", False)
+
+    result = {
+        "success": False,
+        "slice_id": slice_id,
+        "nombre_vm": vm_name,
+        "vm_id": vm.get("vm_id"),
+        "project_id": shared["project_id"],
+        "steps_completed": []
+    }
+    start = time.time()
+
+    try:
+        flavor = shared["flavors"][_flavor_key(vm["flavor_spec"])]
+        result["flavor_id"] = flavor["flavor_id"]
+        result["flavor_created"] = flavor.get("created", False)
+
+        ports = []
+        networks = []
+        for (network_name, _, cidr, port_suffix, meta), port_id in zip(_vm_networks(slice_id, vm), vm_ports):
+            net = shared["networks"][network_name]
+            if not port_id:
+                result["error"] = f"No se pudo crear puerto port_{vm_name}_{port_suffix}"
+                return result
+
+            ports.append(port_id)
+            if not any(n["network_id"] == net["network_id"] for n in networks):
+                networks.append({"network_id": net["network_id"], "subnet_id": net["subnet_id"], "cidr": cidr, **meta})
+
+        result["networks"] = networks
+        result["ports"] = ports
+        result["steps_completed"].append(f"ports_created_{len(ports)}")
+
+        if not launch_vm_instance(result, vm_name, vm["imagen_id"], flavor["flavor_id"], ports,
+                                  shared["project_id"], shared["project_token"], shared["admin_token"],
+                                  vm.get("target_host"), salida_internet, shared.get("external_net_id")):
+            return result
+
+        result["success"] = True
+        result["message"] = f"VM {vm_name} desplegada exitosamente en OpenStack"
+
+    except Exception as e:
+        result["error"] = f"Excepción desplegando {vm_name}: {str(e)}"
+        result["exception"] = str(type(e).__name__)
+        import traceback
+        result["traceback"] = traceback.format_exc()
+        print(f"\n❌ ERROR: {result['error']}")
+
+    finally:
+        result["elapsed_s"] = round(time.time() - start, 2)
+
+    return result
+
+
+# ================================
+# WORKFLOW COMPLETO DEL SLICE
+# ================================
+def deploy_slice_complete(args):
+    """
+    Args:
+        {"slice_id": int, "vms": [{"nombre_vm", "vm_id", "imagen_id", "flavor_spec",
+                                   "redes", "salidainternet", "target_host"}, ...]}
+
+    Returns:
+        {"success", "project_id", "vms": [resultado por VM], "timings"}
+    """
+    slice_id = args.get("slice_id")
+    vms = args.get("vms", [])
+
+    result = {
+        "success": False,
+        "slice_id": slice_id,
+        "vms": [],
+        "steps_completed": [],
+        "timings": {}
+    }
+    t0 = time.time()
+
+    if not slice_id or not vms:
+        result["error"] = "Faltan parámetros: slice_id, vms"
+        return result
+
+    try:
+        # ================================
+        # FASE 1a: PROYECTO (secuencial, cada paso depende del anterior)
+        # ================================
+        print("🔑 Obteniendo token de admin...")
+        admin_token = get_admin_token()
+        if not admin_token:
+            result["error"] = "No se pudo obtener token de admin"
+            return result
+        result["steps_completed"].append("admin_token_obtained")
+
+        project_name = f"slice_{slice_id}"
+        print(f"📦 Creando/obteniendo proyecto {project_name}...")
+        project_id = create_os_project(admin_token, project_name, f"Proyecto para slice {slice_id}")
+        if not project_id:
+            result["error"] = f"No se pudo crear proyecto {project_name}"
+            return result
+        result["project_id"] = project_id
+        result["steps_completed"].append("project_created")
+
+        print("👤 Asignando rol admin al proyecto...")
+        if not assign_admin_role_over_os_project(admin_token, project_id):
+            result["error"] = "No se pudo asignar rol admin"
+            return result
+        result["steps_completed"].append("admin_role_assigned")
+
+        print("🔑 Obteniendo token del proyecto...")
+        project_token = get_token_for_project(project_id, admin_token)
+        if not project_token:
+            result["error"] = "No se pudo obtener token del proyecto"
+            return result
+        result["steps_completed"].append("project_token_obtained")
+        result["timings"]["project_s"] = round(time.time() - t0, 2)
+
+        # ================================
+        # FASE 1b: FLAVORS, REDES Y RED EXTERNA (en paralelo)
+        # ================================
+        t1 = time.time()
+        flavor_specs = {}
+        for vm in vms:
+            flavor_specs.setdefault(_flavor_key(vm["flavor_spec"]), vm["flavor_spec"])
+
+        network_specs = {}
+        for vm in vms:
+            for network_name, subnet_name, cidr, _, _ in _vm_networks(slice_id, vm):
+                network_specs.setdefault(network_name, (subnet_name, cidr))
+
+        needs_internet = any(vm.get("salidainternet") for vm in vms)
+
+        print(f"⚙️ Fase 1: {len(flavor_specs)} flavor(s), {len(network_specs)} red(es)"
+              f"{', red externa' if needs_internet else ''}")
+
+        with ThreadPoolExecutor(max_workers=SLICE_SHARED_WORKERS) as executor:
+            flavor_futures = {
+                key: executor.submit(get_or_create_flavor, admin_token, spec)
+                for key, spec in flavor_specs.items()
+            }
+            network_futures = {
+                name: executor.submit(ensure_network, project_token, name, subnet_name, cidr)
+                for name, (subnet_name, cidr) in network_specs.items()
+            }
+            external_future = executor.submit(find_external_network, admin_token) if needs_internet else None
+
+            flavors = {key: f.result() for key, f in flavor_futures.items()}
+            networks = {name: f.result() for name, f in network_futures.items()}
+            external_net_id = external_future.result() if external_future else None
+
+        for key, flavor in flavors.items():
+            if "error" in flavor:
+                result["error"] = f"Error con flavor {flavor_specs[key]}: {flavor['error']}"
+                return result
+        for name, net in networks.items():
+            if "error" in net:
+                result["error"] = net["error"]
+                return result
+
+        result["flavors"] = {flavor["name"]: flavor["flavor_id"] for flavor in flavors.values()}
+        result["networks"] = {name: net["network_id"] for name, net in networks.items()}
+        result["steps_completed"].append("shared_resources_ready")
+        result["timings"]["shared_resources_s"] = round(time.time() - t1, 2)
+        print(f"✅ Fase 1 completada en {time.time() - t0:.1f}s")
+
+        shared = {
+            "admin_token": admin_token,
+            "project_id": project_id,
+            "project_token": project_token,
+            "flavors": flavors,
+            "networks": networks,
+            "external_net_id": external_net_id
+        }
+
+        # ================================
+        # FASE 1c: PUERTOS DE TODAS LAS VMS (un solo POST /ports)
+        # ================================
+        t_ports = time.time()
+        port_specs = []
+        for vm in vms:
+            for network_name, _, _, port_suffix, _ in _vm_networks(slice_id, vm):
+                port_specs.append({
+                    "name": f"port_{vm['nombre_vm']}_{port_suffix}",
+                    "network_id": networks[network_name]["network_id"]
+                })
+
+        port_ids = create_os_ports_bulk(project_token, port_specs, project_id)
+
+        # Repartir los IDs por VM en el mismo orden en que se generaron los specs
+        ports_by_vm = []
+        offset = 0
+        for vm in vms:
+            n_ports = len(_vm_networks(slice_id, vm))
+            ports_by_vm.append(port_ids[offset:offset + n_ports])
+            offset += n_ports
+
+        result["steps_completed"].append(f"ports_created_{sum(1 for p in port_ids if p)}")
+        result["timings"]["ports_s"] = round(time.time() - t_ports, 2)
+
+        # ================================
+        # FASE 2: INSTANCIAS (por VM)
+        # ================================
+        t2 = time.time()
+        print(f"🚀 Fase 2: desplegando {len(vms)} VM(s) (concurrencia {SLICE_VM_WORKERS})...")
+        with ThreadPoolExecutor(max_workers=SLICE_VM_WORKERS) as executor:
+            result["vms"] = list(executor.map(
+                lambda args: deploy_vm_phase2(slice_id, args[0], args[1], shared),
+                zip(vms, ports_by_vm)
+            ))
+        result["timings"]["vms_s"] = round(time.time() - t2, 2)
+
+        exitosas = sum(1 for r in result["vms"] if r["success"])
+        result["success"] = exitosas == len(vms)
+        result["steps_completed"].append(f"vms_deployed_{exitosas}_of_{len(vms)}")
+        if not result["success"]:
+            result["error"] = f"{len(vms) - exitosas} de {len(vms)} VM(s) fallaron"
+
+        print(f"\n{'🎉' if result['success'] else '⚠️'} Slice {slice_id}: {exitosas}/{len(vms)} VM(s) desplegadas")
+
+    except Exception as e:
+        result["error"] = f"Excepción durante despliegue del slice: {str(e)}"
+        result["exception"] = str(type(e).__name__)
+        import traceback
+        result["traceback"] = traceback.format_exc()
+        print(f"\n❌ ERROR: {result['error']}")
+        print(result["traceback"])
+
+    finally:
+        result["timings"]["total_s"] = round(time.time() - t0, 2)
+
+    return result
+
+# ================================
+# MAIN - PUNTO DE ENTRADA
+# ================================
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        args_json = sys.argv[1]
+    else:
+        args_json = sys.stdin.read()
+
+    try:
+        args = json.loads(args_json)
+        result = deploy_slice_complete(args)
+        print(json.dumps(result))
+
+    except json.JSONDecodeError as e:
+        print(json.dumps({"success": False, "error": f"Invalid JSON input: {str(e)}"}))
+        sys.exit(1)
+
+    except Exception as e:
+        print(json.dumps({"success": False, "error": f"Unhandled exception: {str(e)}"}))
+        sys.exit(1)
@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import json
-import time
 import os
-import requests
 
 from openstack_sf import (
     get_admin_token,
@@ -12,20 +10,21 @@ from openstack_sf import (
     assign_admin_role_over_os_project,
     create_os_network,
     create_os_subnet,
-    create_os_port,
+    create_os_ports_bulk,
     create_os_instance,
     get_console_url,
     get_or_create_router_for_project,
     connect_router_to_subnet
 )
+from openstack_sdk import http_get
 from flavor_manager import get_or_create_flavor
+from instance_tracker import wait_until_active
 
 
 def verify_ports_attached(instance_id, project_token, expected_port_count):
     """
     Verifica que la instancia tenga todos los puertos esperados
     """
-    import requests
     
     ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
     NOVA_PORT = os.getenv("NOVA_PORT")
@@ -38,7 +37,7 @@ def verify_ports_attached(instance_id, project_token, expected_port_count):
     }
     
     try:
-        r = requests.get(url=url, headers=headers, timeout=10)
+        r = http_get(url, headers=headers, timeout=10)
         if r.status_code == 200:
             server = r.json().get('server', {})
             addresses = server.get('addresses', {})
@@ -72,89 +71,12 @@ def wait_for_instance_active(instance_id, project_token, max_wait=60, check_inte
     """
     Espera a que una instancia esté en estado ACTIVE
     Detecta errores de placement y recursos
-    """
-
-    import requests
-    import os
-
-    ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
-    NOVA_PORT = os.getenv("NOVA_PORT")
-    NOVA_ENDPOINT = f'http://{ACCESS_NODE_IP}:{NOVA_PORT}/v2.1'
-
-    url = f"{NOVA_ENDPOINT}/servers/{instance_id}"
-    headers = {
-        'Content-type': 'application/json',
-        'X-Auth-Token': project_token
-    }
-
-    start_time = time.time()
-    elapsed = 0
 
-    print(f"⏳ Esperando a que instancia {instance_id[:8]}... esté ACTIVE...")
-
-    while elapsed < max_wait:
-        try:
-            r = requests.get(url=url, headers=headers, timeout=5)
-
-            if r.status_code == 200:
-                server_info = r.json().get('server', {})
-                status = server_info.get('status', 'UNKNOWN')
-                fault = server_info.get('fault', {})
-
-                print(f"   └─ Estado actual: {status} (esperado: {elapsed:.1f}s)")
-
-                if status == 'ACTIVE':
-                    print(f"✅ Instancia lista en {elapsed:.1f}s")
-                    return {
-                        "ready": True,
-                        "status": status,
-                        "elapsed": elapsed
-                    }
-                    
-                elif status == 'ERROR':
-                    # 🔥 DETECTAR TIPO DE ERROR
-                    error_message = fault.get('message', 'Unknown error')
-                    error_code = fault.get('code', 0)
-                    
-                    print(f"❌ Instancia en ERROR: {error_message}")
-                    
-                    # Detectar errores comunes
-                    is_no_valid_host = any(phrase in error_message.lower() for phrase in [
-                        'no valid host',
-                        'no conductor found',
-                        'insufficient resources',
-                        'not enough hosts'
-                    ])
-                    
-                    return {
-                        "ready": False,
-                        "status": status,
-                        "elapsed": elapsed,
-                        "error": error_message,
-                        "error_code": error_code,
-                        "is_placement_error": is_no_valid_host,
-                        "fault": fault
-                    }
-
-                time.sleep(check_interval)
-                elapsed = time.time() - start_time
-            else:
-                print(f"⚠️ Error consultando estado: HTTP {r.status_code}")
-                time.sleep(check_interval)
-                elapsed = time.time() - start_time
-
-        except Exception as e:
-            print(f"⚠️ Excepción consultando estado: {e}")
-            time.sleep(check_interval)
-            elapsed = time.time() - start_time
-
-    print(f"⏱️ Timeout esperando instancia ({max_wait}s)")
-    return {
-        "ready": False,
-        "status": "TIMEOUT",
-        "elapsed": elapsed,
-        "error": f"Instance not ready after {max_wait}s"
-    }
+    El polling lo hace instance_tracker: un GET /servers/detail por proyecto
+    para todas las VMs pendientes, con backoff adaptativo desde sub-segundo
+    (check_interval se mantiene por compatibilidad).
+    """
+    return wait_until_active(instance_id, project_token, max_wait=max_wait)
 
 def check_network_exists(project_token, network_name):
     """
@@ -163,7 +85,6 @@ def check_network_exists(project_token, network_name):
     Returns:
         dict con network_id y subnet_id o None si no existe
     """
-    import requests
     import os
 
     ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
@@ -176,14 +97,14 @@ def check_network_exists(project_token, network_name):
         'X-Auth-Token': project_token
     }
 
-    r = requests.get(url=url, headers=headers)
+    r = http_get(url, headers=headers)
     if r.status_code == 200:
         networks = r.json().get('networks', [])
         if networks:
             network_id = networks[0]['id']
 
             subnet_url = f"{NEUTRON_ENDPOINT}/subnets?network_id={network_id}"
-            r2 = requests.get(url=subnet_url, headers=headers)
+            r2 = http_get(url=subnet_url, headers=headers)
             if r2.status_code == 200:
                 subnets = r2.json().get('subnets', [])
                 if subnets:
@@ -195,6 +116,158 @@ def check_network_exists(project_token, network_name):
 
     return None
 
+def find_external_network(admin_token):
+    """Busca la primera red router:external=True"""
+    ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
+    NEUTRON_PORT = os.getenv("NEUTRON_PORT")
+    NEUTRON_ENDPOINT = f'http://{ACCESS_NODE_IP}:{NEUTRON_PORT}/v2.0'
+
+    url_ext = f"{NEUTRON_ENDPOINT}/networks?router:external=true"
+    r_ext = http_get(url_ext, headers={'X-Auth-Token': admin_token})
+
+    if r_ext.status_code == 200:
+        nets = r_ext.json().get('networks', [])
+        if nets:
+            print(f"✅ Red externa encontrada: {nets[0]['name']} ({nets[0]['id']})")
+            return nets[0]['id']
+    return None
+
+def launch_vm_instance(result, vm_name, imagen_id, flavor_id, ports, project_id,
+                       project_token, admin_token, target_host=None,
+                       salida_internet=False, external_net_id=None):
+    """
+    Pasos 7 a 11 del despliegue: puerto externo, instancia, espera a ACTIVE,
+    validación de topología y console URL.
+    Escribe el progreso/errores en result y retorna True si la VM quedó lista.
+    """
+    # ================================
+    # PASO 7 y 8: CONECTIVIDAD EXTERNA (MODO DIRECTO VLAN 6)
+    # ================================
+    # Reemplazamos Routers por conexión directa a la red externa
+
+    if salida_internet:
+        print("\n🌐 ========== CONFIGURANDO ACCESO DIRECTO A INTERNET ==========")
+
+        # 1. Buscar la red externa (ahora se llama external_vlan6 o la que creamos)
+        # Buscamos cualquier red que sea router:external=True
+        if not external_net_id:
+            external_net_id = find_external_network(admin_token)
+
+        if external_net_id:
+            # 2. Crear un puerto directo en esa red para esta VM
+            from openstack_sf import create_os_external_port
+            ext_port_id = create_os_external_port(admin_token, external_net_id, project_id, vm_name)
+
+            if ext_port_id:
+                # AGREGAMOS EL PUERTO A LA LISTA DE PUERTOS DE LA VM
+                ports.append(ext_port_id)
+                result["steps_completed"].append("external_port_attached")
+                print(f"✅ Puerto externo {ext_port_id} agregado a la VM")
+
+                result["internet_access"] = {
+                    "enabled": True,
+                    "mode": "direct_attachment",
+                    "network_id": external_net_id
+                }
+            else:
+                print("⚠️ Falló la creación del puerto externo")
+        else:
+            print("⚠️ No se encontró ninguna red externa (router:external=True)")
+
+        print("========================================================\n")
+
+    # ================================
+    # PASO 9: CREAR INSTANCIA
+    # ================================
+    print(f"\n🖥️ Creando instancia {vm_name}...")
+    print(f"   • Imagen: {imagen_id}")
+    print(f"   • Flavor: {flavor_id}")
+    print(f"   • Puertos: {len(ports)}")
+    if target_host:
+        print(f"   • Target Host: {target_host} (Forzando placement)")
+
+    instance_info = create_os_instance(imagen_id, flavor_id, vm_name, ports, project_token, target_host)
+
+    if not instance_info or "server" not in instance_info:
+        result["error"] = "No se pudo crear instancia"
+        return False
+
+    instance_id = instance_info["server"]["id"]
+    result["instance_id"] = instance_id
+    result["instance_info"] = instance_info
+    result["steps_completed"].append("instance_created")
+    print(f"✅ Instancia creada: {instance_id}")
+
+    # ================================
+    # PASO 10: ESPERAR A QUE ESTÉ ACTIVA
+    # ================================
+    wait_result = wait_for_instance_active(instance_id, project_token, max_wait=90, check_interval=3)
+
+    # 🔥 VALIDACIÓN CRÍTICA DE ERRORES
+    if not wait_result["ready"]:
+        error_msg = wait_result.get('error', 'Unknown error')
+
+        # Detectar error de placement
+        if wait_result.get("is_placement_error", False):
+            result["error"] = f"PLACEMENT_ERROR: {error_msg}"
+            result["error_type"] = "NO_VALID_HOST"
+            result["should_rollback"] = True
+            print(f"🚨 ERROR DE PLACEMENT DETECTADO: {error_msg}")
+        else:
+            result["error"] = f"INSTANCE_ERROR: {error_msg}"
+            result["error_type"] = "DEPLOYMENT_FAILED"
+            result["should_rollback"] = True
+            print(f"❌ Error desplegando instancia: {error_msg}")
+
+        result["instance_status"] = wait_result
+        result["instance_id"] = instance_id  # Importante para rollback
+        return False
+
+    result["instance_status"] = wait_result
+    result["steps_completed"].append("instance_active")
+
+    # ================================
+    # PASO 10.5: VALIDAR TOPOLOGÍA
+    # ================================
+    expected_ports = len(ports)
+    print(f"🔍 Validando topología de red ({expected_ports} puertos esperados)...")
+
+    topology_check = verify_ports_attached(instance_id, project_token, expected_ports)
+
+    if not topology_check["valid"]:
+        result["error"] = f"TOPOLOGY_ERROR: {topology_check['error']}"
+        result["error_type"] = "INVALID_TOPOLOGY"
+        result["should_rollback"] = True
+        result["topology_validation"] = topology_check
+        print(f"❌ Topología incorrecta: {topology_check['error']}")
+        return False
+
+    result["topology_validation"] = topology_check
+    result["steps_completed"].append("topology_validated")
+    print(f"✅ Topología validada correctamente")
+
+    # ================================
+    # PASO 11: OBTENER CONSOLE URL
+    # ================================
+    if wait_result["ready"]:
+        print(f"🖥️ Obteniendo URL de consola...")
+        console_url = get_console_url(instance_id, admin_token)
+
+        if console_url:
+            result["console_url"] = console_url
+            result["steps_completed"].append("console_url_obtained")
+            print(f"✅ Console URL obtenida")
+        else:
+            result["console_url"] = None
+            result["warning"] = "No se pudo obtener URL de consola"
+            print("⚠️ No se pudo obtener console_url")
+    else:
+        result["console_url"] = None
+        result["warning"] = "Console URL no disponible - instancia no está ACTIVE"
+        print("⚠️ Saltando obtención de console URL (instancia no lista)")
+
+    return True
+
 def deploy_vm_complete(args):
     """
     Workflow completo de despliegue en OpenStack con soporte para Internet
@@ -295,6 +368,7 @@ def deploy_vm_complete(args):
         networks_created = []
         networks_cache = {}
         subnets_to_connect = []
+        port_specs = []
 
         if not redes:
             print("ℹ️ No hay redes definidas, creando red por defecto...")
@@ -320,14 +394,7 @@ def deploy_vm_complete(args):
                     result["error"] = "No se pudo crear subnet por defecto"
                     return result
 
-            port_name = f"port_{vm_name}_default"
-            port_id = create_os_port(project_token, port_name, network_id, project_id)
-
-            if not port_id:
-                result["error"] = "No se pudo crear puerto por defecto"
-                return result
-
-            ports.append(port_id)
+            port_specs.append({"name": f"port_{vm_name}_default", "network_id": network_id})
             networks_created.append({
                 "network_id": network_id,
                 "subnet_id": subnet_id,
@@ -373,14 +440,7 @@ def deploy_vm_complete(args):
 
                     networks_cache[network_name] = (network_id, subnet_id)
 
-                port_name = f"port_{vm_name}_link_{enlace_id}"
-                port_id = create_os_port(project_token, port_name, network_id, project_id)
-
-                if not port_id:
-                    result["error"] = f"No se pudo crear puerto {port_name}"
-                    return result
-
-                ports.append(port_id)
+                port_specs.append({"name": f"port_{vm_name}_link_{enlace_id}", "network_id": network_id})
 
                 if not any(n["network_id"] == network_id for n in networks_created):
                     networks_created.append({
@@ -394,149 +454,25 @@ def deploy_vm_complete(args):
                     if subnet_id not in subnets_to_connect:
                         subnets_to_connect.append(subnet_id)
 
+        # Todos los puertos de la VM en un solo POST /ports (fallback uno a uno)
+        port_ids = create_os_ports_bulk(project_token, port_specs, project_id)
+        for spec, port_id in zip(port_specs, port_ids):
+            if not port_id:
+                result["error"] = f"No se pudo crear puerto {spec['name']}"
+                return result
+            ports.append(port_id)
+
         result["networks"] = networks_created
         result["ports"] = ports
         result["steps_completed"].append(f"networks_created_{len(networks_created)}")
         print(f"✅ {len(networks_created)} red(es) creada(s), {len(ports)} puerto(s) creado(s)")
-	
-	# ================================
-        # PASO 7 y 8: CONECTIVIDAD EXTERNA (MODO DIRECTO VLAN 6)
-        # ================================
-        # Reemplazamos Routers por conexión directa a la red externa
-        
-        if salida_internet:
-            print("\n🌐 ========== CONFIGURANDO ACCESO DIRECTO A INTERNET ==========")
-            
-            # 1. Buscar la red externa (ahora se llama external_vlan6 o la que creamos)
-            # Buscamos cualquier red que sea router:external=True
-            import requests
-            ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
-            NEUTRON_PORT = os.getenv("NEUTRON_PORT")
-            NEUTRON_ENDPOINT = f'http://{ACCESS_NODE_IP}:{NEUTRON_PORT}/v2.0'
-            
-            url_ext = f"{NEUTRON_ENDPOINT}/networks?router:external=true"
-            r_ext = requests.get(url_ext, headers={'X-Auth-Token': admin_token})
-            
-            external_net_id = None
-            if r_ext.status_code == 200:
-                nets = r_ext.json().get('networks', [])
-                if nets:
-                    external_net_id = nets[0]['id']
-                    print(f"✅ Red externa encontrada: {nets[0]['name']} ({external_net_id})")
-            
-            if external_net_id:
-                # 2. Crear un puerto directo en esa red para esta VM
-                from openstack_sf import create_os_external_port
-                ext_port_id = create_os_external_port(admin_token, external_net_id, project_id, vm_name)
-                
-                if ext_port_id:
-                    # AGREGAMOS EL PUERTO A LA LISTA DE PUERTOS DE LA VM
-                    ports.append(ext_port_id)
-                    result["steps_completed"].append("external_port_attached")
-                    print(f"✅ Puerto externo {ext_port_id} agregado a la VM")
-                    
-                    result["internet_access"] = {
-                        "enabled": True,
-                        "mode": "direct_attachment",
-                        "network_id": external_net_id
-                    }
-                else:
-                    print("⚠️ Falló la creación del puerto externo")
-            else:
-                print("⚠️ No se encontró ninguna red externa (router:external=True)")
-            
-            print("========================================================\n")
-
         # ================================
-        # PASO 9: CREAR INSTANCIA
+        # PASOS 7 a 11: PUERTO EXTERNO, INSTANCIA, ESPERA Y CONSOLA
         # ================================
-        print(f"\n🖥️ Creando instancia {vm_name}...")
-        print(f"   • Imagen: {imagen_id}")
-        print(f"   • Flavor: {flavor_id}")
-        print(f"   • Puertos: {len(ports)}")
-        if target_host:
-                print(f"   • Target Host: {target_host} (Forzando placement)")	
-
-        instance_info = create_os_instance(imagen_id, flavor_id, vm_name, ports, project_token, target_host)        
-
-        if not instance_info or "server" not in instance_info:
-            result["error"] = "No se pudo crear instancia"
-            return result
-	
-        instance_id = instance_info["server"]["id"]
-        result["instance_id"] = instance_id
-        result["instance_info"] = instance_info
-        result["steps_completed"].append("instance_created")
-        print(f"✅ Instancia creada: {instance_id}")
-
-        # ================================
-        # PASO 10: ESPERAR A QUE ESTÉ ACTIVA
-        # ================================
-        wait_result = wait_for_instance_active(instance_id, project_token, max_wait=90, check_interval=3)
-
-        # 🔥 VALIDACIÓN CRÍTICA DE ERRORES
-        if not wait_result["ready"]:
-            error_msg = wait_result.get('error', 'Unknown error')
-        
-            # Detectar error de placement
-            if wait_result.get("is_placement_error", False):
-                result["error"] = f"PLACEMENT_ERROR: {error_msg}"
-                result["error_type"] = "NO_VALID_HOST"
-                result["should_rollback"] = True
-                print(f"🚨 ERROR DE PLACEMENT DETECTADO: {error_msg}")
-            else:
-                result["error"] = f"INSTANCE_ERROR: {error_msg}"
-                result["error_type"] = "DEPLOYMENT_FAILED"
-                result["should_rollback"] = True
-                print(f"❌ Error desplegando instancia: {error_msg}")
-        
-            result["instance_status"] = wait_result
-            result["instance_id"] = instance_id  # Importante para rollback
+        if not launch_vm_instance(result, vm_name, imagen_id, flavor_id, ports, project_id,
+                                  project_token, admin_token, target_host, salida_internet):
             return result
 
-        result["instance_status"] = wait_result
-        result["steps_completed"].append("instance_active")
-
-        # ================================
-        # PASO 10.5: VALIDAR TOPOLOGÍA
-        # ================================
-        expected_ports = len(ports)
-        print(f"🔍 Validando topología de red ({expected_ports} puertos esperados)...")
-
-        topology_check = verify_ports_attached(instance_id, project_token, expected_ports)
-
-        if not topology_check["valid"]:
-            result["error"] = f"TOPOLOGY_ERROR: {topology_check['error']}"
-            result["error_type"] = "INVALID_TOPOLOGY"
-            result["should_rollback"] = True
-            result["topology_validation"] = topology_check	
-            print(f"❌ Topología incorrecta: {topology_check['error']}")
-            return result
-
-        result["topology_validation"] = topology_check
-        result["steps_completed"].append("topology_validated")
-        print(f"✅ Topología validada correctamente")
-
-        # ================================
-        # PASO 11: OBTENER CONSOLE URL
-        # ================================
-        if wait_result["ready"]:
-            print(f"🖥️ Obteniendo URL de consola...")
-            console_url = get_console_url(instance_id, admin_token)
-
-            if console_url:
-                result["console_url"] = console_url
-                result["steps_completed"].append("console_url_obtained")
-                print(f"✅ Console URL obtenida")
-            else:
-                result["console_url"] = None
-                result["warning"] = "No se pudo obtener URL de consola"
-                print("⚠️ No se pudo obtener console_url")
-        else:
-            result["console_url"] = None
-            result["warning"] = "Console URL no disponible - instancia no está ACTIVE"
-            print("⚠️ Saltando obtención de console URL (instancia no lista)")
-
         # ================================
         # PASO 12: ÉXITO
         # ================================
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 import sys
 import json
-import requests
 from openstack_sf import get_admin_token
+from openstack_sdk import http_get, http_post
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,6 +15,18 @@ NOVA_PORT = os.getenv("NOVA_PORT")
 
 NOVA_ENDPOINT = f'http://{ACCESS_NODE_IP}:{NOVA_PORT}/v2.1'
 
+# ================================== ÍNDICE DE FLAVORS ==================================
+# {(vcpus, ram_mb, disk_gb): {"id", "name"}} cargado una vez desde Nova.
+# Resolver un flavor es un lookup en el dict; se resincroniza cada
+# FLAVOR_INDEX_TTL segundos (flavors creados/borrados fuera de este proceso).
+FLAVOR_INDEX_TTL = int(os.getenv("FLAVOR_INDEX_TTL", "300"))
+
+_flavor_index = {}
+_flavor_index_synced_at = 0.0
+_flavor_index_lock = threading.Lock()
+_flavor_sync_lock = threading.Lock()
+_flavor_spec_locks = {}
+
 def list_flavors(token):
     """
     Lista todos los flavors disponibles en OpenStack
@@ -23,11 +37,57 @@ def list_flavors(token):
         'X-Auth-Token': token
     }
     
-    r = requests.get(url=url, headers=headers)
+    r = http_get(url, headers=headers)
     if r.status_code == 200:
         return r.json().get('flavors', [])
     return []
 
+def _flavor_key(cpus, ram_mb, disk_gb):
+    return (int(cpus), int(ram_mb), int(disk_gb))
+
+def _index_flavor(flavor):
+    key = _flavor_key(flavor.get('vcpus', 0), flavor.get('ram', 0), flavor.get('disk', 0))
+    # setdefault: ante duplicados gana el primero que devuelve Nova (como el scan lineal)
+    _flavor_index.setdefault(key, {"id": flavor['id'], "name": flavor.get('name')})
+
+def sync_flavor_index(token, force=False):
+    """
+    Recarga el índice desde Nova si venció el TTL (o si force=True).
+    Single-flight: un solo hilo lista flavors, los demás esperan y reutilizan el índice.
+    """
+    global _flavor_index_synced_at
+
+    if not force and time.time() - _flavor_index_synced_at < FLAVOR_INDEX_TTL:
+        return True
+
+    with _flavor_sync_lock:
+        if not force and time.time() - _flavor_index_synced_at < FLAVOR_INDEX_TTL:
+            return True
+
+        url = f"{NOVA_ENDPOINT}/flavors/detail"
+        headers = {
+            'Content-type': 'application/json',
+            'X-Auth-Token': token
+        }
+        r = http_get(url, headers=headers)
+        if r.status_code != 200:
+            print(f"⚠️ No se pudo sincronizar índice de flavors: HTTP {r.status_code}")
+            return False
+
+        with _flavor_index_lock:
+            _flavor_index.clear()
+            for flavor in r.json().get('flavors', []):
+                _index_flavor(flavor)
+            _flavor_index_synced_at = time.time()
+            print(f"🗂️ Índice de flavors sincronizado ({len(_flavor_index)} specs)")
+        return True
+
+def _spec_lock(key):
+    with _flavor_index_lock:
+        if key not in _flavor_spec_locks:
+            _flavor_spec_locks[key] = threading.Lock()
+        return _flavor_spec_locks[key]
+
 def find_flavor_by_specs(token, cpus, ram_mb, disk_gb):
     """
     Busca un flavor existente que coincida con las especificaciones
@@ -40,14 +100,14 @@ def find_flavor_by_specs(token, cpus, ram_mb, disk_gb):
     Returns:
         flavor_id si existe, None si no
     """
-    flavors = list_flavors(token)
-    
-    for flavor in flavors:
-        if (flavor.get('vcpus') == cpus and 
-            flavor.get('ram') == ram_mb and 
-            flavor.get('disk') == disk_gb):
-            print(f"✅ Flavor existente encontrado: {flavor['name']} (ID: {flavor['id']})")
-            return flavor['id']
+    sync_flavor_index(token)
+
+    with _flavor_index_lock:
+        entry = _flavor_index.get(_flavor_key(cpus, ram_mb, disk_gb))
+
+    if entry:
+        print(f"✅ Flavor existente encontrado: {entry['name']} (ID: {entry['id']})")
+        return entry['id']
     
     return None
 
@@ -83,11 +143,13 @@ def create_flavor(token, name, cpus, ram_mb, disk_gb):
         }
     }
     
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     
     if r.status_code == 200:
         flavor = r.json().get('flavor', {})
         flavor_id = flavor.get('id')
+        with _flavor_index_lock:
+            _index_flavor({**flavor, 'vcpus': cpus, 'ram': ram_mb, 'disk': disk_gb})
         print(f"✅ Flavor creado: {name} (ID: {flavor_id})")
         return flavor_id
     else:
@@ -125,7 +187,7 @@ def get_or_create_flavor(token, flavor_spec):
     
     print(f"🔍 Buscando flavor: {cpus} vCPUs, {ram_mb} MB RAM, {disk_gb_int} GB disco...")
     
-    # Buscar flavor existente
+    # Caso común: lookup en el índice local
     existing_flavor_id = find_flavor_by_specs(token, cpus, ram_mb, disk_gb_int)
     
     if existing_flavor_id:
@@ -135,9 +197,23 @@ def get_or_create_flavor(token, flavor_spec):
             "name": nombre
         }
     
-    # Crear nuevo flavor
-    print(f"🔧 Creando nuevo flavor: {nombre}...")
-    new_flavor_id = create_flavor(token, nombre, cpus, ram_mb, disk_gb_int)
+    # Single-flight por spec: VMs concurrentes con el mismo spec no crean duplicados
+    with _spec_lock(_flavor_key(cpus, ram_mb, disk_gb_int)):
+        # Otro hilo pudo crearlo mientras esperábamos, u otro proceso antes del TTL
+        existing_flavor_id = find_flavor_by_specs(token, cpus, ram_mb, disk_gb_int)
+        if not existing_flavor_id:
+            sync_flavor_index(token, force=True)
+            existing_flavor_id = find_flavor_by_specs(token, cpus, ram_mb, disk_gb_int)
+        if existing_flavor_id:
+            return {
+                "flavor_id": existing_flavor_id,
+                "created": False,
+                "name": nombre
+            }
+
+        # Crear nuevo flavor
+        print(f"🔧 Creando nuevo flavor: {nombre}...")
+        new_flavor_id = create_flavor(token, nombre, cpus, ram_mb, disk_gb_int)
     
     if new_flavor_id:
         return {
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Agente persistente del headnode OpenStack.
+
+Reemplaza el `ssh ... python3 deploy_vm_workflow.py '<json>'` por VM:
+el intérprete, los imports, los tokens y las sesiones HTTP
+quedan calientes entre workflows.
+
+Escucha solo en localhost; el driver llega a través de un túnel SSH
+(ssh -L) sobre la conexión multiplexada.
+
+Uso:
+    nohup python3 headnode_agent.py > headnode_agent.log 2>&1 &
+
+Endpoints:
+    GET  /health                  → estado del agente
+    POST /workflow/<script_name>  → body JSON = args del workflow, respuesta = JSON del workflow
+    POST /jobs/<script_name>      → igual, pero en segundo plano: responde 202 con job_id
+    GET  /jobs/<job_id>           → {"status": "running" | "done", "result": JSON del workflow}
+
+Los jobs son para workflows largos (un slice completo): el driver consulta
+el estado en lugar de mantener un request abierto con un timeout fijo.
+
+Si el request trae el header traceparent, el workflow corre como span hijo
+y los spans vuelven al driver en el campo "spans" del resultado.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from deploy_vm_workflow import deploy_vm_complete
+from deploy_slice_workflow import deploy_slice_complete
+from delete_project_workflow import delete_project_complete
+from openstack_sdk import http_stats
+
+os.environ.setdefault("SERVICE_NAME", "headnode_openstack")
+import tracing
+
+AGENT_HOST = os.getenv("HEADNODE_AGENT_HOST", "127.0.0.1")
+AGENT_PORT = int(os.getenv("HEADNODE_AGENT_PORT", "8765"))
+JOB_TTL_SECONDS = int(os.getenv("HEADNODE_AGENT_JOB_TTL", "3600"))   # jobs terminados se conservan 1h
+
+# Workflows disponibles: mismo nombre de script que usa el driver
+WORKFLOWS = {
+    "deploy_vm_workflow.py": deploy_vm_complete,
+    "deploy_slice_workflow.py": deploy_slice_complete,
+    "delete_project_workflow.py": delete_project_complete,
+}
+
+_stats_lock = threading.Lock()
+_stats = {
+    "started_at": time.time(),
+    "in_flight": 0,
+    "completed": 0,
+    "failed": 0
+}
+
+_jobs_lock = threading.Lock()
+_jobs = {}      # job_id → {"script", "status", "started_at", "finished_at", "result"}
+
+
+def run_workflow(script_name, workflow, args, traceparent=None):
+    """Ejecuta un workflow con el mismo manejo de errores, stats y traza para /workflow y /jobs"""
+    with _stats_lock:
+        _stats["in_flight"] += 1
+
+    start = time.time()
+    spans = []
+    try:
+        if traceparent:
+            # Spans de este request en memoria: el agente no ve el archivo de trazas del driver
+            with tracing.capturando() as spans:
+                with tracing.span(f"agent.{script_name}", parent=traceparent) as span:
+                    result = workflow(args)
+                    if not result.get("success"):
+                        span.status = "error"
+        else:
+            result = workflow(args)
+    except Exception as e:
+        result = {
+            "success": False,
+            "error": f"Unhandled exception: {e}",
+            "traceback": traceback.format_exc()
+        }
+    finally:
+        with _stats_lock:
+            _stats["in_flight"] -= 1
+
+    if spans:
+        result["spans"] = spans
+
+    with _stats_lock:
+        _stats["completed" if result.get("success") else "failed"] += 1
+
+    result["agent_elapsed_s"] = round(time.time() - start, 3)
+    return result
+
+
+def start_job(script_name, workflow, args, traceparent=None):
+    """Lanza el workflow en un hilo propio y devuelve su job_id"""
+    now = time.time()
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        for old_id in [j for j, job in _jobs.items()
+                       if job["finished_at"] and now - job["finished_at"] > JOB_TTL_SECONDS]:
+            del _jobs[old_id]
+        _jobs[job_id] = {"script": script_name, "status": "running",
+                         "started_at": now, "finished_at": None, "result": None}
+
+    def _run():
+        result = run_workflow(script_name, workflow, args, traceparent)
+        with _jobs_lock:
+            _jobs[job_id].update({"status": "done", "finished_at": time.time(), "result": result})
+
+    threading.Thread(target=_run, name=f"job-{job_id[:8]}", daemon=True).start()
+    return job_id
+
+
+class AgentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/jobs/"):
+            job_id = self.path[len("/jobs/"):]
+            with _jobs_lock:
+                job = dict(_jobs[job_id]) if job_id in _jobs else None
+            if job is None:
+                self._send_json(404, {"success": False, "error": f"Job no encontrado: {job_id}"})
+                return
+            job["job_id"] = job_id
+            job["elapsed_s"] = round((job["finished_at"] or time.time()) - job["started_at"], 1)
+            self._send_json(200, job)
+            return
+
+        if self.path != "/health":
+            self._send_json(404, {"success": False, "error": f"Ruta no encontrada: {self.path}"})
+            return
+
+        with _stats_lock:
+            stats = dict(_stats)
+        stats["uptime_s"] = round(time.time() - stats.pop("started_at"), 1)
+        with _jobs_lock:
+            stats["jobs_running"] = sum(1 for job in _jobs.values() if job["status"] == "running")
+        self._send_json(200, {
+            "status": "healthy",
+            "workflows": list(WORKFLOWS.keys()),
+            "stats": stats,
+            "openstack_http": http_stats()
+        })
+
+    def do_POST(self):
+        if self.path.startswith("/workflow/"):
+            script_name = self.path[len("/workflow/"):]
+            as_job = False
+        elif self.path.startswith("/jobs/"):
+            script_name = self.path[len("/jobs/"):]
+            as_job = True
+        else:
+            self._send_json(404, {"success": False, "error": f"Ruta no encontrada: {self.path}"})
+            return
+
+        workflow = WORKFLOWS.get(script_name)
+        if workflow is None:
+            self._send_json(404, {"success": False, "error": f"Workflow no soportado: {script_name}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            args = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"success": False, "error": f"Invalid JSON input: {e}"})
+            return
+
+        traceparent = self.headers.get("traceparent")
+        if as_job:
+            job_id = start_job(script_name, workflow, args, traceparent)
+            self._send_json(202, {"success": True, "job_id": job_id, "status": "running"})
+            return
+
+        self._send_json(200, run_workflow(script_name, workflow, args, traceparent))
+
+    def log_message(self, fmt, *args):
+        print(f"[AGENT] {self.address_string()} - {fmt % args}")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer((AGENT_HOST, AGENT_PORT), AgentHandler)
+    server.daemon_threads = True
+    print(f"🟢 Headnode agent escuchando en {AGENT_HOST}:{AGENT_PORT}")
+    print(f"   Workflows: {', '.join(WORKFLOWS.keys())}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 Agente detenido")
+        server.server_close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Seguimiento de instancias hasta ACTIVE/ERROR con polling en bloque.
+
+En lugar de un GET /servers/{id} cada 3s por VM, un único hilo consulta
+GET /servers/detail una vez por proyecto (token) para todas las instancias
+pendientes y despierta a cada waiter cuando su instancia cambia de estado.
+
+El intervalo es adaptativo: arranca en READINESS_MIN_INTERVAL y crece
+(x READINESS_BACKOFF) hasta READINESS_MAX_INTERVAL mientras nada cambia;
+vuelve al mínimo cuando llega una instancia nueva o alguna transiciona.
+"""
+import os
+import threading
+import time
+import requests
+
+from openstack_sdk import http_get
+
+READINESS_MIN_INTERVAL = float(os.getenv("READINESS_MIN_INTERVAL", "0.5"))
+READINESS_MAX_INTERVAL = float(os.getenv("READINESS_MAX_INTERVAL", "3"))
+READINESS_BACKOFF = float(os.getenv("READINESS_BACKOFF", "1.5"))
+
+PLACEMENT_ERROR_PHRASES = [
+    'no valid host',
+    'no conductor found',
+    'insufficient resources',
+    'not enough hosts'
+]
+
+# {instance_id: {"token", "event", "result", "started_at", "status"}}
+_pending = {}
+_pending_lock = threading.Lock()
+_wakeup = threading.Event()
+_poller = None
+
+
+def _nova_endpoint():
+    ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
+    NOVA_PORT = os.getenv("NOVA_PORT")
+    return f'http://{ACCESS_NODE_IP}:{NOVA_PORT}/v2.1'
+
+
+def _resolve(instance_id, result):
+    """Entrega el resultado al waiter y lo saca de la lista de pendientes"""
+    with _pending_lock:
+        waiter = _pending.pop(instance_id, None)
+    if waiter:
+        waiter["result"] = result
+        waiter["event"].set()
+
+
+def _error_result(server, elapsed):
+    fault = server.get('fault', {})
+    error_message = fault.get('message', 'Unknown error')
+    print(f"❌ Instancia {server['id'][:8]} en ERROR: {error_message}")
+    return {
+        "ready": False,
+        "status": "ERROR",
+        "elapsed": elapsed,
+        "error": error_message,
+        "error_code": fault.get('code', 0),
+        "is_placement_error": any(p in error_message.lower() for p in PLACEMENT_ERROR_PHRASES),
+        "fault": fault
+    }
+
+
+def _poll_once():
+    """
+    Una consulta por token (proyecto) para todas sus instancias pendientes.
+    Retorna True si alguna instancia cambió de estado.
+    """
+    with _pending_lock:
+        by_token = {}
+        for instance_id, waiter in _pending.items():
+            by_token.setdefault(waiter["token"], []).append(instance_id)
+
+    changed = False
+    for token, instance_ids in by_token.items():
+        try:
+            r = http_get(
+                f"{_nova_endpoint()}/servers/detail",
+                headers={'Content-type': 'application/json', 'X-Auth-Token': token},
+                timeout=10
+            )
+        except requests.RequestException as e:
+            print(f"⚠️ Excepción consultando estado: {e}")
+            continue
+
+        if r.status_code != 200:
+            print(f"⚠️ Error consultando estado: HTTP {r.status_code}")
+            continue
+
+        servers = {s['id']: s for s in r.json().get('servers', [])}
+        now = time.time()
+
+        for instance_id in instance_ids:
+            server = servers.get(instance_id)
+            if not server:
+                continue  # aún no visible en el listado
+
+            with _pending_lock:
+                waiter = _pending.get(instance_id)
+            if not waiter:
+                continue
+
+            status = server.get('status', 'UNKNOWN')
+            elapsed = now - waiter["started_at"]
+            if status != waiter["status"]:
+                print(f"   └─ {instance_id[:8]}: {status} ({elapsed:.1f}s)")
+                waiter["status"] = status
+                changed = True
+
+            if status == 'ACTIVE':
+                print(f"✅ Instancia {instance_id[:8]} lista en {elapsed:.1f}s")
+                _resolve(instance_id, {"ready": True, "status": status, "elapsed": elapsed})
+            elif status == 'ERROR':
+                _resolve(instance_id, _error_result(server, elapsed))
+
+    return changed
+
+
+def _poll_loop():
+    interval = READINESS_MIN_INTERVAL
+    while True:
+        with _pending_lock:
+            idle = not _pending
+        if idle:
+            # Sin instancias pendientes: dormir hasta que llegue una
+            _wakeup.wait()
+            _wakeup.clear()
+            interval = READINESS_MIN_INTERVAL
+
+        if _poll_once():
+            interval = READINESS_MIN_INTERVAL
+        else:
+            interval = min(interval * READINESS_BACKOFF, READINESS_MAX_INTERVAL)
+
+        # Una instancia nueva interrumpe la espera y reinicia el backoff
+        if _wakeup.wait(interval):
+            _wakeup.clear()
+            interval = READINESS_MIN_INTERVAL
+
+
+def _ensure_poller():
+    global _poller
+    with _pending_lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = threading.Thread(target=_poll_loop, name="readiness-poller", daemon=True)
+            _poller.start()
+
+
+def wait_until_active(instance_id, project_token, max_wait=60):
+    """
+    Registra la instancia y bloquea hasta ACTIVE, ERROR o timeout.
+    Devuelve el mismo dict que wait_for_instance_active.
+    """
+    waiter = {
+        "token": project_token,
+        "event": threading.Event(),
+        "result": None,
+        "started_at": time.time(),
+        "status": None
+    }
+    with _pending_lock:
+        _pending[instance_id] = waiter
+
+    _ensure_poller()
+    _wakeup.set()
+
+    print(f"⏳ Esperando a que instancia {instance_id[:8]}... esté ACTIVE...")
+
+    if waiter["event"].wait(max_wait):
+        return waiter["result"]
+
+    with _pending_lock:
+        _pending.pop(instance_id, None)
+
+    # Pudo resolverse justo entre el timeout y el pop
+    if waiter["result"] is not None:
+        return waiter["result"]
+
+    print(f"⏱️ Timeout esperando instancia ({max_wait}s)")
+    return {
+        "ready": False,
+        "status": "TIMEOUT",
+        "elapsed": time.time() - waiter["started_at"],
+        "error": f"Instance not ready after {max_wait}s"
+    }
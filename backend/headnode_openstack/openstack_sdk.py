@@ -1,4 +1,128 @@
 import json, requests
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+# ================================== SESIONES HTTP ==================================
+# Una requests.Session por endpoint (scheme://host:port) con pool de conexiones y
+# keep-alive: las decenas de llamadas Keystone/Nova/Neutron por VM reutilizan TCP.
+# Reintentos con backoff exponencial:
+#   - 5xx y 409 en GET/PUT/DELETE (idempotentes; 409 = recurso ocupado, p.ej. puerto en uso)
+#   - en POST solo 503 con Retry-After (el servicio rechazó la petición sin procesarla).
+#     Un 502/504 del gateway puede llegar cuando Nova/Neutron ya la aceptaron:
+#     reintentar duplicaría el server/puerto/proyecto, así que lo resuelve quien
+#     llama (reconciliando por nombre). Un 409 en POST es semántico, p.ej. "proyecto ya existe".
+HTTP_POOL_SIZE = int(os.getenv("OPENSTACK_HTTP_POOL_SIZE", "20"))
+HTTP_TIMEOUT = float(os.getenv("OPENSTACK_HTTP_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.getenv("OPENSTACK_HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("OPENSTACK_HTTP_BACKOFF", "0.5"))
+
+_RETRY_STATUS = {
+    'GET': {409, 500, 502, 503, 504},
+    'PUT': {409, 500, 502, 503, 504},
+    'DELETE': {409, 500, 502, 503, 504},
+    'POST': {503}
+}
+RETRY_AFTER_MAX = float(os.getenv("OPENSTACK_RETRY_AFTER_MAX", "30"))
+
+def _retry_after(r):
+    """Segundos del header Retry-After (solo la forma numérica), acotados; None si no viene"""
+    try:
+        return min(float(r.headers['Retry-After']), RETRY_AFTER_MAX)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_http_stats = {}
+_timing_hooks = []
+
+def _endpoint_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def _session_for(url):
+    key = _endpoint_key(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            # max_retries solo cubre fallos de conexión; los reintentos por status van en http_request
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
+def add_timing_hook(hook):
+    """Registra hook(method, url, status_code, elapsed_s, attempt) que se llama tras cada intento"""
+    _timing_hooks.append(hook)
+
+def _record_timing(method, url, status_code, elapsed, attempt):
+    key = f"{method} {_endpoint_key(url)}"
+    with _sessions_lock:
+        stats = _http_stats.setdefault(key, {"calls": 0, "retries": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+        stats["calls"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        if attempt > 0:
+            stats["retries"] += 1
+        if status_code is None or status_code >= 400:
+            stats["errors"] += 1
+    for hook in _timing_hooks:
+        try:
+            hook(method, url, status_code, elapsed, attempt)
+        except Exception as e:
+            print(f"⚠️ Timing hook falló: {e}")
+
+def http_stats():
+    """Snapshot de llamadas/latencias por método y endpoint (para /health del agente)"""
+    with _sessions_lock:
+        return {
+            key: {**s, "total_s": round(s["total_s"], 3), "max_s": round(s["max_s"], 3),
+                  "avg_ms": round(1000 * s["total_s"] / s["calls"], 1) if s["calls"] else 0}
+            for key, s in _http_stats.items()
+        }
+
+def http_request(method, url, **kwargs):
+    """requests.request sobre la sesión del endpoint, con reintentos y timing"""
+    method = method.upper()
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    retry_status = _RETRY_STATUS.get(method, set())
+    session = _session_for(url)
+
+    for attempt in range(HTTP_RETRIES + 1):
+        start = time.time()
+        try:
+            r = session.request(method, url, **kwargs)
+        except requests.ConnectionError:
+            _record_timing(method, url, None, time.time() - start, attempt)
+            if attempt == HTTP_RETRIES or method == 'POST':
+                raise
+        else:
+            _record_timing(method, url, r.status_code, time.time() - start, attempt)
+            espera = _retry_after(r)
+            if r.status_code not in retry_status or attempt == HTTP_RETRIES or (method == 'POST' and espera is None):
+                return r
+            print(f"⚠️ {method} {url} → HTTP {r.status_code}, reintentando ({attempt + 1}/{HTTP_RETRIES})...")
+            if espera is not None:
+                time.sleep(espera)
+                continue
+        time.sleep(HTTP_BACKOFF * (2 ** attempt))
+
+def http_get(url, **kwargs):
+    return http_request('GET', url, **kwargs)
+
+def http_post(url, **kwargs):
+    return http_request('POST', url, **kwargs)
+
+def http_put(url, **kwargs):
+    return http_request('PUT', url, **kwargs)
+
+def http_delete(url, **kwargs):
+    return http_request('DELETE', url, **kwargs)
 
 # ================================== KEYSTONE ==================================
 # source: https://docs.openstack.org/api-ref/identity/v3/
@@ -33,7 +157,7 @@ def password_authentication_with_scoped_authorization(auth_endpoint, user_id, pa
             }
         }
         
-    r = requests.post(url=url, data=json.dumps(data))
+    r = http_post(url, data=json.dumps(data))
     # status_code success = 201
     return r
 
@@ -62,7 +186,7 @@ def token_authentication_with_scoped_authorization(auth_endpoint, token, domain_
             }
         }
 
-    r = requests.post(url=url, data=json.dumps(data))
+    r = http_post(url, data=json.dumps(data))
     # status_code success = 201
     return r
 
@@ -81,7 +205,7 @@ def create_project(auth_endpoint, token, domain_id, project_name, project_descri
             }
         }
 
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     # status_code success = 201
     return r
 
@@ -89,7 +213,7 @@ def assign_role_to_user_on_project(auth_endpoint, token, project_id, user_id, ro
     url = auth_endpoint + '/projects/' + project_id + '/users/' + user_id + '/roles/' + role_id
     headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
 
-    r = requests.put(url=url, headers=headers)
+    r = http_put(url, headers=headers)
     # status_code success = 204
     return r
 
@@ -114,7 +238,7 @@ def create_server(nova_endpoint, token, name, flavor_id, image_id, networks=None
 
     data = {'server': server_payload}    
     
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     # status_code success = 202
     return r
 
@@ -134,7 +258,7 @@ def get_server_console(nova_endpoint, token, server_id, compute_api_version):
                 }
         }
     
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     # status_code success = 200
     return r
 
@@ -152,7 +276,7 @@ def create_network(auth_endpoint, token, name):
         }
         
     headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     # status_code success = 201
     return r
 
@@ -173,7 +297,7 @@ def create_subnet(auth_endpoint, token, network_id, name, ip_version, cidr):
     data = data=json.dumps(data)
 
     headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
-    r = requests.post(url=url, headers=headers, data=data)
+    r = http_post(url, headers=headers, data=data)
     # status_code success = 201
     return r
 
@@ -191,11 +315,25 @@ def create_port(auth_endpoint, token, name, network_id, project_id):
             }
         }
 
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     # status_code success = 201
     return r
 
 
+def create_ports_bulk(auth_endpoint, token, ports):
+    """
+    Crea varios puertos en un solo POST /ports (bulk de Neutron).
+    ports = lista de dicts con el mismo formato que 'port' en create_port.
+    """
+    url = auth_endpoint + '/ports'
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    data = {'ports': ports}
+
+    r = http_post(url, headers=headers, data=json.dumps(data))
+    # status_code success = 201
+    return r
+
 # ================================== NEUTRON - ROUTER FUNCTIONS ==================================
 
 def create_router(neutron_endpoint, token, name, external_network_id=None):
@@ -219,7 +357,7 @@ def create_router(neutron_endpoint, token, name, external_network_id=None):
             "enable_snat": True
         }
     
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
     return r
 
 def add_router_interface(neutron_endpoint, token, router_id, subnet_id):
@@ -232,7 +370,7 @@ def add_router_interface(neutron_endpoint, token, router_id, subnet_id):
     
     data = {"subnet_id": subnet_id}
     
-    r = requests.put(url=url, headers=headers, data=json.dumps(data))
+    r = http_put(url, headers=headers, data=json.dumps(data))
     return r
 
 def set_router_gateway(neutron_endpoint, token, router_id, external_network_id):
@@ -252,7 +390,7 @@ def set_router_gateway(neutron_endpoint, token, router_id, external_network_id):
         }
     }
     
-    r = requests.put(url=url, headers=headers, data=json.dumps(data))
+    r = http_put(url, headers=headers, data=json.dumps(data))
     return r
 
 def remove_router_interface(neutron_endpoint, token, router_id, subnet_id):
@@ -265,7 +403,7 @@ def remove_router_interface(neutron_endpoint, token, router_id, subnet_id):
     
     data = {"subnet_id": subnet_id}
     
-    r = requests.put(url=url, headers=headers, data=json.dumps(data))
+    r = http_put(url, headers=headers, data=json.dumps(data))
     return r
 
 def create_port_custom(auth_endpoint, token, name, network_id, project_id, mac_address=None, fixed_ips=None):
@@ -292,5 +430,50 @@ def create_port_custom(auth_endpoint, token, name, network_id, project_id, mac_a
 
     data = {'port': port_data}
 
-    r = requests.post(url=url, headers=headers, data=json.dumps(data))
+    r = http_post(url, headers=headers, data=json.dumps(data))
+    return r
+
+# ================================== TEARDOWN ==================================
+# DELETE directos por recurso; status_code success = 204 (404 = ya no existe)
+
+def delete_server(nova_endpoint, token, server_id):
+    url = nova_endpoint + '/servers/' + server_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
+    return r
+
+def delete_port(neutron_endpoint, token, port_id):
+    url = neutron_endpoint + '/ports/' + port_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
+    return r
+
+def delete_subnet(neutron_endpoint, token, subnet_id):
+    url = neutron_endpoint + '/subnets/' + subnet_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
+    return r
+
+def delete_network(neutron_endpoint, token, network_id):
+    url = neutron_endpoint + '/networks/' + network_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
+    return r
+
+def delete_router(neutron_endpoint, token, router_id):
+    url = neutron_endpoint + '/routers/' + router_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
+    return r
+
+def delete_project(auth_endpoint, token, project_id):
+    url = auth_endpoint + '/projects/' + project_id
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token}
+
+    r = http_delete(url, headers=headers)
     return r
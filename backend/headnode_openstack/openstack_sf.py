@@ -1,7 +1,10 @@
-from openstack_sdk import password_authentication_with_scoped_authorization, token_authentication_with_scoped_authorization, create_server, get_server_console, create_project, assign_role_to_user_on_project, create_network, create_subnet, create_port, create_router, add_router_interface, set_router_gateway, remove_router_interface
+from openstack_sdk import password_authentication_with_scoped_authorization, token_authentication_with_scoped_authorization, create_server, get_server_console, create_project, assign_role_to_user_on_project, create_network, create_subnet, create_port, create_ports_bulk, create_router, add_router_interface, set_router_gateway, remove_router_interface
 from dotenv import load_dotenv
-from openstack_sdk import create_port_custom
+from openstack_sdk import create_port_custom, http_get
+from datetime import datetime, timezone
 import os
+import threading
+import time
 
 load_dotenv()
 ACCESS_NODE_IP = os.getenv("ACCESS_NODE_IP")
@@ -21,6 +24,80 @@ KEYSTONE_ENDPOINT = 'http://' + ACCESS_NODE_IP + ':' + KEYSTONE_PORT + '/v3'
 NOVA_ENDPOINT = 'http://' + ACCESS_NODE_IP + ':' + NOVA_PORT + '/v2.1'
 NEUTRON_ENDPOINT = 'http://' + ACCESS_NODE_IP + ':' + NEUTRON_PORT + '/v2.0'
 
+# ================================== CACHE DE TOKENS ==================================
+# Tokens de Keystone por scope ("admin" o "project:<id>"), compartidos entre
+# workflows concurrentes del mismo proceso (p.ej. el headnode agent).
+# Se renuevan TOKEN_REFRESH_MARGIN segundos antes de su expires_at.
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_DEFAULT_TTL = 3600
+
+# Un 502/504 del gateway en un POST no dice si Nova/Neutron/Keystone creó el recurso
+# (openstack_sdk no reintenta esos POST): antes de darlo por fallido o reintentarlo
+# se busca el recurso por nombre.
+GATEWAY_STATUS = {502, 504}
+
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+_token_scope_locks = {}
+
+def _parse_expires_at(resp):
+    """Convierte token.expires_at de Keystone (ISO 8601, UTC) a epoch"""
+    try:
+        expires_at = resp.json()['token']['expires_at']
+        for fmt in ('%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ'):
+            try:
+                dt = datetime.strptime(expires_at, fmt).replace(tzinfo=timezone.utc)
+                return dt.timestamp()
+            except ValueError:
+                continue
+    except (ValueError, KeyError, TypeError):
+        pass
+    return time.time() + TOKEN_DEFAULT_TTL
+
+def _scope_lock(scope):
+    with _token_cache_lock:
+        if scope not in _token_scope_locks:
+            _token_scope_locks[scope] = threading.Lock()
+        return _token_scope_locks[scope]
+
+def _cached_token(scope):
+    with _token_cache_lock:
+        entry = _token_cache.get(scope)
+    if entry and entry['expires_at'] - time.time() > TOKEN_REFRESH_MARGIN:
+        return entry['token']
+    return ''
+
+def _get_or_refresh_token(scope, authenticate):
+    """
+    Devuelve el token cacheado del scope o autentica de nuevo.
+    Un solo hilo autentica por scope; los demás esperan y reutilizan el resultado.
+    """
+    token = _cached_token(scope)
+    if token:
+        return token
+
+    with _scope_lock(scope):
+        token = _cached_token(scope)
+        if token:
+            return token
+
+        r = authenticate()
+        if r.status_code != 201:
+            return ''
+
+        token = r.headers['X-Subject-Token']
+        with _token_cache_lock:
+            _token_cache[scope] = {'token': token, 'expires_at': _parse_expires_at(r)}
+        return token
+
+def invalidate_token(scope=None):
+    """Descarta un token (p.ej. tras un 401) o todo el cache si scope es None"""
+    with _token_cache_lock:
+        if scope is None:
+            _token_cache.clear()
+        else:
+            _token_cache.pop(scope, None)
+
 def get_admin_token():
     """
     INPUT:
@@ -29,12 +106,10 @@ def get_admin_token():
         admin_project_token = token with scope authorization over the admin project (clod_admin) | '' if something wrong
     
     """
-    resp1 = password_authentication_with_scoped_authorization(KEYSTONE_ENDPOINT, ADMIN_USER_ID, ADMIN_USER_PASSWORD, DOMAIN_ID, ADMIN_PROJECT_ID)
-    admin_project_token = ''
-    if resp1.status_code == 201:
-        admin_project_token = resp1.headers['X-Subject-Token']
-    
-    return admin_project_token
+    return _get_or_refresh_token(
+        'admin',
+        lambda: password_authentication_with_scoped_authorization(KEYSTONE_ENDPOINT, ADMIN_USER_ID, ADMIN_USER_PASSWORD, DOMAIN_ID, ADMIN_PROJECT_ID)
+    )
 
 def get_token_for_project(project_id, admin_project_token):
     """
@@ -46,12 +121,10 @@ def get_token_for_project(project_id, admin_project_token):
         token_for_project = token with scope authorization over the project identified by project_id | '' if something wrong
     
     """
-    r = token_authentication_with_scoped_authorization(KEYSTONE_ENDPOINT, admin_project_token, DOMAIN_ID, project_id)
-    token_for_project = ''
-    if r.status_code == 201:
-        token_for_project = r.headers['X-Subject-Token']
-    
-    return token_for_project
+    return _get_or_refresh_token(
+        f'project:{project_id}',
+        lambda: token_authentication_with_scoped_authorization(KEYSTONE_ENDPOINT, admin_project_token, DOMAIN_ID, project_id)
+    )
 
 def create_os_instance(image_id, flavor_id, name, port_list, token_for_project, target_host=None):
     """
@@ -75,11 +148,28 @@ def create_os_instance(image_id, flavor_id, name, port_list, token_for_project,
     instance_info = {}
     if r.status_code == 202:
         instance_info = r.json()
+    elif r.status_code in GATEWAY_STATUS:
+        server_id = get_server_id_by_name(token_for_project, name)
+        if server_id:
+            print(f"ℹ️ HTTP {r.status_code} creando {name}, pero Nova ya la tiene: {server_id}")
+            instance_info = {"server": {"id": server_id}}
+        else:
+            print(f"❌ Error creando instancia: {r.status_code} - {r.text}")
     else:
         print(f"❌ Error creando instancia: {r.status_code} - {r.text}")
 
     return instance_info
 
+def get_server_id_by_name(token_for_project, name):
+    """ID del server del proyecto con ese nombre exacto (el filtro name de Nova es regex) o None"""
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': token_for_project}
+    r = http_get(f"{NOVA_ENDPOINT}/servers", headers=headers, params={"name": name})
+    if r.status_code == 200:
+        for server in r.json().get('servers', []):
+            if server.get('name') == name:
+                return server['id']
+    return None
+
 def get_console_url(instance_id, admin_project_token):
     """
     INPUT:
@@ -109,9 +199,9 @@ def create_os_project(admin_project_token, slice_name, slice_description = ''):
         # Proyecto creado exitosamente
         slice_id = r.json()['project']['id']
         print(f"✅ Proyecto {slice_name} creado: {slice_id}")
-    elif r.status_code == 409:
-        # Proyecto ya existe (conflict)
-        print(f"ℹ️ Proyecto {slice_name} ya existe, buscando ID...")
+    elif r.status_code == 409 or r.status_code in GATEWAY_STATUS:
+        # Proyecto ya existe (conflict) o Keystone pudo crearlo pese al error del gateway
+        print(f"ℹ️ Proyecto {slice_name}: HTTP {r.status_code}, buscando ID...")
         # Buscar el proyecto existente
         slice_id = get_project_id_by_name(admin_project_token, slice_name)
         if slice_id:
@@ -123,14 +213,13 @@ def get_project_id_by_name(admin_project_token, project_name):
     """
     Busca un proyecto por nombre y retorna su ID
     """
-    import requests
     url = f"{KEYSTONE_ENDPOINT}/projects?name={project_name}"
     headers = {
         'Content-type': 'application/json',
         'X-Auth-Token': admin_project_token
     }
     
-    r = requests.get(url=url, headers=headers)
+    r = http_get(url, headers=headers)
     if r.status_code == 200:
         projects = r.json().get('projects', [])
         if projects:
@@ -189,14 +278,76 @@ def create_os_port(target_project_token, port_name, network_id, target_project_i
     port_id = ''
     if r.status_code == 201:
         port_id = r.json()['port']['id']
+    elif r.status_code in GATEWAY_STATUS:
+        existentes = list_ports_by_name(target_project_token, target_project_id, [port_name])
+        if existentes.get((port_name, network_id)):
+            port_id = existentes[(port_name, network_id)][0]
     
     return port_id
 
+def list_ports_by_name(target_project_token, target_project_id, names):
+    """{(name, network_id): [port_id, ...]} de los puertos del proyecto con esos nombres"""
+    headers = {'Content-type': 'application/json', 'X-Auth-Token': target_project_token}
+    r = http_get(f"{NEUTRON_ENDPOINT}/ports", headers=headers,
+                 params={"project_id": target_project_id, "name": list(names)})
+    found = {}
+    if r.status_code == 200:
+        for port in r.json().get('ports', []):
+            found.setdefault((port['name'], port['network_id']), []).append(port['id'])
+    return found
+
+def create_os_ports_bulk(target_project_token, port_specs, target_project_id):
+    """
+    INPUT:
+        port_specs = lista de {"name", "network_id"} (p.ej. todos los puertos de una VM o de un slice)
+
+    OUTPUT:
+        port_ids = lista de port_id en el mismo orden que port_specs ('' si ese puerto falló)
+
+    Un solo POST /ports para todos; si el bulk falla o devuelve menos puertos,
+    los que falten se crean uno a uno con create_os_port.
+    """
+    if not port_specs:
+        return []
+
+    ports = [
+        {
+            'name': spec['name'],
+            'tenant_id': target_project_id,
+            'network_id': spec['network_id'],
+            'port_security_enabled': 'false'
+        }
+        for spec in port_specs
+    ]
+
+    created = {}
+    r = create_ports_bulk(NEUTRON_ENDPOINT, target_project_token, ports)
+    if r.status_code == 201:
+        for port in r.json().get('ports', []):
+            created.setdefault((port['name'], port['network_id']), []).append(port['id'])
+        print(f"✅ {sum(len(v) for v in created.values())}/{len(ports)} puerto(s) creado(s) en bulk")
+    elif r.status_code in GATEWAY_STATUS:
+        # Neutron pudo haber creado el bulk: se reutilizan los que ya existen
+        created = list_ports_by_name(target_project_token, target_project_id, {spec['name'] for spec in port_specs})
+        print(f"⚠️ Bulk de puertos: HTTP {r.status_code}, {sum(len(v) for v in created.values())} ya existían, "
+              f"creando el resto uno a uno...")
+    else:
+        print(f"⚠️ Bulk de puertos falló: HTTP {r.status_code}, creando uno a uno...")
+
+    port_ids = []
+    for spec in port_specs:
+        pending = created.get((spec['name'], spec['network_id']))
+        if pending:
+            port_ids.append(pending.pop(0))
+        else:
+            port_ids.append(create_os_port(target_project_token, spec['name'], spec['network_id'], target_project_id))
+
+    return port_ids
+
 # ================================== FUNCIONES PARA INTERNET ==================================
 
 def get_external_network_id(admin_token):
     """Busca la red externa disponible en OpenStack"""
-    import requests
     
     if EXTERNAL_NETWORK_ID:
         print(f"✅ Usando red externa del .env: {EXTERNAL_NETWORK_ID}")
@@ -208,7 +359,7 @@ def get_external_network_id(admin_token):
         'X-Auth-Token': admin_token
     }
     
-    r = requests.get(url=url, headers=headers)
+    r = http_get(url, headers=headers)
     if r.status_code == 200:
         networks = r.json().get('networks', [])
         if networks:
@@ -275,7 +426,6 @@ def set_router_external_gateway(admin_token, router_id, external_network_id):
 
 def get_or_create_router_for_project(admin_token, project_token, project_id, slice_id):
     """Obtiene o crea un router para el proyecto con salida a Internet"""
-    import requests
     
     router_name = f"router_slice_{slice_id}"
     
@@ -286,7 +436,7 @@ def get_or_create_router_for_project(admin_token, project_token, project_id, sli
         'X-Auth-Token': project_token
     }
     
-    r = requests.get(url=url, headers=headers)
+    r = http_get(url, headers=headers)
     if r.status_code == 200:
         routers = r.json().get('routers', [])
         # 🔥 CORRECCIÓN: Verificar que la lista no esté vacía y que el primer elemento sea válido
@@ -325,7 +475,6 @@ def get_or_create_router_for_project(admin_token, project_token, project_id, sli
 
 def check_router_interface_exists(token, router_id, subnet_id):
     """Verifica si una subnet ya está conectada a un router"""
-    import requests
     
     url = f"{NEUTRON_ENDPOINT}/routers/{router_id}"
     headers = {
@@ -334,13 +483,13 @@ def check_router_interface_exists(token, router_id, subnet_id):
     }
     
     try:
-        r = requests.get(url=url, headers=headers)
+        r = http_get(url, headers=headers)
         if r.status_code == 200:
             router_data = r.json().get('router', {})
             
             # Verificar en ports del router
             ports_url = f"{NEUTRON_ENDPOINT}/ports?device_id={router_id}"
-            r_ports = requests.get(url=ports_url, headers=headers)
+            r_ports = http_get(url=ports_url, headers=headers)
             
             if r_ports.status_code == 200:
                 ports = r_ports.json().get('ports', [])
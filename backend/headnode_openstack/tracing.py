@@ -0,0 +1,305 @@
+"""
+Trazas distribuidas mínimas con W3C Trace Context.
+
+    traceparent: 00-<trace_id 32 hex>-<span_id 16 hex>-01
+
+El span activo vive en un contextvar. span() abre un hijo del activo (o del
+traceparent recibido; sin ninguno empieza una traza nueva), mide su duración
+y al cerrarse lo escribe como una línea JSON en TRACE_EXPORT_PATH.
+
+Propagación:
+    - HTTP: header "traceparent" (inject_headers / instrumentar_fastapi)
+    - AMQP: properties.headers["traceparent"]
+    - SSH:  campo "traceparent" en el JSON de argumentos del script
+
+Los procesos sin acceso al archivo (scripts del headnode) llaman capturar(),
+devuelven spans_capturados() en su respuesta y quien los invocó los exporta
+con exportar(). Un proceso que atiende varios requests a la vez (el agente
+OpenStack) usa capturando(), que separa los spans por request. Mismo archivo
+en cada servicio que traza.
+"""
+import contextvars
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "/app/traces/spans.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+SERVICE_NAME = os.getenv("SERVICE_NAME", "unknown")
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_actual = contextvars.ContextVar("trace_span", default=None)
+_lock = threading.Lock()
+_capturados = None      # lista en memoria si capturar() fue llamado
+_captura = contextvars.ContextVar("trace_captura", default=None)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start = time.time()
+        self.end = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": SERVICE_NAME,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round((self.end - self.start) * 1000, 1),
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+def parse_traceparent(value):
+    """(trace_id, parent_span_id) o None si el header no es válido"""
+    match = _TRACEPARENT_RE.match((value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def actual():
+    """Span activo en este contexto (o None)"""
+    return _actual.get()
+
+
+def traceparent():
+    """traceparent del span activo, para propagarlo (None si no hay traza)"""
+    span_actual = _actual.get()
+    return span_actual.traceparent() if span_actual else None
+
+
+def inject_headers(headers=None):
+    """Headers HTTP/AMQP con el traceparent del span activo agregado"""
+    headers = dict(headers or {})
+    valor = traceparent()
+    if valor:
+        headers["traceparent"] = valor
+    return headers
+
+
+def anotar(**attributes):
+    """Agrega atributos al span activo (p.ej. slice_id en el span del request)"""
+    span_actual = _actual.get()
+    if span_actual:
+        span_actual.attributes.update(attributes)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Mide un bloque como span. parent: traceparent recibido por HTTP/AMQP/SSH;
+    si no viene (o no es válido), el padre es el span activo.
+    """
+    if not TRACING_ENABLED:
+        yield Span(name, "0" * 32, None, attributes)
+        return
+
+    padre = parse_traceparent(parent) if parent else None
+    if padre is None and _actual.get() is not None:
+        padre = (_actual.get().trace_id, _actual.get().span_id)
+    trace_id, parent_id = padre if padre else (os.urandom(16).hex(), None)
+
+    nuevo = Span(name, trace_id, parent_id, attributes)
+    token = _actual.set(nuevo)
+    try:
+        yield nuevo
+    except Exception as e:
+        nuevo.status = "error"
+        nuevo.attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        nuevo.end = time.time()
+        _actual.reset(token)
+        exportar([nuevo.to_dict()])
+
+
+def trazar(name):
+    """Decorador: cada llamada a la función es un span (p.ej. vistas Flask)"""
+    def decorador(fn):
+        @functools.wraps(fn)
+        def envoltura(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def con_contexto(fn):
+    """
+    fn ligada a una copia del contexto actual, para ThreadPoolExecutor.submit
+    (los hilos del pool no heredan el span activo). Llamar una vez por submit.
+    """
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.run(fn, *args, **kwargs)
+
+
+# ======================================
+# EXPORTACIÓN
+# ======================================
+def capturar():
+    """Guarda los spans en memoria en lugar del archivo (procesos remotos)"""
+    global _capturados
+    _capturados = []
+
+
+def spans_capturados():
+    return list(_capturados or [])
+
+
+@contextmanager
+def capturando():
+    """Los spans cerrados en este contexto (hilo/request) van a la lista, no al archivo"""
+    spans = []
+    token = _captura.set(spans)
+    try:
+        yield spans
+    finally:
+        _captura.reset(token)
+
+
+def exportar(spans):
+    """Escribe spans (dicts) como líneas JSON; también los recibidos de otro proceso"""
+    if not spans or not TRACING_ENABLED:
+        return
+    destino = _captura.get()
+    if destino is not None:
+        destino.extend(spans)
+        return
+    with _lock:
+        if _capturados is not None:
+            _capturados.extend(spans)
+            return
+        try:
+            os.makedirs(os.path.dirname(TRACE_EXPORT_PATH) or ".", exist_ok=True)
+            if os.path.exists(TRACE_EXPORT_PATH) and os.path.getsize(TRACE_EXPORT_PATH) >= TRACE_MAX_BYTES:
+                os.replace(TRACE_EXPORT_PATH, TRACE_EXPORT_PATH + ".1")
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+                for item in spans:
+                    f.write(json.dumps(item) + "\n")
+        except OSError as e:
+            print(f"⚠️ No se pudo exportar spans: {e}")
+
+
+def leer_spans(path=None):
+    """Spans del archivo de exportación (y del archivo rotado, si existe)"""
+    path = path or TRACE_EXPORT_PATH
+    for archivo in (path + ".1", path):
+        if not os.path.exists(archivo):
+            continue
+        with open(archivo, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+# ======================================
+# WATERFALL
+# ======================================
+def waterfall(spans, ancho=40):
+    """
+    Vista de cascada de una traza: cada span con su profundidad, desplazamiento
+    y duración desde el inicio de la traza, más una barra de texto.
+    """
+    spans = sorted(spans, key=lambda s: s["start"])
+    if not spans:
+        return None
+    inicio = spans[0]["start"]
+    total = max(s["end"] for s in spans) - inicio or 1e-6
+
+    # Orden de árbol: cada span seguido de sus hijos (así las VMs en paralelo no se mezclan)
+    por_id = {s["span_id"]: s for s in spans}
+    hijos = {}
+    for s in spans:
+        padre = s.get("parent_id") if s.get("parent_id") in por_id else None
+        hijos.setdefault(padre, []).append(s)
+    ordenados = []
+    pendientes = [(s, 0) for s in reversed(hijos.get(None, []))]
+    while pendientes:
+        s, nivel = pendientes.pop()
+        ordenados.append((s, nivel))
+        pendientes.extend((h, nivel + 1) for h in reversed(hijos.get(s["span_id"], [])))
+
+    filas, texto = [], []
+    for s, nivel in ordenados:
+        offset = s["start"] - inicio
+        desde = int(offset / total * ancho)
+        largo = max(1, int((s["end"] - s["start"]) / total * ancho))
+        filas.append({
+            "name": s["name"],
+            "service": s.get("service"),
+            "depth": nivel,
+            "offset_ms": round(offset * 1000, 1),
+            "duration_ms": s["duration_ms"],
+            "status": s["status"],
+            "attributes": s.get("attributes", {})
+        })
+        texto.append(
+            f"{'  ' * nivel}{s['name']} [{s.get('service')}]".ljust(56)
+            + f"|{' ' * desde}{'█' * largo}".ljust(ancho + 2)
+            + f"| {s['duration_ms']:.0f}ms" + (" ❌" if s["status"] == "error" else "")
+        )
+
+    return {
+        "trace_id": spans[0]["trace_id"],
+        "inicio": inicio,
+        "duracion_ms": round(total * 1000, 1),
+        "spans": filas,
+        "texto": texto
+    }
+
+
+def trazas_con_atributo(clave, valor, path=None):
+    """Waterfall de cada traza que tenga algún span con attributes[clave] == valor"""
+    por_traza = {}
+    coincidentes = set()
+    for s in leer_spans(path):
+        por_traza.setdefault(s["trace_id"], []).append(s)
+        if str(s.get("attributes", {}).get(clave)) == str(valor):
+            coincidentes.add(s["trace_id"])
+    trazas = [waterfall(por_traza[trace_id]) for trace_id in coincidentes]
+    return sorted(trazas, key=lambda t: t["inicio"])
+
+
+def instrumentar_fastapi(app, excluir=("/", "/health")):
+    """
+    Middleware HTTP: cada request es un span hijo del traceparent entrante
+    (o raíz de una traza nueva) y la respuesta devuelve su traceparent.
+    """
+    @app.middleware("http")
+    async def _trazar_request(request, call_next):
+        if request.url.path in excluir:
+            return await call_next(request)
+        with span(f"{request.method} {request.url.path}", parent=request.headers.get("traceparent")) as s:
+            response = await call_next(request)
+            s.set("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                s.status = "error"
+            if TRACING_ENABLED:
+                response.headers["traceparent"] = s.traceparent()
+            return response
@@ -1,13 +1,22 @@
 from fastapi import FastAPI, Request
+import asyncio
 import subprocess
+import threading
 import json
 import os
+import time
+import urllib.request
+import urllib.error
+from ssh_manager import run_ssh, ensure_master, open_forward, evict_idle_masters, masters_status
+import tracing
 
 app = FastAPI(
     title="Hybrid Driver (Linux + OpenStack)",
     version="2.0.0",
     description="Orquestador para VMs en Linux Cluster y OpenStack"
 )
+# Cada request continúa la traza del traceparent que envía slice_manager
+tracing.instrumentar_fastapi(app)
 
 
 # --- Configuración Linux ---
@@ -22,124 +31,313 @@ USER_OPENSTACK = os.getenv("USER_OPENSTACK", "ubuntu")
 OPENSTACK_HEADNODE = os.getenv("OPENSTACK_HEADNODE", "10.20.12.106")
 OPENSTACK_PORT = os.getenv("OPENSTACK_PORT", "5821")
 OPENSTACK_SCRIPTS_PATH = os.getenv("OPENSTACK_SCRIPTS_PATH", "/home/ubuntu/openstack-scripts")
+OPENSTACK_AGENT_ENABLED = os.getenv("OPENSTACK_AGENT_ENABLED", "true").lower() == "true"
+OPENSTACK_AGENT_PORT = int(os.getenv("OPENSTACK_AGENT_PORT", "8765"))              # puerto del agente en el headnode
+OPENSTACK_AGENT_LOCAL_PORT = int(os.getenv("OPENSTACK_AGENT_LOCAL_PORT", "18765"))  # extremo local del túnel
+OPENSTACK_AGENT_RESTART_COOLDOWN = 60
+OPENSTACK_AGENT_HEALTH_INTERVAL = 30
+# Un slice completo corre como job en el agente y el driver consulta su estado
+OPENSTACK_JOB_POLL_INTERVAL = float(os.getenv("OPENSTACK_JOB_POLL_INTERVAL", "2"))
+OPENSTACK_JOB_UNREACHABLE_S = int(os.getenv("OPENSTACK_JOB_UNREACHABLE_S", "120"))
+SLICE_DEPLOY_TIMEOUT_BASE = int(os.getenv("SLICE_DEPLOY_TIMEOUT_BASE", "300"))
+SLICE_DEPLOY_TIMEOUT_PER_VM = int(os.getenv("SLICE_DEPLOY_TIMEOUT_PER_VM", "30"))
+# Teardown de un proyecto: debe caber en el timeout=180 con que sliceManager llama a /delete_project_openstack
+PROJECT_TEARDOWN_TIMEOUT = int(os.getenv("PROJECT_TEARDOWN_TIMEOUT", "150"))
+SSH_EVICT_INTERVAL = int(os.getenv("SSH_EVICT_INTERVAL", "60"))
+
+# --- Conexiones SSH persistentes ---
+def _ssh_keepalive_loop():
+    """Abre los masters hacia ambos headnodes y cierra los ociosos periódicamente"""
+    for key, user, host, port in [
+        (SSH_KEY_LINUXHN, USER_LINUXHN, LINUX_HEADNODE, LINUX_PORT),
+        (SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE, OPENSTACK_PORT),
+    ]:
+        try:
+            ensure_master(key, user, host, port)
+        except Exception as e:
+            print(f"[SSH-MUX] ⚠️ No se pudo precalentar {user}@{host}:{port}: {e}")
+
+    while True:
+        time.sleep(SSH_EVICT_INTERVAL)
+        try:
+            evict_idle_masters()
+        except Exception as e:
+            print(f"[SSH-MUX] ⚠️ Error en eviction: {e}")
+
+@app.on_event("startup")
+def start_ssh_keepalive():
+    threading.Thread(target=_ssh_keepalive_loop, daemon=True).start()
+
+# --- Agente persistente del headnode OpenStack ---
+_agent_state = {"last_start_attempt": 0.0, "last_healthy": 0.0}
+_agent_lock = threading.Lock()
+
+def _agent_request(method, path, payload=None, timeout=300):
+    url = f"http://127.0.0.1:{OPENSTACK_AGENT_LOCAL_PORT}{path}"
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=body, method=method,
+                                 headers=tracing.inject_headers({"Content-Type": "application/json"}))
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read().decode("utf-8"))
+
+def _start_openstack_agent():
+    """Lanza el agente en el headnode si no responde (con cooldown para no reintentar en bucle)"""
+    with _agent_lock:
+        now = time.time()
+        if now - _agent_state["last_start_attempt"] < OPENSTACK_AGENT_RESTART_COOLDOWN:
+            return False
+        _agent_state["last_start_attempt"] = now
+
+    print("[OPENSTACK-AGENT] Agente no disponible, iniciándolo en el headnode...")
+    start_cmd = (
+        f"\"cd {OPENSTACK_SCRIPTS_PATH} && "
+        f"HEADNODE_AGENT_PORT={OPENSTACK_AGENT_PORT} "
+        f"nohup python3 headnode_agent.py > headnode_agent.log 2>&1 < /dev/null &\""
+    )
+    result = run_ssh(SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE, start_cmd,
+                     port=OPENSTACK_PORT, timeout=15)
+    if result.returncode != 0:
+        return False
+
+    # Esperar a que el agente levante (imports + bind)
+    for _ in range(20):
+        time.sleep(0.25)
+        try:
+            _agent_request("GET", "/health", timeout=2)
+            print("[OPENSTACK-AGENT] ✅ Agente iniciado")
+            return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            continue
+    return False
+
+def _openstack_agent_ready():
+    """Health check del agente (cacheado); si no responde intenta iniciarlo"""
+    if time.time() - _agent_state.get("last_healthy", 0.0) < OPENSTACK_AGENT_HEALTH_INTERVAL:
+        return True
+    try:
+        _agent_request("GET", "/health", timeout=3)
+        ok = True
+    except (urllib.error.URLError, ConnectionError, OSError):
+        ok = _start_openstack_agent()
+    if ok:
+        _agent_state["last_healthy"] = time.time()
+    return ok
+
+def slice_deploy_timeout(n_vms):
+    """Tiempo máximo de un despliegue de slice: crece con el número de VMs"""
+    return SLICE_DEPLOY_TIMEOUT_BASE + SLICE_DEPLOY_TIMEOUT_PER_VM * n_vms
+
+def _esperar_job_agente(job_id, script_name, timeout):
+    """
+    Consulta el job hasta que termine. Si se vence el plazo o el agente deja
+    de responder, el workflow puede seguir corriendo: se marca workflow_en_curso
+    para que el caller no haga rollback sobre recursos que aún se están creando.
+    """
+    deadline = time.time() + timeout
+    sin_respuesta_desde = None
+    while True:
+        time.sleep(OPENSTACK_JOB_POLL_INTERVAL)
+        try:
+            job = _agent_request("GET", f"/jobs/{job_id}", timeout=10)
+            sin_respuesta_desde = None
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                # El agente se reinició: el hilo del job terminó con él
+                return {"success": False, "error": f"Job {job_id} perdido (agente reiniciado)"}
+            job = None
+        except (urllib.error.URLError, TimeoutError, ConnectionError, OSError):
+            job = None
+
+        if job is not None and job.get("status") == "done":
+            data = job.get("result") or {}
+            tracing.exportar(data.pop("spans", None) or [])
+            print(f"[OPENSTACK-AGENT] ✅ {script_name} completado "
+                  f"(job {job_id[:8]}, agente: {data.get('agent_elapsed_s', '?')}s)")
+            return {"success": True, "data": data}
+
+        if job is None:
+            sin_respuesta_desde = sin_respuesta_desde or time.time()
+            if time.time() - sin_respuesta_desde > OPENSTACK_JOB_UNREACHABLE_S:
+                return {"success": False, "workflow_en_curso": True, "job_id": job_id,
+                        "error": f"Agente sin respuesta por {OPENSTACK_JOB_UNREACHABLE_S}s (job {job_id})"}
+            # Reabrir el túnel por si cayó el master SSH
+            open_forward(SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE,
+                         OPENSTACK_AGENT_LOCAL_PORT, OPENSTACK_AGENT_PORT, port=OPENSTACK_PORT)
+        elif time.time() > deadline:
+            return {"success": False, "workflow_en_curso": True, "job_id": job_id,
+                    "error": f"Job {job_id} sigue en curso tras {timeout}s"}
+
+def execute_via_openstack_agent(script_name, args_dict, timeout=300, as_job=False):
+    """
+    Ejecuta el workflow en el agente persistente a través del túnel SSH.
+    Retorna None si el agente no está disponible (el caller hace fallback a SSH + python3).
+    Una vez enviado el workflow no se reintenta: podría duplicar la VM.
+    as_job: el agente lo corre en segundo plano y aquí se consulta su estado.
+    """
+    if not open_forward(SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE,
+                        OPENSTACK_AGENT_LOCAL_PORT, OPENSTACK_AGENT_PORT, port=OPENSTACK_PORT):
+        print("[OPENSTACK-AGENT] ⚠️ No se pudo abrir el túnel hacia el agente")
+        return None
+
+    if not _openstack_agent_ready():
+        print("[OPENSTACK-AGENT] ⚠️ Agente no disponible, usando SSH + python3")
+        return None
+
+    try:
+        if as_job:
+            job = _agent_request("POST", f"/jobs/{script_name}", args_dict, timeout=30)
+            print(f"[OPENSTACK-AGENT] {script_name} en segundo plano (job {job['job_id'][:8]})")
+            return _esperar_job_agente(job["job_id"], script_name, timeout)
+        data = _agent_request("POST", f"/workflow/{script_name}", args_dict, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 404 and as_job:
+            # Agente sin /jobs (versión anterior): request síncrono con el mismo plazo
+            return execute_via_openstack_agent(script_name, args_dict, timeout=timeout)
+        if e.code == 404:
+            # Workflow no soportado por el agente → fallback
+            return None
+        return {"success": False, "error": f"Agente respondió HTTP {e.code}"}
+    except urllib.error.URLError as e:
+        # No llegó a conectar: el workflow no se ejecutó
+        _agent_state["last_healthy"] = 0.0
+        print(f"[OPENSTACK-AGENT] ⚠️ Agente no disponible: {e}")
+        return None
+    except (TimeoutError, ConnectionError, OSError) as e:
+        # El workflow ya fue enviado: puede seguir corriendo en el headnode
+        _agent_state["last_healthy"] = 0.0
+        return {"success": False, "workflow_en_curso": True,
+                "error": f"Error esperando respuesta del agente: {e}"}
+
+    # Spans que el agente midió en el headnode (traceparent enviado en el header)
+    tracing.exportar(data.pop("spans", None) or [])
+    print(f"[OPENSTACK-AGENT] ✅ {script_name} completado "
+          f"(agente: {data.get('agent_elapsed_s', '?')}s)")
+    return {"success": True, "data": data}
 
 # --- Helpers OpenStack ---
-def execute_on_openstack_headnode(script_name, args_dict):
+def execute_on_openstack_headnode(script_name, args_dict, timeout=300, as_job=False):
     """
-    Ejecuta un script Python en el headnode de OpenStack vía SSH
+    Ejecuta un workflow en el headnode de OpenStack.
+    Primero intenta el agente persistente; si no está disponible,
+    ejecuta el script Python vía SSH como antes.
     
     Args:
         script_name: Nombre del script (ej: 'deploy_vm.py')
         args_dict: Diccionario con argumentos JSON
+        timeout: plazo máximo del workflow (segundos)
+        as_job: en el agente, correrlo en segundo plano y consultar su estado
     
     Returns:
-        dict: Resultado con success, data/error
+        dict: Resultado con success, data/error (workflow_en_curso si puede seguir corriendo)
     """
-    # Serializar argumentos como JSON
-    args_json = json.dumps(args_dict).replace('"', '\\"')
-    
-    # Comando SSH para ejecutar script remoto
-    cmd = (
-        f"ssh -i {SSH_KEY_OPENSTACK} "
-        f"-o BatchMode=yes -o StrictHostKeyChecking=no "
-        f"-p {OPENSTACK_PORT} "
-        f"{USER_OPENSTACK}@{OPENSTACK_HEADNODE} "
-        f"\"cd {OPENSTACK_SCRIPTS_PATH} && python3 {script_name} '{args_json}'\""
-    )
+    with tracing.span(f"headnode.{script_name}", headnode="openstack"):
+        if OPENSTACK_AGENT_ENABLED:
+            agent_result = execute_via_openstack_agent(script_name, args_dict, timeout=timeout, as_job=as_job)
+            if agent_result is not None:
+                return agent_result
+
+        # Comando remoto (la conexión SSH se reutiliza vía ControlMaster).
+        # Los argumentos van por stdin: un slice completo no cabe cómodo en la línea de comandos
+        remote_cmd = f"\"cd {OPENSTACK_SCRIPTS_PATH} && python3 {script_name}\""
     
-    print(f"[OPENSTACK] Ejecutando: {script_name}")
+        print(f"[OPENSTACK] Ejecutando: {script_name}")
     
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=300)
+        try:
+            result = run_ssh(SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE, remote_cmd,
+                             port=OPENSTACK_PORT, timeout=timeout, input_data=json.dumps(args_dict))
+        except subprocess.TimeoutExpired:
+            return {"success": False, "workflow_en_curso": True,
+                    "error": f"{script_name} no terminó en {timeout}s"}
     
-    print(f"[OPENSTACK] Return code: {result.returncode}")
+        print(f"[OPENSTACK] Return code: {result.returncode}")
     
-    if result.returncode == 0:
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
+        if result.returncode == 0:
+            stdout = result.stdout.strip()
+            stderr = result.stderr.strip()
         
-        print(f"[OPENSTACK] STDOUT length: {len(stdout)} chars")
+            print(f"[OPENSTACK] STDOUT length: {len(stdout)} chars")
         
-        print(f"[OPENSTACK] ================== STDOUT COMPLETO ==================")
-        print(stdout)
-        print(f"[OPENSTACK] ======================= FIN =======================")
+            print(f"[OPENSTACK] ================== STDOUT COMPLETO ==================")
+            print(stdout)
+            print(f"[OPENSTACK] ======================= FIN =======================")
         
-        if stderr:
-            print(f"[OPENSTACK] ================== STDERR ==================")
-            print(stderr)
-            print(f"[OPENSTACK] ==================== FIN ====================")
+            if stderr:
+                print(f"[OPENSTACK] ================== STDERR ==================")
+                print(stderr)
+                print(f"[OPENSTACK] ==================== FIN ====================")
         
-        # ESTRATEGIA MEJORADA: Buscar JSON en múltiples formas
+            # ESTRATEGIA MEJORADA: Buscar JSON en múltiples formas
         
-        # Método 1: Intentar parsear la última línea (JSON compacto)
-        try:
-            last_line = stdout.split('\n')[-1].strip()
-            if last_line.startswith('{') and last_line.endswith('}'):
-                response_data = json.loads(last_line)
-                print(f"[OPENSTACK] ✅ JSON parseado (método: última línea)")
-                return {"success": True, "data": response_data}
-        except (json.JSONDecodeError, IndexError):
-            pass
+            # Método 1: Intentar parsear la última línea (JSON compacto)
+            try:
+                last_line = stdout.split('\n')[-1].strip()
+                if last_line.startswith('{') and last_line.endswith('}'):
+                    response_data = json.loads(last_line)
+                    print(f"[OPENSTACK] ✅ JSON parseado (método: última línea)")
+                    return {"success": True, "data": response_data}
+            except (json.JSONDecodeError, IndexError):
+                pass
         
-        # Método 2: Buscar bloques JSON multi-línea
-        try:
-            lines = stdout.split('\n')
-            json_start = -1
-            brace_count = 0
+            # Método 2: Buscar bloques JSON multi-línea
+            try:
+                lines = stdout.split('\n')
+                json_start = -1
+                brace_count = 0
             
-            # Buscar el último bloque JSON válido
-            for i in range(len(lines) - 1, -1, -1):
-                line = lines[i].strip()
+                # Buscar el último bloque JSON válido
+                for i in range(len(lines) - 1, -1, -1):
+                    line = lines[i].strip()
                 
-                if line.endswith('}'):
-                    json_start = i
-                    # Contar hacia atrás para encontrar el inicio
-                    for j in range(i, -1, -1):
-                        l = lines[j].strip()
-                        if l.startswith('{'):
-                            json_block = '\n'.join(lines[j:i+1])
-                            response_data = json.loads(json_block)
-                            print(f"[OPENSTACK] ✅ JSON parseado (método: multi-línea)")
-                            return {"success": True, "data": response_data}
-        except (json.JSONDecodeError, IndexError):
-            pass
+                    if line.endswith('}'):
+                        json_start = i
+                        # Contar hacia atrás para encontrar el inicio
+                        for j in range(i, -1, -1):
+                            l = lines[j].strip()
+                            if l.startswith('{'):
+                                json_block = '\n'.join(lines[j:i+1])
+                                response_data = json.loads(json_block)
+                                print(f"[OPENSTACK] ✅ JSON parseado (método: multi-línea)")
+                                return {"success": True, "data": response_data}
+            except (json.JSONDecodeError, IndexError):
+                pass
         
-        # Método 3: Concatenar todo el stdout y buscar JSON
-        try:
-            # Eliminar líneas de log/print que no son JSON
-            clean_lines = []
-            for line in stdout.split('\n'):
-                stripped = line.strip()
-                # Incluir solo líneas que parecen JSON
-                if stripped and (stripped.startswith('{') or stripped.startswith('"') or 
-                               stripped.startswith('[') or stripped.startswith('}')):
-                    clean_lines.append(stripped)
+            # Método 3: Concatenar todo el stdout y buscar JSON
+            try:
+                # Eliminar líneas de log/print que no son JSON
+                clean_lines = []
+                for line in stdout.split('\n'):
+                    stripped = line.strip()
+                    # Incluir solo líneas que parecen JSON
+                    if stripped and (stripped.startswith('{') or stripped.startswith('"') or 
+                                   stripped.startswith('[') or stripped.startswith('}')):
+                        clean_lines.append(stripped)
             
-            if clean_lines:
-                json_str = ' '.join(clean_lines)
-                response_data = json.loads(json_str)
-                print(f"[OPENSTACK] ✅ JSON parseado (método: concatenación)")
-                return {"success": True, "data": response_data}
-        except json.JSONDecodeError:
-            pass
+                if clean_lines:
+                    json_str = ' '.join(clean_lines)
+                    response_data = json.loads(json_str)
+                    print(f"[OPENSTACK] ✅ JSON parseado (método: concatenación)")
+                    return {"success": True, "data": response_data}
+            except json.JSONDecodeError:
+                pass
         
-        # Si ningún método funcionó, mostrar el stdout para debug
-        print(f"[OPENSTACK] ⚠️ No se pudo parsear JSON. Stdout completo:")
-        print(stdout[:500])  # Primeros 500 caracteres
+            # Si ningún método funcionó, mostrar el stdout para debug
+            print(f"[OPENSTACK] ⚠️ No se pudo parsear JSON. Stdout completo:")
+            print(stdout[:500])  # Primeros 500 caracteres
         
-        return {
-            "success": False,
-            "error": "No se pudo parsear respuesta JSON del workflow",
-            "raw_output": stdout[:200]
-        }
-    else:
-        print(f"[OPENSTACK] ❌ Error en ejecución SSH")
-        print(f"[OPENSTACK] STDERR: {result.stderr}")
-        print(f"[OPENSTACK] STDOUT: {result.stdout}")  # También mostrar stdout en caso de error
-        return {
-            "success": False,
-            "error": result.stderr.strip() or result.stdout.strip(),
-            "returncode": result.returncode
-        }
+            return {
+                "success": False,
+                "error": "No se pudo parsear respuesta JSON del workflow",
+                "raw_output": stdout[:200]
+            }
+        else:
+            print(f"[OPENSTACK] ❌ Error en ejecución SSH")
+            print(f"[OPENSTACK] STDERR: {result.stderr}")
+            print(f"[OPENSTACK] STDOUT: {result.stdout}")  # También mostrar stdout en caso de error
+            return {
+                "success": False,
+                "error": result.stderr.strip() or result.stdout.strip(),
+                "returncode": result.returncode
+            }
 
 # --- Helpers Linux (HEADNODE) ---
 def execute_on_linux_headnode(script_name, args_dict):
@@ -153,50 +351,53 @@ def execute_on_linux_headnode(script_name, args_dict):
     Returns:
         dict: Resultado con success, data/error
     """
-    # Serializar argumentos como JSON escapando comillas
-    args_json = json.dumps(args_dict).replace('"', '\\"')
-
-    cmd = (
-        f"ssh -i {SSH_KEY_LINUXHN} "
-        f"-o BatchMode=yes -o StrictHostKeyChecking=no "
-        f"-p {LINUX_PORT} "
-        f"{USER_LINUXHN}@{LINUX_HEADNODE} "
-        f"\"cd {LINUX_SCRIPTS_PATH} && python3 {script_name} '{args_json}'\""
-    )
+    with tracing.span(f"headnode.{script_name}", headnode="linux", worker=args_dict.get("worker")) as span:
+        # El script continúa la traza con este traceparent y devuelve sus spans en el JSON
+        args_dict = {**args_dict, "traceparent": span.traceparent()}
+        # Serializar argumentos como JSON escapando comillas
+        args_json = json.dumps(args_dict).replace('"', '\\"')
 
-    print(f"[LINUX-HN] Ejecutando: {script_name}")
-    # Puedes poner timeout más corto si quieres
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=300)
+        remote_cmd = f"\"cd {LINUX_SCRIPTS_PATH} && python3 {script_name} '{args_json}'\""
 
-    print(f"[LINUX-HN] Return code: {result.returncode}")
+        print(f"[LINUX-HN] Ejecutando: {script_name}")
+        # Puedes poner timeout más corto si quieres
+        result = run_ssh(SSH_KEY_LINUXHN, USER_LINUXHN, LINUX_HEADNODE, remote_cmd,
+                         port=LINUX_PORT, timeout=300)
 
-    if result.returncode != 0:
-        print(f"[LINUX-HN] ❌ Error en ejecución SSH")
-        print(f"[LINUX-HN] STDERR: {result.stderr}")
-        return {
-            "success": False,
-            "error": result.stderr.strip() or result.stdout.strip(),
-            "returncode": result.returncode
-        }
+        print(f"[LINUX-HN] Return code: {result.returncode}")
 
-    stdout = result.stdout.strip()
-    print(f"[LINUX-HN] STDOUT length: {len(stdout)} chars")
+        if result.returncode != 0:
+            print(f"[LINUX-HN] ❌ Error en ejecución SSH")
+            print(f"[LINUX-HN] STDERR: {result.stderr}")
+            span.status = "error"
+            return {
+                "success": False,
+                "error": result.stderr.strip() or result.stdout.strip(),
+                "returncode": result.returncode
+            }
 
-    # Aquí asumimos que el script del headnode imprime UN JSON limpio
-    try:
-        data = json.loads(stdout)
-        return {
-            "success": True,
-            "data": data
-        }
-    except json.JSONDecodeError:
-        print(f"[LINUX-HN] ⚠️ No se pudo parsear JSON. Stdout:")
-        print(stdout[:500])
-        return {
-            "success": False,
-            "error": "No se pudo parsear respuesta JSON del headnode Linux",
-            "raw_output": stdout[:200]
-        }
+        stdout = result.stdout.strip()
+        print(f"[LINUX-HN] STDOUT length: {len(stdout)} chars")
+
+        # Aquí asumimos que el script del headnode imprime UN JSON limpio
+        try:
+            data = json.loads(stdout)
+            # Spans que el script midió en el headnode/worker (no tiene acceso al archivo de trazas)
+            if isinstance(data, dict):
+                tracing.exportar(data.pop("spans", None) or [])
+            return {
+                "success": True,
+                "data": data
+            }
+        except json.JSONDecodeError:
+            print(f"[LINUX-HN] ⚠️ No se pudo parsear JSON. Stdout:")
+            print(stdout[:500])
+            span.status = "error"
+            return {
+                "success": False,
+                "error": "No se pudo parsear respuesta JSON del headnode Linux",
+                "raw_output": stdout[:200]
+            }
 
 # --- Endpoint Principal: Crear VM ---
 @app.post("/create_vm")
@@ -225,7 +426,8 @@ async def create_vm_linux(data):
     vlans = data.get("vlans", [])
     puerto_vnc = str(data.get("puerto_vnc"))
     imagen = data.get("imagen", "cirros-base.qcow2")
-    ram_mb = str(parse_ram_to_mb(data.get("ram_gb", 1)))
+    # slice_manager envía ram_mb (columna numérica); ram_gb queda por compatibilidad
+    ram_mb = str(int(data["ram_mb"])) if data.get("ram_mb") else str(parse_ram_to_mb(data.get("ram_gb", 1)))
     cpus = str(int(data.get("cpus", 1)))
     disco_gb = str(int(data.get("disco_gb", 10)))
 
@@ -422,6 +624,91 @@ async def create_vm_openstack(data):
         "steps_completed": vm_info.get("steps_completed", [])
     }
 
+# --- Endpoint: Crear Slice OpenStack (dos fases) ---
+def _map_openstack_vm_result(vm_info):
+    """Adapta el resultado por VM del workflow al formato de create_vm_openstack"""
+    nombre_vm = vm_info.get("nombre_vm")
+    if not vm_info.get("success", False):
+        return {
+            "success": False,
+            "status": False,
+            "platform": "openstack",
+            "nombre_vm": nombre_vm,
+            "message": f"Falló despliegue OpenStack de {nombre_vm}",
+            "error": vm_info.get("error", "Error desconocido en workflow"),
+            "error_type": vm_info.get("error_type"),
+            "should_rollback": vm_info.get("should_rollback", False),
+            "instance_id": vm_info.get("instance_id"),
+            "details": vm_info
+        }
+
+    return {
+        "success": True,
+        "status": True,
+        "platform": "openstack",
+        "nombre_vm": nombre_vm,
+        "message": f"VM {nombre_vm} desplegada en OpenStack",
+        "instance_id": vm_info.get("instance_id"),
+        "console_url": vm_info.get("console_url"),
+        "networks": vm_info.get("networks", []),
+        "ports": vm_info.get("ports", []),
+        "flavor_id": vm_info.get("flavor_id"),
+        "flavor_created": vm_info.get("flavor_created", False),
+        "project_id": vm_info.get("project_id"),
+        "topology_validation": vm_info.get("topology_validation", {}),
+        "steps_completed": vm_info.get("steps_completed", [])
+    }
+
+@app.post("/create_slice_openstack")
+async def create_slice_openstack(request: Request):
+    """
+    Despliega todas las VMs de un slice en una sola llamada al headnode:
+    proyecto, redes y flavors se crean una vez (fase 1) y luego solo
+    puertos + instancias por VM (fase 2).
+    """
+    data = await request.json()
+    slice_id = data.get("slice_id")
+    vms = data.get("vms", [])
+
+    if not slice_id or not vms:
+        return {"success": False, "error": "Faltan parámetros: slice_id, vms"}
+
+    timeout = slice_deploy_timeout(len(vms))
+    print(f"[OPENSTACK] Desplegando slice {slice_id} ({len(vms)} VMs) en dos fases (plazo {timeout}s)...")
+    # En un hilo: el despliegue dura minutos y no debe bloquear el event loop del driver
+    result = await asyncio.to_thread(
+        execute_on_openstack_headnode, "deploy_slice_workflow.py",
+        {"slice_id": slice_id, "vms": vms}, timeout=timeout, as_job=True
+    )
+
+    if not result["success"]:
+        return {
+            "success": False,
+            "platform": "openstack",
+            "message": f"Falló comunicación con headnode para slice {slice_id}",
+            "error": result.get("error", "Error de comunicación"),
+            "workflow_en_curso": result.get("workflow_en_curso", False),
+            "job_id": result.get("job_id"),
+            "vms": []
+        }
+
+    slice_info = result["data"]
+    vm_results = [_map_openstack_vm_result(vm_info) for vm_info in slice_info.get("vms", [])]
+
+    print(f"[OPENSTACK] Slice {slice_id}: "
+          f"{sum(1 for r in vm_results if r['success'])}/{len(vms)} VMs OK "
+          f"(timings: {slice_info.get('timings', {})})")
+
+    return {
+        "success": slice_info.get("success", False),
+        "platform": "openstack",
+        "slice_id": slice_id,
+        "project_id": slice_info.get("project_id"),
+        "error": slice_info.get("error"),
+        "timings": slice_info.get("timings", {}),
+        "vms": vm_results
+    }
+
 # --- Endpoint: Eliminar VM ---
 @app.post("/delete_vm")
 async def delete_vm(request: Request):
@@ -440,6 +727,10 @@ async def delete_vm_linux(data):
     """Eliminación en Linux (código corregido con búsqueda automática de TAPs)"""
     nombre_vm = data.get("nombre_vm")
     worker_ip = data.get("worker_ip") or data.get("worker")
+
+    # Batch: varias VMs del mismo worker en un solo teardown remoto
+    if data.get("vms"):
+        return await delete_vms_linux_batch(worker_ip, data["vms"])
     process_id = data.get("process_id")
     interfaces_tap = data.get("interfaces_tap", [])
     delete_disk = data.get("delete_disk", False)
@@ -493,6 +784,47 @@ async def delete_vm_linux(data):
     }
     
 
+async def delete_vms_linux_batch(worker_ip, vms):
+    """Elimina varias VMs de un mismo worker con una sola conexión headnode → worker"""
+    if not worker_ip:
+        return {"success": False, "error": "Falta parámetro: worker_ip"}
+
+    delete_args = {
+        "worker": worker_ip,
+        "vms": [
+            {
+                "nombre_vm": vm.get("nombre_vm"),
+                "process_id": vm.get("process_id"),
+                "interfaces_tap": vm.get("interfaces_tap", []),
+                "delete_disk": vm.get("delete_disk", False)
+            }
+            for vm in vms
+        ]
+    }
+
+    print(f"[LINUX] Enviando teardown batch de {len(vms)} VMs al worker {worker_ip}...")
+    result = execute_on_linux_headnode("delete_vm_linux.py", delete_args)
+
+    if not result["success"]:
+        return {
+            "success": False,
+            "status": False,
+            "platform": "linux",
+            "mensaje": f"Falló comunicación con headnode Linux (batch {worker_ip})",
+            "error": result.get("error", "Error desconocido"),
+            "details": result
+        }
+
+    info = result["data"]
+    return {
+        "success": info.get("success", False),
+        "status": info.get("success", False),
+        "platform": "linux",
+        "mensaje": f"Teardown batch en {worker_ip}: {info.get('total', 0)} VMs",
+        "results": info.get("results", []),
+        "error": info.get("error")
+    }
+
 async def delete_vm_openstack(data):
     """Eliminación en OpenStack"""
     nombre_vm = data.get("nombre_vm")
@@ -528,8 +860,8 @@ async def delete_vm_openstack(data):
 @app.post("/delete_project_openstack")
 async def delete_project_openstack(request: Request):
     """
-    Elimina un proyecto completo de OpenStack ejecutando el script bash
-    en el headnode.
+    Elimina un proyecto completo de OpenStack con el workflow de teardown
+    por API del headnode (olas: servidores → puertos → routers → subredes → redes → proyecto).
     """
     data = await request.json()
     project_name = data.get("project_name")
@@ -543,122 +875,58 @@ async def delete_project_openstack(request: Request):
     
     print(f"[OPENSTACK] Eliminando proyecto: {project_name}")
     
-    # Comando con carga de credenciales de OpenStack
-    delete_cmd = (
-        f"source /home/ubuntu/env-scripts/cloud-admin-openrc && "
-        f"cd {OPENSTACK_SCRIPTS_PATH} && "
-        f"./delete_project.sh {project_name}"
-    )
-    
-    cmd_ssh = (
-        f"ssh -i {SSH_KEY_OPENSTACK} "
-        f"-o BatchMode=yes -o StrictHostKeyChecking=no "
-        f"-p {OPENSTACK_PORT} "
-        f"{USER_OPENSTACK}@{OPENSTACK_HEADNODE} "
-        f"\"{delete_cmd}\""
+    # En un hilo: esperar a que Nova borre las instancias no debe bloquear el event loop
+    result = await asyncio.to_thread(
+        execute_on_openstack_headnode, "delete_project_workflow.py",
+        {"project_name": project_name, "slice_id": slice_id}, timeout=PROJECT_TEARDOWN_TIMEOUT
     )
     
-    try:
-        result = subprocess.run(
-            cmd_ssh, 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            timeout=180
-        )
-        
-        stdout = result.stdout.strip()
-        stderr = result.stderr.strip()
-        
-        print(f"[OPENSTACK] Return code: {result.returncode}")
-        print(f"[OPENSTACK] STDOUT: {stdout[:500]}")
-        
-        if result.returncode == 0:
-            
-            success_indicators = [
-                "🎉 Proyecto",
-                "eliminado completamente",
-                "successfully deleted",
-                "project deleted"
-            ]
-            
-            is_success = any(indicator in stdout for indicator in success_indicators)
-            
-            
-            details = {
-                "instancias_eliminadas": stdout.count("Eliminando instancia"),
-                "puertos_eliminados": stdout.count("Eliminando puerto"),
-                "subredes_eliminadas": stdout.count("Eliminando subred"),
-                "redes_eliminadas": stdout.count("Eliminando red"),
-                "log_completo": stdout
-            }
-            
-            if is_success:
-                print(f"[OPENSTACK] Proyecto {project_name} eliminado exitosamente")
-                print(f"[OPENSTACK]    • {details['instancias_eliminadas']} instancias")
-                print(f"[OPENSTACK]    • {details['puertos_eliminados']} puertos")
-                print(f"[OPENSTACK]    • {details['subredes_eliminadas']} subredes")
-                print(f"[OPENSTACK]    • {details['redes_eliminadas']} redes")
-                
-                return {
-                    "success": True,
-                    "message": f"Proyecto {project_name} eliminado completamente",
-                    "project_name": project_name,
-                    "slice_id": slice_id,
-                    "details": details
-                }
-            else:
-                # El script se ejecutó pero no muestra mensaje de éxito
-                warning_msg = "Script ejecutado pero sin confirmación de éxito"
-                print(f"[OPENSTACK] {warning_msg}")
-                
-                return {
-                    "success": False,
-                    "error": warning_msg,
-                    "details": {
-                        "stdout": stdout,
-                        "stderr": stderr
-                    }
-                }
-        else:
-            # Error en la ejecución
-            error_msg = stderr if stderr else stdout
-            
-            # Casos especiales
-            if "no encontrado" in error_msg.lower() or "not found" in error_msg.lower():
-                print(f"[OPENSTACK] Proyecto {project_name} no encontrado")
-                return {
-                    "success": True,  # Consideramos éxito si ya no existe
-                    "message": f"Proyecto {project_name} no existe (posiblemente ya eliminado)",
-                    "warning": "Proyecto no encontrado",
-                    "details": {"stdout": stdout, "stderr": stderr}
-                }
-            
-            print(f"[OPENSTACK] Error: {error_msg[:200]}")
-            
-            return {
-                "success": False,
-                "error": f"Fallo al ejecutar script: {error_msg[:200]}",
-                "returncode": result.returncode,
-                "details": {
-                    "stdout": stdout,
-                    "stderr": stderr
-                }
-            }
-            
-    except subprocess.TimeoutExpired:
-        print(f"[OPENSTACK] Timeout eliminando proyecto {project_name}")
+    if not result["success"]:
+        print(f"[OPENSTACK] Error: {result.get('error')}")
         return {
             "success": False,
-            "error": "Timeout al eliminar proyecto (>180s)",
-            "message": "La eliminación está tardando demasiado, verifique manualmente en el headnode"
+            "error": f"Falló comunicación con headnode: {result.get('error', 'Error de comunicación')}"
         }
-    except Exception as e:
-        print(f"[OPENSTACK] Excepción: {e}")
+    
+    teardown = result["data"]
+    details = teardown.get("details", {})
+    
+    if teardown.get("not_found"):
+        print(f"[OPENSTACK] Proyecto {project_name} no encontrado")
+        return {
+            "success": True,  # Consideramos éxito si ya no existe
+            "message": teardown.get("message"),
+            "warning": "Proyecto no encontrado",
+            "project_name": project_name,
+            "slice_id": slice_id,
+            "details": details
+        }
+    
+    if not teardown.get("success"):
+        print(f"[OPENSTACK] Error: {teardown.get('error')}")
         return {
             "success": False,
-            "error": str(e)
+            "error": teardown.get("error", "Error desconocido en teardown"),
+            "project_name": project_name,
+            "slice_id": slice_id,
+            "details": details,
+            "errors": teardown.get("errors", []),
+            "timings": teardown.get("timings", {})
         }
+    
+    print(f"[OPENSTACK] Proyecto {project_name} eliminado exitosamente "
+          f"({teardown.get('timings', {}).get('total_s', '?')}s)")
+    for recurso, cantidad in details.items():
+        print(f"[OPENSTACK]    • {recurso}: {cantidad}")
+    
+    return {
+        "success": True,
+        "message": f"Proyecto {project_name} eliminado completamente",
+        "project_name": project_name,
+        "slice_id": slice_id,
+        "details": details,
+        "timings": teardown.get("timings", {})
+    }
 
 # --- Endpoints informativos ---
 @app.get("/")
@@ -687,13 +955,8 @@ def health():
     # Verificar conectividad con OpenStack headnode
     openstack_reachable = False
     try:
-        test_cmd = (
-            f"ssh -i {SSH_KEY_OPENSTACK} "
-            f"-o BatchMode=yes -o StrictHostKeyChecking=no -o ConnectTimeout=5 "
-            f"-p {OPENSTACK_PORT} "
-            f"{USER_OPENSTACK}@{OPENSTACK_HEADNODE} 'echo OK'"
-        )
-        result = subprocess.run(test_cmd, shell=True, capture_output=True, text=True, timeout=10)
+        result = run_ssh(SSH_KEY_OPENSTACK, USER_OPENSTACK, OPENSTACK_HEADNODE, "'echo OK'",
+                         port=OPENSTACK_PORT, timeout=10)
         openstack_reachable = result.returncode == 0 and "OK" in result.stdout
     except Exception as e:
         print(f"[HEALTH] Error verificando OpenStack: {e}")
@@ -704,5 +967,6 @@ def health():
         "platforms": {
             "linux": "operational",
             "openstack": "operational" if openstack_reachable else "unreachable"
-        }
+        },
+        "ssh_masters": masters_status()
     }
\ No newline at end of file
@@ -0,0 +1,196 @@
+import os
+import subprocess
+import threading
+import time
+
+# ======================================
+# CONFIGURACIÓN MULTIPLEXACIÓN SSH
+# ======================================
+# Cada conexión (usuario@host:puerto) mantiene un proceso "master" de OpenSSH
+# (ControlMaster). Las llamadas siguientes reutilizan su socket y se saltan
+# TCP + key exchange + autenticación.
+SSH_CONTROL_DIR = os.getenv("SSH_CONTROL_DIR", "/tmp/ssh-mux")
+SSH_CONTROL_PERSIST = int(os.getenv("SSH_CONTROL_PERSIST", "600"))   # segundos ociosos antes de cerrar el master
+SSH_CONNECT_TIMEOUT = int(os.getenv("SSH_CONNECT_TIMEOUT", "10"))
+SSH_HEALTH_INTERVAL = int(os.getenv("SSH_HEALTH_INTERVAL", "30"))    # segundos entre checks del master
+
+os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+
+# Estado de cada master: {"user@host:port": {"last_used", "last_check", "alive", ...}}
+_masters = {}
+_masters_lock = threading.Lock()
+_host_locks = {}
+
+
+def _conn_key(user, host, port):
+    return f"{user}@{host}:{port}"
+
+
+def _host_lock(key):
+    with _masters_lock:
+        if key not in _host_locks:
+            _host_locks[key] = threading.Lock()
+        return _host_locks[key]
+
+
+def _control_opts():
+    """Opciones comunes: %C es un hash de (local, host, puerto, usuario) → ruta corta y única"""
+    return (
+        f"-o ControlPath={SSH_CONTROL_DIR}/%C "
+        f"-o ControlPersist={SSH_CONTROL_PERSIST} "
+        f"-o ServerAliveInterval=15 -o ServerAliveCountMax=3"
+    )
+
+
+def _base_cmd(key_path, user, host, port=None):
+    port_opt = f"-p {port} " if port else ""
+    return (
+        f"ssh -i {key_path} "
+        f"-o BatchMode=yes -o StrictHostKeyChecking=no "
+        f"-o ConnectTimeout={SSH_CONNECT_TIMEOUT} "
+        f"{_control_opts()} "
+        f"{port_opt}"
+    )
+
+
+def check_master(key_path, user, host, port=None):
+    """Health check del master: `ssh -O check` no abre una conexión nueva"""
+    cmd = f"{_base_cmd(key_path, user, host, port)}-O check {user}@{host}"
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
+    return result.returncode == 0
+
+
+def open_master(key_path, user, host, port=None):
+    """
+    Levanta el master en background (-f -N -M).
+    stdout/stderr a DEVNULL: si el master heredara los pipes de capture_output,
+    subprocess.run quedaría esperando EOF hasta que el master muera.
+    """
+    cmd = f"{_base_cmd(key_path, user, host, port)}-o ControlMaster=yes -f -N {user}@{host}"
+    result = subprocess.run(
+        cmd, shell=True,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        timeout=SSH_CONNECT_TIMEOUT + 5
+    )
+    return result.returncode == 0
+
+
+def close_master(key_path, user, host, port=None):
+    cmd = f"{_base_cmd(key_path, user, host, port)}-O exit {user}@{host}"
+    subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
+    with _masters_lock:
+        _masters.pop(_conn_key(user, host, port), None)
+
+
+def ensure_master(key_path, user, host, port=None):
+    """
+    Garantiza un master vivo para user@host:port.
+    El check se cachea SSH_HEALTH_INTERVAL segundos para no pagar un proceso extra por llamada.
+    """
+    key = _conn_key(user, host, port)
+    now = time.time()
+
+    with _masters_lock:
+        state = _masters.get(key)
+        if state and state["alive"] and now - state["last_check"] < SSH_HEALTH_INTERVAL:
+            return True
+
+    with _host_lock(key):
+        alive = False
+        try:
+            alive = check_master(key_path, user, host, port)
+            if not alive:
+                print(f"[SSH-MUX] Abriendo master hacia {key}...")
+                alive = open_master(key_path, user, host, port)
+                print(f"[SSH-MUX] {'✅ Master listo' if alive else '⚠️ No se pudo abrir master'} ({key})")
+        except subprocess.TimeoutExpired:
+            print(f"[SSH-MUX] ⚠️ Timeout verificando master {key}")
+
+        with _masters_lock:
+            state = _masters.setdefault(key, {
+                "target": (key_path, user, host, port),
+                "opened_at": now,
+                "last_used": now,
+                "calls": 0
+            })
+            state["alive"] = alive
+            state["last_check"] = time.time()
+
+    return alive
+
+
+def run_ssh(key_path, user, host, remote_cmd, port=None, timeout=300, input_data=None):
+    """
+    Ejecuta remote_cmd en user@host reutilizando el master.
+    Si el master no está disponible, ControlMaster=no hace que ssh
+    caiga a una conexión directa en lugar de fallar.
+    input_data se envía por stdin (argumentos grandes fuera de la línea de comandos).
+    """
+    ensure_master(key_path, user, host, port)
+
+    cmd = (
+        f"{_base_cmd(key_path, user, host, port)}-o ControlMaster=no "
+        f"{user}@{host} {remote_cmd}"
+    )
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout,
+                            input=input_data)
+
+    with _masters_lock:
+        state = _masters.get(_conn_key(user, host, port))
+        if state:
+            state["last_used"] = time.time()
+            state["calls"] += 1
+
+    return result
+
+
+def open_forward(key_path, user, host, local_port, remote_port, port=None, remote_host="127.0.0.1"):
+    """
+    Agrega un túnel local (-L) sobre el master ya abierto: no crea una conexión nueva.
+    Si el puerto local ya está reenviado, ssh devuelve error y lo tratamos como OK.
+    """
+    if not ensure_master(key_path, user, host, port):
+        return False
+    cmd = (
+        f"{_base_cmd(key_path, user, host, port)}-O forward "
+        f"-L 127.0.0.1:{local_port}:{remote_host}:{remote_port} {user}@{host}"
+    )
+    result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
+    return result.returncode == 0 or "already" in result.stderr.lower()
+
+
+def evict_idle_masters():
+    """
+    Cierra masters sin uso desde hace más de SSH_CONTROL_PERSIST segundos.
+    OpenSSH ya los cierra solo (ControlPersist); esto limpia el registro local
+    y fuerza el cierre si el master quedó colgado.
+    """
+    now = time.time()
+    with _masters_lock:
+        idle = [k for k, s in _masters.items() if now - s["last_used"] > SSH_CONTROL_PERSIST]
+    for key in idle:
+        with _masters_lock:
+            state = _masters.get(key)
+        if state:
+            try:
+                close_master(*state["target"])
+            except subprocess.TimeoutExpired:
+                with _masters_lock:
+                    _masters.pop(key, None)
+            print(f"[SSH-MUX] Master ocioso cerrado: {key}")
+    return idle
+
+
+def masters_status():
+    """Snapshot del estado de los masters para /health"""
+    now = time.time()
+    with _masters_lock:
+        return {
+            key: {
+                "alive": s["alive"],
+                "calls": s["calls"],
+                "idle_s": round(now - s["last_used"], 1),
+                "age_s": round(now - s["opened_at"], 1)
+            }
+            for key, s in _masters.items()
+        }
@@ -0,0 +1,122 @@
+"""
+Historial corto por host en memoria (ring buffer de tamaño fijo).
+
+Cada host tiene arreglos compactos preasignados (array('d') para el timestamp,
+array('f') para cada métrica): HISTORY_SIZE muestras ocupan ~HISTORY_SIZE * 24
+bytes por host, sin un dict por muestra. Las consultas por rango recorren
+desde la muestra más nueva hacia atrás, así que cuestan O(ventana).
+"""
+import os
+import threading
+from array import array
+
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", "360"))      # 360 x 10s = 1h
+
+# Campo de la muestra del daemon → arreglo float32
+HISTORY_FIELDS = ["cpu_percent", "ram_percent", "disk_percent", "disk_free_gb", "qemu_count"]
+
+
+class HostRing:
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.head = 0            # próxima posición a escribir
+        self.count = 0
+        self.ts = array('d', [0.0]) * size
+        self.values = {field: array('f', [0.0]) * size for field in HISTORY_FIELDS}
+
+    def append(self, ts, sample):
+        """
+        Agrega la muestra en orden cronológico. Una muestra atrasada (replay del
+        spool del daemon) se inserta en su posición corriendo una vez las más
+        nuevas; si es más vieja que todo el ring lleno, no entra.
+        """
+        if self.count and ts < self.ts[(self.head - 1) % self.size]:
+            return self._insert(ts, sample)
+        self._write(self.head, ts, sample)
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        return True
+
+    def _write(self, i, ts, sample):
+        self.ts[i] = ts
+        for field, values in self.values.items():
+            values[i] = float(sample.get(field) or 0)
+
+    def _insert(self, ts, sample):
+        # Posiciones lógicas 0..count-1 (0 = más vieja); pos = primera con ts mayor
+        oldest = (self.head - self.count) % self.size
+        pos = self.count
+        while pos > 0 and self.ts[(oldest + pos - 1) % self.size] > ts:
+            pos -= 1
+        if self.count == self.size:
+            if pos == 0:
+                return False
+            # Ring lleno: se descarta la más vieja y se corren hacia atrás las anteriores
+            for k in range(pos - 1):
+                self._copy((oldest + k + 1) % self.size, (oldest + k) % self.size)
+            self._write((oldest + pos - 1) % self.size, ts, sample)
+            return True
+        # Se corren hacia adelante las más nuevas y se escribe en el hueco
+        for k in range(self.count, pos, -1):
+            self._copy((oldest + k - 1) % self.size, (oldest + k) % self.size)
+        self._write((oldest + pos) % self.size, ts, sample)
+        self.head = (self.head + 1) % self.size
+        self.count += 1
+        return True
+
+    def _copy(self, src, dst):
+        self.ts[dst] = self.ts[src]
+        for values in self.values.values():
+            values[dst] = values[src]
+
+    def since(self, since_ts=None, fields=None):
+        """Muestras con ts >= since_ts en orden cronológico, como listas por campo"""
+        fields = fields or HISTORY_FIELDS
+        indices = []
+        i = self.head
+        for _ in range(self.count):
+            i = (i - 1) % self.size
+            if since_ts is not None and self.ts[i] < since_ts:
+                break
+            indices.append(i)
+        indices.reverse()
+
+        result = {"timestamps": [self.ts[i] for i in indices]}
+        for field in fields:
+            values = self.values[field]
+            result[field] = [round(values[i], 2) for i in indices]
+        return result
+
+    def oldest_ts(self):
+        if not self.count:
+            return None
+        return self.ts[(self.head - self.count) % self.size]
+
+
+_rings = {}
+_lock = threading.Lock()
+
+
+def record(host, ts, sample):
+    with _lock:
+        ring = _rings.get(host)
+        if ring is None:
+            ring = _rings[host] = HostRing()
+        ring.append(ts, sample)
+
+
+def query(host, since_ts=None, fields=None):
+    """None si el host no tiene historial"""
+    with _lock:
+        ring = _rings.get(host)
+        if ring is None:
+            return None
+        data = ring.since(since_ts, fields)
+        data["oldest_ts"] = ring.oldest_ts()
+        data["capacity"] = ring.size
+        return data
+
+
+def hosts():
+    with _lock:
+        return {host: ring.count for host, ring in _rings.items()}
@@ -1,8 +1,24 @@
 from fastapi import FastAPI, Request
-from datetime import datetime
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 import json
 import asyncio
+import os
+import time
+import zlib
+from typing import Optional
+
+import host_history
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from metrics_bus import Publisher, SAMPLES_EXCHANGE
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional: sin él solo se acepta NDJSON
+    msgpack = None
 
 app = FastAPI()
 
@@ -11,6 +27,130 @@ app = FastAPI()
 # ===========================
 # Diccionario con la última métrica recibida por cada worker
 latest_metrics = {}
+# Timestamp (epoch) de la muestra guardada en latest_metrics por worker
+latest_ts = {}
+
+# Tamaño máximo de un batch ya descomprimido
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", str(8 * 1024 * 1024)))
+
+# ===========================
+# PROMETHEUS
+# ===========================
+PROM_REGISTRY = CollectorRegistry()
+muestras_recibidas = Counter(
+    "monitoring_samples_received_total", "Muestras recibidas de los daemons",
+    ["endpoint"], registry=PROM_REGISTRY
+)
+
+# Campo de la muestra del daemon → (métrica, ayuda)
+WORKER_GAUGES = {
+    "cpu_percent": ("worker_cpu_percent", "Uso de CPU observado del worker (%)"),
+    "cpu_percent_max": ("worker_cpu_percent_max", "Máximo de CPU en la ventana de muestreo (%)"),
+    "cpu_count": ("worker_cpu_count", "Núcleos lógicos del worker"),
+    "ram_percent": ("worker_ram_percent", "Uso de RAM observado del worker (%)"),
+    "ram_total_gb": ("worker_ram_total_gb", "RAM total del worker (GB)"),
+    "disk_percent": ("worker_disk_percent", "Uso de disco observado del worker (%)"),
+    "disk_free_gb": ("worker_disk_free_gb", "Disco libre del worker (GB)"),
+    "qemu_count": ("worker_qemu_count", "Procesos qemu (VMs) corriendo en el worker"),
+}
+VM_GAUGES = {
+    "cpu_percent": ("vm_cpu_percent", "CPU del proceso qemu (% de un núcleo)"),
+    "rss_mb": ("vm_rss_mb", "Memoria residente del proceso qemu (MB)"),
+    "read_bps": ("vm_disk_read_bytes_per_second", "Lectura de disco del proceso qemu"),
+    "write_bps": ("vm_disk_write_bytes_per_second", "Escritura de disco del proceso qemu"),
+    "net_rx_bps": ("vm_net_receive_bytes_per_second", "Tráfico recibido por la VM (TAP)"),
+    "net_tx_bps": ("vm_net_transmit_bytes_per_second", "Tráfico enviado por la VM (TAP)"),
+}
+
+class WorkersCollector:
+    """Gauges por worker y por VM, leídos de latest_metrics en cada scrape"""
+
+    def collect(self):
+        familias = {campo: GaugeMetricFamily(nombre, ayuda, labels=["worker"])
+                    for campo, (nombre, ayuda) in WORKER_GAUGES.items()}
+        vm_familias = {campo: GaugeMetricFamily(nombre, ayuda, labels=["worker", "vm"])
+                       for campo, (nombre, ayuda) in VM_GAUGES.items()}
+        edad = GaugeMetricFamily("worker_sample_age_seconds", "Antigüedad de la última muestra del worker", labels=["worker"])
+
+        ahora = time.time()
+        for hostname, data in list(latest_metrics.items()):
+            for campo, familia in familias.items():
+                if data.get(campo) is not None:
+                    familia.add_metric([hostname], float(data[campo]))
+            edad.add_metric([hostname], ahora - latest_ts.get(hostname, ahora))
+            for vm in data.get("vms") or []:
+                nombre_vm = vm.get("name") or f"pid-{vm.get('pid')}"
+                for campo, familia in vm_familias.items():
+                    if vm.get(campo) is not None:
+                        familia.add_metric([hostname, nombre_vm], float(vm[campo]))
+
+        yield from familias.values()
+        yield edad
+        yield from vm_familias.values()
+
+PROM_REGISTRY.register(WorkersCollector())
+
+# ===========================
+# PUSH: RabbitMQ fanout + SSE
+# ===========================
+METRICS_PUSH_ENABLED = os.getenv("METRICS_PUSH_ENABLED", "true").lower() == "true"
+SSE_QUEUE_SIZE = 100
+
+# Cada muestra recibida se publica en el exchange fanout (analytics se suscribe)
+publisher = Publisher(SAMPLES_EXCHANGE) if METRICS_PUSH_ENABLED else None
+
+# Suscriptores SSE en proceso: una cola acotada por cliente conectado
+sse_subscribers = set()
+
+def publicar_muestra(data: dict, backfill: bool = False):
+    """
+    Entrega la muestra a RabbitMQ y a los clientes SSE sin bloquear el request.
+    backfill=True (muestra atrasada o reenviada del spool): se publica con el
+    header replay para que analytics la archive sin tomarla como estado actual,
+    y no va a SSE, que solo muestra el estado en vivo.
+    """
+    if publisher:
+        publisher.publish(data, {"replay": True} if backfill else None)
+    if backfill:
+        return
+    for cola in list(sse_subscribers):
+        if cola.full():
+            # Cliente lento: se descarta la muestra más vieja
+            try:
+                cola.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        cola.put_nowait(data)
+
+def timestamp_muestra(data: dict):
+    """Epoch de la muestra según el daemon (timestamp_sent en UTC); ahora si no viene"""
+    try:
+        return datetime.fromisoformat(data["timestamp_sent"]).replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+def procesar_muestra(data: dict, ts: float, replay: bool = False):
+    """
+    Registra una muestra: última por worker (si no es más vieja que la actual),
+    historial en memoria (en su posición cronológica) y publicación push.
+
+    Las muestras del spool que el daemon reenvía después de una caída (replay)
+    o que llegan más viejas que la actual se publican como backfill: analytics
+    las archiva, pero no reemplazan el estado actual del worker.
+    """
+    hostname = data.get("hostname", "unknown")
+    data["received_at"] = datetime.now(ZoneInfo("America/Lima")).isoformat()
+    host_history.record(hostname, ts, data)
+    actual = ts >= latest_ts.get(hostname, 0)
+    if actual:
+        latest_metrics[hostname] = data   # almacena la última métrica de este worker
+        latest_ts[hostname] = ts
+    publicar_muestra(data, backfill=replay or not actual)
+    return hostname
+
+def es_replay(request: Request):
+    """El daemon marca con X-Metrics-Replay los envíos que vienen de su spool"""
+    return request.headers.get("x-metrics-replay") == "1"
 
 # ===========================
 # ENDPOINT: recibir métricas de cada worker
@@ -18,13 +158,78 @@ latest_metrics = {}
 @app.post("/metrics")
 async def receive_metrics(request: Request):
     data = await request.json()
-    hostname = data.get("hostname", "unknown")
-    data["received_at"] = datetime.now(ZoneInfo("America/Lima")).isoformat()
-    latest_metrics[hostname] = data   # almacena la última métrica de este worker
+    replay = es_replay(request)
+    hostname = procesar_muestra(data, timestamp_muestra(data) if replay else time.time(), replay)
+    muestras_recibidas.labels("single").inc()
 
     print(f"📡 Métricas recibidas de {hostname}: CPU={data.get('cpu_percent')}%, RAM={data.get('ram_percent')}%")
     return {"status": "ok", "worker": hostname}
 
+# ===========================
+# ENDPOINT: recibir varias muestras en un solo request
+# ===========================
+@app.post("/metrics/batch")
+async def receive_metrics_batch(request: Request):
+    """
+    Batch de muestras de uno o varios workers (buffer o spool del daemon).
+    Content-Type: application/x-ndjson (una muestra JSON por línea) o
+    application/msgpack (arreglo de muestras). Content-Encoding: gzip opcional.
+    """
+    # MAX_BATCH_BYTES acota el cuerpo tal como llega y, con gzip, también descomprimido
+    raw = bytearray()
+    async for chunk in request.stream():
+        raw.extend(chunk)
+        if len(raw) > MAX_BATCH_BYTES:
+            return JSONResponse({"status": "error", "message": "Batch demasiado grande"}, status_code=413)
+    raw = bytes(raw)
+
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            raw = descompresor.decompress(raw, MAX_BATCH_BYTES)
+        except zlib.error as e:
+            return JSONResponse({"status": "error", "message": f"gzip inválido: {e}"}, status_code=400)
+        if descompresor.unconsumed_tail:
+            return JSONResponse({"status": "error", "message": "Batch demasiado grande"}, status_code=413)
+
+    content_type = request.headers.get("content-type", "application/x-ndjson").split(";")[0].strip()
+    rechazadas = 0
+    if content_type in ("application/msgpack", "application/x-msgpack"):
+        if msgpack is None:
+            return JSONResponse({"status": "error", "message": "msgpack no disponible, use NDJSON"}, status_code=415)
+        try:
+            muestras = msgpack.unpackb(raw, raw=False)
+        except Exception as e:
+            return JSONResponse({"status": "error", "message": f"msgpack inválido: {e}"}, status_code=400)
+        if not isinstance(muestras, list):
+            return JSONResponse({"status": "error", "message": "msgpack: se esperaba un arreglo de muestras"}, status_code=400)
+    else:
+        muestras = []
+        for linea in raw.splitlines():
+            if not linea.strip():
+                continue
+            try:
+                muestras.append(json.loads(linea))
+            except ValueError:
+                rechazadas += 1
+
+    replay = es_replay(request)
+    por_worker = {}
+    aceptadas = 0
+    for data in muestras:
+        if not isinstance(data, dict):
+            rechazadas += 1
+            continue
+        hostname = procesar_muestra(data, timestamp_muestra(data), replay)
+        por_worker[hostname] = por_worker.get(hostname, 0) + 1
+        aceptadas += 1
+
+    muestras_recibidas.labels("batch").inc(aceptadas)
+    # Un log por batch, no por muestra
+    print(f"📦 Batch{' (replay)' if replay else ''} recibido: {aceptadas} muestra(s) de {por_worker}" +
+          (f", {rechazadas} rechazada(s)" if rechazadas else ""))
+    return {"status": "ok", "accepted": aceptadas, "rejected": rechazadas, "workers": por_worker}
+
 # ===========================
 # ENDPOINT: devolver métricas actuales de todos los workers
 # ===========================
@@ -45,6 +250,99 @@ def get_latest_metrics():
         "metrics": latest_metrics
     }
 
+# ===========================
+# ENDPOINT: historial corto de un worker (ring buffer en memoria)
+# ===========================
+def parse_since(since: Optional[str]):
+    """Acepta epoch en segundos, ISO 8601 o segundos hacia atrás con signo (-600)"""
+    if since is None or since == "":
+        return None
+    try:
+        valor = float(since)
+        return time.time() + valor if valor < 0 else valor
+    except ValueError:
+        dt = datetime.fromisoformat(since)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=ZoneInfo("America/Lima"))
+        return dt.timestamp()
+
+@app.get("/metrics/{host}/range")
+def get_host_range(host: str, since: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Muestras de un worker desde `since` (máx. HISTORY_SIZE, ~1h a 10s).
+    Ejemplo:
+    curl "http://192.168.201.1:5010/metrics/server2/range?since=-600&fields=cpu_percent,ram_percent"
+    """
+    try:
+        since_ts = parse_since(since)
+    except ValueError:
+        return {"status": "error", "message": f"since inválido: {since}"}
+
+    campos = None
+    if fields:
+        campos = [f.strip() for f in fields.split(",") if f.strip()]
+        invalidos = [f for f in campos if f not in host_history.HISTORY_FIELDS]
+        if invalidos:
+            return {
+                "status": "error",
+                "message": f"Campos inválidos: {', '.join(invalidos)}",
+                "campos_disponibles": host_history.HISTORY_FIELDS
+            }
+
+    data = host_history.query(host, since_ts, campos)
+    if data is None:
+        return {"status": "no_data", "message": f"Sin historial para {host}"}
+
+    return {
+        "status": "ok",
+        "worker": host,
+        "since": since_ts,
+        "count": len(data["timestamps"]),
+        **data
+    }
+
+# ===========================
+# ENDPOINT: stream de muestras (Server-Sent Events)
+# ===========================
+@app.get("/metrics/stream")
+async def stream_metrics(request: Request):
+    """
+    Stream SSE con cada muestra en cuanto llega (primero el estado actual).
+    Ejemplo:
+    curl -N http://192.168.201.1:5010/metrics/stream
+    """
+    cola = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    sse_subscribers.add(cola)
+
+    async def eventos():
+        try:
+            for data in list(latest_metrics.values()):
+                yield f"event: sample\ndata: {json.dumps(data)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(cola.get(), timeout=15)
+                    yield f"event: sample\ndata: {json.dumps(data)}\n\n"
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            sse_subscribers.discard(cola)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics/prometheus")
+def prometheus_metrics():
+    """Métricas en formato de exposición de Prometheus (scrape)"""
+    return Response(generate_latest(PROM_REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/metrics/push/status")
+def push_status():
+    return {
+        "rabbitmq": publisher.stats() if publisher else {"enabled": False},
+        "sse_clients": len(sse_subscribers),
+        "history": host_history.hosts()
+    }
+
 # ===========================
 # EJECUTAR HEADNODE
 # ===========================
@@ -6,6 +6,7 @@ import time
 from sqlalchemy.orm import Session
 from database import SessionLocal
 import network as svc   # tu network.py normal
+import tracing
 
 
 # ==========================
@@ -90,7 +91,12 @@ def main():
                     body_json = json.loads(body.decode())
                     print(f"📩 RPC recibido: {body_json}")
 
-                    response = handle_request(body_json)
+                    # Span hijo del traceparent que trae el mensaje (slice_manager)
+                    traceparent = (props.headers or {}).get("traceparent")
+                    with tracing.span(f"network.{str(body_json.get('action', '')).lower()}", parent=traceparent) as span:
+                        response = handle_request(body_json)
+                        if isinstance(response, dict) and "error" in response:
+                            span.status = "error"
 
                     ch.basic_publish(
                         exchange="",
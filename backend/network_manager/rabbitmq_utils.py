@@ -2,6 +2,7 @@
 import os
 import json
 import pika
+import tracing
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "admin")
@@ -28,7 +29,8 @@ def publish_to_network(message: dict):
         routing_key=QUEUE_NETWORK,
         body=body,
         properties=pika.BasicProperties(
-            delivery_mode=2  # persistente
+            delivery_mode=2,  # persistente
+            headers=tracing.inject_headers()  # traceparent W3C
         ),
     )
     conn.close()
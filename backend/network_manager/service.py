@@ -2,12 +2,14 @@ from fastapi import FastAPI, Depends
 from sqlalchemy.orm import Session
 from database import get_db
 import network as svc
+import tracing
 
 app = FastAPI(
     title="Network & Security Manager",
     version="1.0.0",
     description="Servicio responsable de VLANs, NAT y seguridad de red."
 )
+tracing.instrumentar_fastapi(app)
 
 
 @app.get("/")
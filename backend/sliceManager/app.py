@@ -1,13 +1,16 @@
 from fastapi import FastAPI, Body
 from datetime import datetime
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests, json, os
+import tracing
 from rabbitmq_utils import rpc_call_network
 from rabbitmq_utils import rpc_call_vm_placement
 
 
 app = FastAPI(title="Slice Manager Hybrid", version="4.0")
+# Cada request abre un span (traceparent entrante o traza nueva)
+tracing.instrumentar_fastapi(app)
 
 # ======================================
 # CONFIGURACIÓN BASE DE DATOS Y MONITOREO
@@ -23,6 +26,10 @@ engine = create_engine(DATABASE_URL)
 MONITORING_URL = "http://monitoring_service:5010/metrics"
 NETWORK_BASE = "http://network_manager:8100"
 LINUX_DRIVER_URL = os.getenv("LINUX_DRIVER_URL", "http://linux-driver:9100")
+# Mismo plazo que usa el driver para un slice OpenStack (+ margen para la respuesta)
+SLICE_DEPLOY_TIMEOUT_BASE = int(os.getenv("SLICE_DEPLOY_TIMEOUT_BASE", "300"))
+SLICE_DEPLOY_TIMEOUT_PER_VM = int(os.getenv("SLICE_DEPLOY_TIMEOUT_PER_VM", "30"))
+SLICE_DEPLOY_TIMEOUT_MARGIN = 60
 
 # Mapeo estático de workers
 WORKER_IPS = {
@@ -43,6 +50,7 @@ def obtener_instancias_por_slice(id_slice: int):
     query = text("""
         SELECT 
             i.idinstancia, i.nombre, i.cpu, i.ram, i.storage, 
+            i.cpu_count, i.ram_mb, i.storage_gb,
             i.salidainternet, 
             im.ruta AS imagen,
             im.nombre AS imagen_nombre,
@@ -53,7 +61,24 @@ def obtener_instancias_por_slice(id_slice: int):
     """)
     with engine.connect() as conn:
         result = conn.execute(query, {"id_slice": id_slice})
-        return [dict(row._mapping) for row in result]
+        return [normalizar_recursos(dict(row._mapping)) for row in result]
+
+def normalizar_recursos(vm: dict):
+    """Columnas numéricas (cpu_count, ram_mb, storage_gb) a tipos JSON-serializables"""
+    vm["cpu_count"] = int(vm.get("cpu_count") or 0)
+    vm["ram_mb"] = int(vm.get("ram_mb") or 0)
+    vm["storage_gb"] = float(vm.get("storage_gb") or 0)
+    return vm
+
+def instancias_con_recursos_invalidos(instancias: list):
+    """
+    Nombres de instancias cuyos cpu/ram/storage no se pudieron interpretar
+    (la columna numérica queda en NULL → 0); no se pueden ubicar ni desplegar.
+    """
+    return [
+        vm["nombre"] for vm in instancias
+        if vm["cpu_count"] <= 0 or vm["ram_mb"] <= 0 or vm["storage_gb"] <= 0
+    ]
 
 def obtener_enlaces_por_slice(id_slice: int):
     """Obtiene enlaces del slice"""
@@ -73,6 +98,82 @@ def obtener_enlaces_por_slice(id_slice: int):
         result = conn.execute(query, {"id_slice": id_slice})
         return [dict(row._mapping) for row in result]
 
+def aplicar_delta_uso_workers(conn, id_slice: int, signo: int):
+    """
+    Suma (signo=1) o resta (signo=-1) los recursos de las instancias del slice
+    en los contadores worker_uso. Solo recorre las instancias de este slice.
+    """
+    if signo < 0:
+        # Restar solo donde ya hay fila: un INSERT aquí dejaría reservas negativas
+        conn.execute(text("""
+            UPDATE worker_uso u
+            JOIN (
+                SELECT 
+                    i.worker_idworker,
+                    SUM(i.cpu_count) AS cpu,
+                    SUM(i.ram_mb) / 1024 AS ram_gb,
+                    SUM(i.storage_gb) AS storage_gb,
+                    COUNT(i.idinstancia) AS instancias
+                FROM instancia i
+                WHERE i.slice_idslice = :sid
+                  AND i.worker_idworker IS NOT NULL
+                GROUP BY i.worker_idworker
+            ) d ON d.worker_idworker = u.worker_idworker
+            SET
+                u.cpu_reservado = GREATEST(u.cpu_reservado - d.cpu, 0),
+                u.ram_reservado_gb = GREATEST(u.ram_reservado_gb - d.ram_gb, 0),
+                u.storage_reservado_gb = GREATEST(u.storage_reservado_gb - d.storage_gb, 0),
+                u.instancias_running = GREATEST(u.instancias_running - d.instancias, 0)
+        """), {"sid": id_slice})
+        return
+
+    conn.execute(text("""
+        INSERT INTO worker_uso (worker_idworker, cpu_reservado, ram_reservado_gb, storage_reservado_gb, instancias_running)
+        SELECT 
+            i.worker_idworker,
+            :signo * SUM(i.cpu_count),
+            :signo * SUM(i.ram_mb) / 1024,
+            :signo * SUM(i.storage_gb),
+            :signo * COUNT(i.idinstancia)
+        FROM instancia i
+        WHERE i.slice_idslice = :sid
+          AND i.worker_idworker IS NOT NULL
+        GROUP BY i.worker_idworker
+        ON DUPLICATE KEY UPDATE
+            cpu_reservado = GREATEST(cpu_reservado + VALUES(cpu_reservado), 0),
+            ram_reservado_gb = GREATEST(ram_reservado_gb + VALUES(ram_reservado_gb), 0),
+            storage_reservado_gb = GREATEST(storage_reservado_gb + VALUES(storage_reservado_gb), 0),
+            instancias_running = GREATEST(instancias_running + VALUES(instancias_running), 0)
+    """), {"sid": id_slice, "signo": signo})
+
+def actualizar_estado_slice(conn, id_slice: int, estado: str, platform: str | None = None):
+    """
+    Cambia el estado del slice y, en la misma transacción, mantiene los
+    contadores worker_uso al entrar o salir de RUNNING.
+    """
+    row = conn.execute(text("""
+        SELECT estado FROM slice WHERE idslice = :sid FOR UPDATE
+    """), {"sid": id_slice}).fetchone()
+    estado_anterior = row[0] if row else None
+    
+    if platform:
+        conn.execute(text("""
+            UPDATE slice SET estado = :e, platform = :p WHERE idslice = :sid
+        """), {"e": estado, "p": platform, "sid": id_slice})
+    else:
+        conn.execute(text("""
+            UPDATE slice SET estado = :e WHERE idslice = :sid
+        """), {"e": estado, "sid": id_slice})
+    
+    try:
+        if estado == 'RUNNING' and estado_anterior != 'RUNNING':
+            aplicar_delta_uso_workers(conn, id_slice, 1)
+        elif estado_anterior == 'RUNNING' and estado != 'RUNNING':
+            aplicar_delta_uso_workers(conn, id_slice, -1)
+    except Exception as e:
+        # El recálculo periódico de analytics corrige la deriva
+        print(f"⚠️ No se pudieron actualizar contadores worker_uso del slice {id_slice}: {e}")
+
 def obtener_metricas_actuales():
     """Obtiene métricas de workers (solo para Linux)"""
     try:
@@ -93,7 +194,8 @@ def obtener_metricas_actuales():
 def solicitar_vlan():
     """Solicita una VLAN vía RabbitMQ RPC (solo para Linux)"""
     try:
-        resp = rpc_call_network({"action": "ASIGNAR_VLAN"})
+        with tracing.span("network.asignar_vlan"):
+            resp = rpc_call_network({"action": "ASIGNAR_VLAN"})
         if "idvlan" in resp and "numero" in resp:
             return resp
         else:
@@ -106,7 +208,8 @@ def solicitar_vlan():
 def solicitar_vlan_internet():
     """Solicita una VLAN para salida a internet (solo para Linux)"""
     try:
-        resp = requests.get(f"{NETWORK_BASE}/vlans/internet", timeout=5)
+        with tracing.span("network.vlan_internet"):
+            resp = requests.get(f"{NETWORK_BASE}/vlans/internet", timeout=5, headers=tracing.inject_headers())
         if resp.status_code == 200:
             return resp.json()
         else:
@@ -119,7 +222,8 @@ def solicitar_vlan_internet():
 def solicitar_vnc():
     """Solicita puerto VNC vía RabbitMQ RPC (solo para Linux)"""
     try:
-        resp = rpc_call_network({"action": "ASIGNAR_VNC"})
+        with tracing.span("network.asignar_vnc"):
+            resp = rpc_call_network({"action": "ASIGNAR_VNC"})
         if resp and "puerto" in resp:
             return resp
         print("⚠️ Error RPC asignando VNC", resp)
@@ -370,8 +474,8 @@ def generar_plan_deploy_linux(id_slice: int, instancias: list,placement_plan_vm:
 
         worker_ip = worker_info["ip"]
 
-        ram_value = parse_ram_to_gb(vm["ram"])
-        storage_value = float(str(vm["storage"]).replace("GB", "").strip())
+        ram_value = vm["ram_mb"] / 1024
+        storage_value = vm["storage_gb"]
         vm_id = str(vm["idinstancia"])
         vlans_vm = list(set(vlans_por_vm.get(vm_id, [])))
 
@@ -395,7 +499,8 @@ def generar_plan_deploy_linux(id_slice: int, instancias: list,placement_plan_vm:
             "puerto_vnc": puerto_vnc,
             "imagen": vm["imagen"],        # Ruta de imagen para Linux
             "ram_gb": ram_value,
-            "cpus": int(vm["cpu"]),
+            "ram_mb": vm["ram_mb"],
+            "cpus": vm["cpu_count"],
             "disco_gb": storage_value,
             "vm_id": vm_id
         })
@@ -466,9 +571,9 @@ def generar_plan_deploy_openstack(id_slice: int, instancias: list, placement_pla
         print(f"   • Worker IP: {worker_ip}") 
 
         vm_id = str(vm["idinstancia"])
-        ram_gb = parse_ram_to_gb(vm["ram"])
-        storage_gb = float(str(vm["storage"]).replace("GB", "").strip())
-        cpus = int(vm["cpu"])
+        ram_gb = vm["ram_mb"] / 1024
+        storage_gb = vm["storage_gb"]
+        cpus = vm["cpu_count"]
 
         redes_de_vm = [
             r for r in topologia["redes"]
@@ -550,7 +655,10 @@ def construir_payload_vm_placement(id_slice: int, zonadisponibilidad: str, insta
                 "nombre": inst["nombre"],
                 "cpu": int(inst["cpu"]),
                 "ram": str(inst["ram"]),
-                "storage": str(inst["storage"])
+                "storage": str(inst["storage"]),
+                "cpu_count": inst["cpu_count"],
+                "ram_mb": inst["ram_mb"],
+                "storage_gb": inst["storage_gb"]
             }
             for inst in instancias
         ]
@@ -574,6 +682,7 @@ def verificar_viabilidad_endpoint(data: dict = Body(...)):
     if not id_slice:
         return {"error": "Falta el parámetro 'id_slice'"}
 
+    tracing.anotar(slice_id=id_slice, platform=platform)
     print(f"🛰️ Evaluando slice {id_slice} para plataforma {platform.upper()}...")
     if not zonadisponibilidad:
         zonadisponibilidad = obtener_zona_disponibilidad(id_slice) or "HP"
@@ -586,6 +695,12 @@ def verificar_viabilidad_endpoint(data: dict = Body(...)):
                 "platform": platform,
                 "error": "No se encontraron instancias para el slice."}
 
+    invalidas = instancias_con_recursos_invalidos(instancias)
+    if invalidas:
+        return {"can_deploy": False,
+                "platform": platform,
+                "error": f"Recursos inválidos (cpu/ram/storage) en: {', '.join(invalidas)}"}
+
     payload = construir_payload_vm_placement(
         id_slice=id_slice,
         zonadisponibilidad=zonadisponibilidad,
@@ -595,7 +710,8 @@ def verificar_viabilidad_endpoint(data: dict = Body(...)):
 
     # 2) Llamar al servicio de VM Placement vía RPC
     try:
-        resp_vm = rpc_call_vm_placement(payload, timeout=15)
+        with tracing.span("placement.verify_rpc", zona=zonadisponibilidad, vms=len(instancias)):
+            resp_vm = rpc_call_vm_placement(payload, timeout=15)
         print(f"📥 Respuesta de VM Placement: {resp_vm}")
     except Exception as e:
         print(f"Error CONEXIÓN con VM Placement: {e}")
@@ -631,15 +747,6 @@ def verificar_viabilidad_endpoint(data: dict = Body(...)):
         "modo": resp_vm.get("modo", "unknown"),
     }
     
-def parse_ram_to_gb(ram_str):
-    """Convierte RAM en MB o GB a float en GB"""
-    ram_str = str(ram_str).strip().upper()
-    if "MB" in ram_str:
-        return float(ram_str.replace("MB", "")) / 1024
-    elif "GB" in ram_str:
-        return float(ram_str.replace("GB", ""))
-    return 1.0
-
 def generar_plan_verify_linux(id_slice: int, metrics_json: dict, instancias: list):
     """Verificación para Linux (código original)"""
     print("🐧 [LINUX] Verificación de recursos...")
@@ -668,8 +775,8 @@ def generar_plan_verify_linux(id_slice: int, metrics_json: dict, instancias: lis
 
     for vm in instancias:
         w = workers[idx]
-        ram_value = parse_ram_to_gb(vm["ram"])
-        cpu_value = int(vm["cpu"])
+        ram_value = vm["ram_mb"] / 1024
+        cpu_value = vm["cpu_count"]
 
         w["cpu_free"] = round(w["cpu_free"] - cpu_value, 2)
         w["ram_free"] = round(w["ram_free"] - ram_value, 2)
@@ -746,6 +853,7 @@ def deploy_slice(data: dict = Body(...)):
             "detalle": "VM Placement es la única fuente de asignación de workers."
         }
 
+    tracing.anotar(slice_id=id_slice, platform=platform)
     print(f"Iniciando despliegue del slice {id_slice} en {platform.upper()}...")
     print(f"Modo VM Placement: {modo}")
     print(f"   Entradas en placement_plan: {len(placement_plan)}")
@@ -754,16 +862,15 @@ def deploy_slice(data: dict = Body(...)):
 
     # Estado inicial
     with engine.begin() as conn:
-        conn.execute(text("""
-            UPDATE slice 
-            SET estado = 'DEPLOYING'
-            WHERE idslice = :sid
-        """), {"sid": id_slice})
+        actualizar_estado_slice(conn, id_slice, 'DEPLOYING')
 
     try:
         instancias = obtener_instancias_por_slice(id_slice)
         if not instancias:
             return {"error": "No se encontraron instancias"}
+        invalidas = instancias_con_recursos_invalidos(instancias)
+        if invalidas:
+            return {"success": False, "error": f"Recursos inválidos (cpu/ram/storage) en: {', '.join(invalidas)}"}
         
         if platform == "linux":
             return deploy_slice_linux(id_slice, instancias, placement_plan)
@@ -827,7 +934,9 @@ def deploy_slice_linux(id_slice: int, instancias: list, placement_plan_vm: list
     
 
 
-    plan = generar_plan_deploy_linux(id_slice, instancias, placement_plan_vm)
+    # Plan: VLANs de enlaces, VNC e IPs por VM
+    with tracing.span("deploy.plan_linux", vms=len(instancias)):
+        plan = generar_plan_deploy_linux(id_slice, instancias, placement_plan_vm)
     
     if not plan.get("can_deploy"):
         return plan
@@ -848,11 +957,12 @@ def deploy_slice_linux(id_slice: int, instancias: list, placement_plan_vm: list
                 "puerto_vnc": str(vm["puerto_vnc"]),
                 "imagen": vm["imagen"],
                 "ram_gb": float(vm["ram_gb"]),
+                "ram_mb": vm.get("ram_mb"),
                 "cpus": int(vm["cpus"]),
                 "disco_gb": float(vm["disco_gb"])
             }
             
-            future = executor.submit(desplegar_vm_en_driver, vm_req)
+            future = executor.submit(tracing.con_contexto(desplegar_vm_en_driver), vm_req)
             future_map[future] = vm
 
         # 🟢 PROCESAR RESULTADOS COMPLETO (del documento 16)
@@ -979,9 +1089,7 @@ def deploy_slice_linux(id_slice: int, instancias: list, placement_plan_vm: list
     estado_final = "RUNNING" if fallos == 0 else ("PARTIAL" if len(vms_exitosas) > 0 else "FAILED")
     
     with engine.begin() as conn:
-        conn.execute(text("""
-            UPDATE slice SET estado = :e WHERE idslice = :sid
-        """), {"e": estado_final, "sid": id_slice})
+        actualizar_estado_slice(conn, id_slice, estado_final)
     
     # ================================
     # 🔥 ROLLBACK SI ALGUNA VM FALLA
@@ -1001,10 +1109,11 @@ def deploy_slice_linux(id_slice: int, instancias: list, placement_plan_vm: list
 
         print(f"🧹 Eliminando {len(instancias_exitosas)} VMs exitosas (rollback)...")
 
-        vm_results = eliminar_vms_paralelo(instancias_exitosas)
+        with tracing.span("deploy.rollback", vms=len(instancias_exitosas)):
+            vm_results = eliminar_vms_paralelo(instancias_exitosas)
 
-        print("🧹 Liberando recursos de red (VLAN/VNC)...")
-        network_results = liberar_recursos_red(id_slice)
+            print("🧹 Liberando recursos de red (VLAN/VNC)...")
+            network_results = liberar_recursos_red(id_slice)
 
         print("🧹 Limpiando estado runtime en BD (sin borrar slice)...")
         limpiar_estado_runtime_slice(id_slice)
@@ -1067,118 +1176,116 @@ def deploy_slice_openstack(id_slice: int, instancias: list, placement_plan_vm: l
     project_name = f"slice_{id_slice}"
     requires_rollback = False
 
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        future_map = {
-            executor.submit(desplegar_vm_en_driver, {
-                "platform": "openstack",
-                "slice_id": id_slice,
-                "nombre_vm": vm["nombre_vm"],
-                "vm_id": vm["vm_id"],
-                "imagen_id": vm["imagen_id"],
-                "flavor_spec": vm["flavor_spec"],
-                "redes": vm["redes"],
-                "salidainternet": vm["salidainternet"],
-                "target_host": vm.get("worker_hostname")
-            }): vm
-            for vm in plan["placement_plan"]
+    # 3) Un solo despliegue en el driver: proyecto/redes/flavors una vez por slice,
+    #    luego puertos + instancias por VM con más concurrencia en el headnode
+    slice_result = desplegar_slice_openstack_en_driver(id_slice, [
+        {
+            "nombre_vm": vm["nombre_vm"],
+            "vm_id": vm["vm_id"],
+            "imagen_id": vm["imagen_id"],
+            "flavor_spec": vm["flavor_spec"],
+            "redes": vm["redes"],
+            "salidainternet": vm["salidainternet"],
+            "target_host": vm.get("worker_hostname")
+        }
+        for vm in plan["placement_plan"]
+    ])
+    if slice_result.get("workflow_en_curso"):
+        # El headnode puede seguir creando servidores: un rollback ahora dejaría
+        # recursos huérfanos. El slice queda en DEPLOYING hasta eliminarlo.
+        print(f"⚠️ Slice {id_slice}: despliegue aún en curso en el headnode, rollback omitido")
+        return {
+            "success": False,
+            "timestamp": datetime.utcnow().isoformat(),
+            "slice_id": id_slice,
+            "platform": "openstack",
+            "estado_final": "DEPLOYING",
+            "error": slice_result.get("error") or slice_result.get("message"),
+            "job_id": slice_result.get("job_id"),
+            "rollback": "omitido: el workflow sigue en curso; eliminar el slice cuando termine"
         }
 
-        for future in as_completed(future_map):
-            vm = future_map[future]
-            vm_name = vm["nombre_vm"]
-            worker_name = vm.get("worker_hostname")
-            try:
-                result = future.result()
-                
-                worker_id = None
-                if worker_name:
-                    with engine.begin() as conn:
-                        row = conn.execute(text("""
-                            SELECT idworker
-                            FROM worker
-                            WHERE nombre = :nombre
-                        """), {"nombre": worker_name}).fetchone()
-                        if row:
-                            worker_id = row[0]
-
-
-                # 🔥 VALIDACIÓN MEJORADA DE RESPUESTA
-                if result.get("success"):
-                    # Verificar si hay errores ocultos
-                    if result.get("should_rollback", False):
-                        print(f"❌ VM {vm_name}: Despliegue requiere rollback")
-                        print(f"   Razón: {result.get('error', 'Unknown')}")
-                        fallos += 1
-                        requires_rollback = True
-                        vms_fallidas.append(vm_name)
-                        
-                        resultados.append({
-                            "vm": vm_name,
-                            "success": False,
-                            "error": result.get("error"),
-                            "error_type": result.get("error_type"),
-                            "instance_id": result.get("instance_id")
-                        })
-                    else:
-                        print(f"✅ VM {vm_name} desplegada correctamente")
-                        
-                        # Actualizar BD
-                        with engine.begin() as conn:
-                            conn.execute(text("""
-                                UPDATE instancia
-                                SET estado = 'RUNNING',
-                                    instance_id = :instance_id,
-                                    platform = 'openstack',
-                                    worker_idworker = :worker_id,
-                                    console_url = :console_url
-                                WHERE nombre = :vm_name AND slice_idslice = :sid
-                            """), {
-                                "instance_id": result.get("instance_id"),
-                                "console_url": result.get("console_url"),
-                                "vm_name": vm_name,
-                                "sid": id_slice,
-                                "worker_id": worker_id
-                            })
-                        
-                        vms_exitosas.append(vm_name)
-                        resultados.append({
-                            "vm": vm_name,
-                            "success": True,
-                            "instance_id": result.get("instance_id"),
-                            "console_url": result.get("console_url"),
-                            "vm_name": vm_name,
-                            "sid": id_slice,
-                            "worker_id": worker_id,
-                            "topology_validated": result.get("topology_validation", {}).get("valid", False)
-                        })
-                else:
-                    # Error explícito
+    resultados_por_vm = {r.get("nombre_vm"): r for r in slice_result.get("vms", [])}
+
+    for vm in plan["placement_plan"]:
+        vm_name = vm["nombre_vm"]
+        worker_name = vm.get("worker_hostname")
+        try:
+            result = resultados_por_vm.get(vm_name) or {
+                "success": False,
+                "error": slice_result.get("error") or slice_result.get("message") or "Sin resultado del driver",
+                "error_type": "SLICE_DEPLOY_FAILED"
+            }
+            
+            worker_id = None
+            if worker_name:
+                with engine.begin() as conn:
+                    row = conn.execute(text("""
+                        SELECT idworker
+                        FROM worker
+                        WHERE nombre = :nombre
+                    """), {"nombre": worker_name}).fetchone()
+                    if row:
+                        worker_id = row[0]
+
+
+            # 🔥 VALIDACIÓN MEJORADA DE RESPUESTA
+            if result.get("success"):
+                # Verificar si hay errores ocultos
+                if result.get("should_rollback", False):
+                    print(f"❌ VM {vm_name}: Despliegue requiere rollback")
+                    print(f"   Razón: {result.get('error', 'Unknown')}")
                     fallos += 1
                     requires_rollback = True
                     vms_fallidas.append(vm_name)
-                    print(f"❌ VM {vm_name} falló: {result.get('error')}")
                     
-                    # Marcar en BD
+                    resultados.append({
+                        "vm": vm_name,
+                        "success": False,
+                        "error": result.get("error"),
+                        "error_type": result.get("error_type"),
+                        "instance_id": result.get("instance_id")
+                    })
+                else:
+                    print(f"✅ VM {vm_name} desplegada correctamente")
+                    
+                    # Actualizar BD
                     with engine.begin() as conn:
                         conn.execute(text("""
                             UPDATE instancia
-                            SET estado = 'FAILED'
+                            SET estado = 'RUNNING',
+                                instance_id = :instance_id,
+                                platform = 'openstack',
+                                worker_idworker = :worker_id,
+                                console_url = :console_url
                             WHERE nombre = :vm_name AND slice_idslice = :sid
-                        """), {"vm_name": vm_name, "sid": id_slice})
+                        """), {
+                            "instance_id": result.get("instance_id"),
+                            "console_url": result.get("console_url"),
+                            "vm_name": vm_name,
+                            "sid": id_slice,
+                            "worker_id": worker_id
+                        })
                     
+                    vms_exitosas.append(vm_name)
                     resultados.append({
                         "vm": vm_name,
-                        "success": False,
-                        "error": result.get("error"),
-                        "error_type": result.get("error_type", "UNKNOWN")
+                        "success": True,
+                        "instance_id": result.get("instance_id"),
+                        "console_url": result.get("console_url"),
+                        "vm_name": vm_name,
+                        "sid": id_slice,
+                        "worker_id": worker_id,
+                        "topology_validated": result.get("topology_validation", {}).get("valid", False)
                     })
-                    
-            except Exception as e:
+            else:
+                # Error explícito
                 fallos += 1
                 requires_rollback = True
                 vms_fallidas.append(vm_name)
-                print(f"❌ Excepción desplegando {vm_name}: {e}")
+                print(f"❌ VM {vm_name} falló: {result.get('error')}")
                 
+                # Marcar en BD
                 with engine.begin() as conn:
                     conn.execute(text("""
                         UPDATE instancia
@@ -1189,9 +1296,29 @@ def deploy_slice_openstack(id_slice: int, instancias: list, placement_plan_vm: l
                 resultados.append({
                     "vm": vm_name,
                     "success": False,
-                    "error": str(e),
-                    "error_type": "EXCEPTION"
+                    "error": result.get("error"),
+                    "error_type": result.get("error_type", "UNKNOWN")
                 })
+                
+        except Exception as e:
+            fallos += 1
+            requires_rollback = True
+            vms_fallidas.append(vm_name)
+            print(f"❌ Excepción desplegando {vm_name}: {e}")
+            
+            with engine.begin() as conn:
+                conn.execute(text("""
+                    UPDATE instancia
+                    SET estado = 'FAILED'
+                    WHERE nombre = :vm_name AND slice_idslice = :sid
+                """), {"vm_name": vm_name, "sid": id_slice})
+            
+            resultados.append({
+                "vm": vm_name,
+                "success": False,
+                "error": str(e),
+                "error_type": "EXCEPTION"
+            })
 
     # 🔥 DECISIÓN DE ROLLBACK
     if requires_rollback or fallos > 0:
@@ -1232,11 +1359,7 @@ def deploy_slice_openstack(id_slice: int, instancias: list, placement_plan_vm: l
 
     # 3) Actualizar estado - TODO OK
     with engine.begin() as conn:
-        conn.execute(text("""
-            UPDATE slice 
-            SET estado = 'RUNNING', platform = 'openstack'
-            WHERE idslice = :sid
-        """), {"sid": id_slice})
+        actualizar_estado_slice(conn, id_slice, 'RUNNING', platform='openstack')
 
     return {
         "success": True,
@@ -1267,7 +1390,7 @@ def execute_project_rollback(id_slice: int, project_name: str):
     
     try:
         url = f"{LINUX_DRIVER_URL}/delete_project_openstack"
-        resp = requests.post(url, json=delete_args, timeout=180)
+        resp = requests.post(url, json=delete_args, timeout=180, headers=tracing.inject_headers())
         
         if resp.status_code == 200:
             result = resp.json()
@@ -1297,40 +1420,91 @@ def desplegar_vm_en_driver(vm_data: dict):
     """
     Envía petición al Driver Híbrido (Linux o OpenStack según platform)
     """
-    platform = vm_data.get("platform", "linux")
-    url = f"{LINUX_DRIVER_URL}/create_vm"
+    with tracing.span("driver.create_vm", vm=vm_data.get("nombre_vm"),
+                      worker=vm_data.get("worker"), platform=vm_data.get("platform", "linux")) as span:
+        platform = vm_data.get("platform", "linux")
+        url = f"{LINUX_DRIVER_URL}/create_vm"
     
-    try:
-        print(f"[HTTP] → POST {url} (Platform: {platform.upper()})")
-        print(f"[HTTP] VM: {vm_data.get('nombre_vm')}")
+        try:
+            print(f"[HTTP] → POST {url} (Platform: {platform.upper()})")
+            print(f"[HTTP] VM: {vm_data.get('nombre_vm')}")
         
-        resp = requests.post(url, json=vm_data, timeout=300)  # Timeout mayor para OpenStack
-        raw = resp.text
+            resp = requests.post(url, json=vm_data, timeout=300, headers=tracing.inject_headers())  # Timeout mayor para OpenStack
+            raw = resp.text
         
-        print(f"[HTTP] ← {resp.status_code}")
+            print(f"[HTTP] ← {resp.status_code}")
+            span.set("http.status_code", resp.status_code)
         
-        if resp.status_code != 200:
-            return {
-                "success": False, 
-                "message": f"HTTP {resp.status_code}: {raw[:200]}"
-            }
+            if resp.status_code != 200:
+                span.status = "error"
+                return {
+                    "success": False, 
+                    "message": f"HTTP {resp.status_code}: {raw[:200]}"
+                }
         
-        try:
-            data = resp.json()
-        except json.JSONDecodeError:
-            return {
-                "success": False, 
-                "message": f"Respuesta no es JSON: {raw[:200]}"
-            }
+            try:
+                data = resp.json()
+            except json.JSONDecodeError:
+                return {
+                    "success": False, 
+                    "message": f"Respuesta no es JSON: {raw[:200]}"
+                }
         
-        success = bool(data.get("success", data.get("status", False)))
+            success = bool(data.get("success", data.get("status", False)))
+            if not success:
+                span.status = "error"
         
-        return data
+            return data
         
-    except requests.exceptions.Timeout:
-        return {"success": False, "message": f"Timeout desplegando VM (platform: {platform})"}
-    except Exception as e:
-        return {"success": False, "message": f"Error de conexión: {str(e)}"}
+        except requests.exceptions.Timeout:
+            span.status = "error"
+            return {"success": False, "message": f"Timeout desplegando VM (platform: {platform})"}
+        except Exception as e:
+            span.status = "error"
+            return {"success": False, "message": f"Error de conexión: {str(e)}"}
+
+def desplegar_slice_openstack_en_driver(id_slice: int, vms: list):
+    """
+    Envía todas las VMs del slice al Driver en una sola petición (/create_slice_openstack)
+    """
+    with tracing.span("driver.create_slice_openstack", slice_id=id_slice, vms=len(vms)) as span:
+        url = f"{LINUX_DRIVER_URL}/create_slice_openstack"
+
+        try:
+            print(f"[HTTP] → POST {url} (slice {id_slice}, {len(vms)} VMs)")
+
+            timeout = SLICE_DEPLOY_TIMEOUT_BASE + SLICE_DEPLOY_TIMEOUT_PER_VM * len(vms) + SLICE_DEPLOY_TIMEOUT_MARGIN
+            resp = requests.post(url, json={"slice_id": id_slice, "vms": vms}, timeout=timeout, headers=tracing.inject_headers())
+            raw = resp.text
+
+            print(f"[HTTP] ← {resp.status_code}")
+            span.set("http.status_code", resp.status_code)
+
+            if resp.status_code != 200:
+                span.status = "error"
+                return {
+                    "success": False,
+                    "message": f"HTTP {resp.status_code}: {raw[:200]}",
+                    "vms": []
+                }
+
+            try:
+                return resp.json()
+            except json.JSONDecodeError:
+                return {
+                    "success": False,
+                    "message": f"Respuesta no es JSON: {raw[:200]}",
+                    "vms": []
+                }
+
+        except requests.exceptions.Timeout:
+            # El driver puede seguir esperando al headnode: no se sabe si terminó
+            span.status = "error"
+            return {"success": False, "message": f"Timeout desplegando slice {id_slice}",
+                    "workflow_en_curso": True, "vms": []}
+        except Exception as e:
+            span.status = "error"
+            return {"success": False, "message": f"Error de conexión: {str(e)}", "vms": []}
 
 # ======================================
 # ENDPOINT: DELETE (Híbrido)
@@ -1345,6 +1519,7 @@ def delete_slice(data: dict = Body(...)):
     if not id_slice:
         return {"error": "Falta el parámetro 'id_slice'"}
 
+    tracing.anotar(slice_id=id_slice)
     print(f"🗑️ Iniciando eliminación del slice {id_slice}...")
 
     # Verificar plataforma del slice
@@ -1363,11 +1538,7 @@ def delete_slice(data: dict = Body(...)):
 
     # Estado inicial
     with engine.begin() as conn:
-        conn.execute(text("""
-            UPDATE slice 
-            SET estado = 'DELETING'
-            WHERE idslice = :sid
-        """), {"sid": id_slice})
+        actualizar_estado_slice(conn, id_slice, 'DELETING')
 
     try:
         slice_data = obtener_datos_completos_slice(id_slice)
@@ -1433,7 +1604,7 @@ def delete_slice_openstack(id_slice: int, slice_data: dict):
         # Usar el helper del driver para ejecutar el script bash
         url = f"{LINUX_DRIVER_URL}/delete_project_openstack"
         
-        resp = requests.post(url, json=delete_args, timeout=180)
+        resp = requests.post(url, json=delete_args, timeout=180, headers=tracing.inject_headers())
         
         if resp.status_code != 200:
             print(f"Error HTTP {resp.status_code}: {resp.text}")
@@ -1520,6 +1691,7 @@ def obtener_datos_completos_slice(id_slice: int):
             instancias_query = text("""
                 SELECT 
                     i.idinstancia, i.nombre, i.estado, i.cpu, i.ram, i.storage,
+                    i.cpu_count, i.ram_mb, i.storage_gb,
                     i.salidainternet, i.ip, i.worker_idworker, i.process_id,
                     i.platform, i.instance_id,
                     v.puerto as vnc_puerto, v.idvnc,
@@ -1532,7 +1704,7 @@ def obtener_datos_completos_slice(id_slice: int):
                 WHERE i.slice_idslice = :id_slice
             """)
             instancias_result = conn.execute(instancias_query, {"id_slice": id_slice})
-            instancias = [dict(row._mapping) for row in instancias_result]
+            instancias = [normalizar_recursos(dict(row._mapping)) for row in instancias_result]
             
             enlaces_query = text("""
                 SELECT 
@@ -1556,98 +1728,111 @@ def obtener_datos_completos_slice(id_slice: int):
         return None
 
 def eliminar_vms_paralelo(instancias: list):
-    """Elimina VMs de Linux (código original)"""
+    """Elimina VMs de Linux: un teardown batch por worker, workers en paralelo"""
     results = []
     
     if not instancias:
         return {"vms_eliminadas": 0, "errores": 0, "detalles": []}
     
     print(f"🔧 Eliminando {len(instancias)} VMs de Linux...")
+
+    # Agrupar por worker: el driver hace una sola conexión headnode → worker por grupo
+    por_worker = {}
+    for instancia in instancias:
+        if instancia.get("worker_ip"):
+            por_worker.setdefault(instancia["worker_ip"], []).append(instancia)
+    taps = obtener_interfaces_tap([i["idinstancia"] for grupo in por_worker.values() for i in grupo])
     
     with ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_vm = {}
-        
-        for instancia in instancias:
-            if instancia.get("worker_ip"):
-                future = executor.submit(eliminar_vm_individual_linux, instancia)
-                future_to_vm[future] = instancia
-        
-        vms_eliminadas = 0
-        errores = 0
+        future_to_worker = {
+            executor.submit(tracing.con_contexto(eliminar_vms_worker_linux), worker_ip, grupo, taps): worker_ip
+            for worker_ip, grupo in por_worker.items()
+        }
         
-        for future in as_completed(future_to_vm):
-            instancia = future_to_vm[future]
+        for future in as_completed(future_to_worker):
+            worker_ip = future_to_worker[future]
             try:
-                result = future.result()
-                results.append({
-                    "vm_nombre": instancia["nombre"],
-                    "worker": instancia["worker_ip"],
-                    "success": result["success"],
-                    "message": result["message"]
-                })
-                
-                if result["success"]:
-                    vms_eliminadas += 1
-                else:
-                    errores += 1
-                    
+                resultados_worker = future.result()
             except Exception as e:
-                errores += 1
-                results.append({
-                    "vm_nombre": instancia["nombre"],
-                    "success": False,
-                    "message": str(e)
-                })
+                resultados_worker = [
+                    {"vm_nombre": instancia["nombre"], "success": False, "message": str(e)}
+                    for instancia in por_worker[worker_ip]
+                ]
+            for item in resultados_worker:
+                item["worker"] = worker_ip
+                results.append(item)
     
+    vms_eliminadas = sum(1 for r in results if r["success"])
     return {
         "vms_eliminadas": vms_eliminadas,
-        "errores": errores,
+        "errores": len(results) - vms_eliminadas,
         "total": len(instancias),
         "detalles": results
     }
 
-def eliminar_vm_individual_linux(instancia: dict):
-    """Elimina VM de Linux (código original)"""
-    url = f"{LINUX_DRIVER_URL}/delete_vm"
-    
-    interfaces_tap = []
+def obtener_interfaces_tap(ids_instancia: list):
+    """idinstancia → [nombre_interfaz] en una sola consulta"""
+    taps = {}
+    if not ids_instancia:
+        return taps
     try:
         with engine.connect() as conn:
             tap_query = text("""
-                SELECT nombre_interfaz 
+                SELECT instancia_idinstancia, nombre_interfaz 
                 FROM interfaces_tap 
-                WHERE instancia_idinstancia = :inst_id
-            """)
-            result = conn.execute(tap_query, {"inst_id": instancia["idinstancia"]})
-            interfaces_tap = [row[0] for row in result]
+                WHERE instancia_idinstancia IN :ids
+            """).bindparams(bindparam("ids", expanding=True))
+            for inst_id, nombre in conn.execute(tap_query, {"ids": list(ids_instancia)}):
+                taps.setdefault(inst_id, []).append(nombre)
     except Exception as e:
         print(f"⚠️ Error obteniendo TAPs: {e}")
-    
+    return taps
+
+def eliminar_vms_worker_linux(worker_ip: str, instancias: list, taps: dict):
+    """Elimina las VMs de un worker con un solo teardown remoto (batch del driver)"""
+    url = f"{LINUX_DRIVER_URL}/delete_vm"
     vm_data = {
         "platform": "linux",
-        "nombre_vm": instancia["nombre"],
-        "worker_ip": instancia["worker_ip"],
-        "vm_id": instancia["idinstancia"],
-        "vnc_puerto": instancia.get("vnc_puerto"),
-        "process_id": instancia.get("process_id"),
-        "interfaces_tap": interfaces_tap,
-        "delete_disk": True 
+        "worker_ip": worker_ip,
+        "vms": [
+            {
+                "nombre_vm": instancia["nombre"],
+                "process_id": instancia.get("process_id"),
+                "interfaces_tap": taps.get(instancia["idinstancia"], []),
+                "delete_disk": True
+            }
+            for instancia in instancias
+        ]
     }
-    
+
+    def todas_fallidas(message):
+        return [{"vm_nombre": i["nombre"], "success": False, "message": message} for i in instancias]
+
     try:
-        resp = requests.post(url, json=vm_data, timeout=60)
+        # El teardown es secuencial en el worker: el timeout crece con el número de VMs
+        resp = requests.post(url, json=vm_data, timeout=60 + 10 * len(instancias),
+                             headers=tracing.inject_headers())
         
         if resp.status_code != 200:
-            return {"success": False, "message": f"HTTP {resp.status_code}"}
+            return todas_fallidas(f"HTTP {resp.status_code}")
         
         data = resp.json()
-        success = bool(data.get("success", data.get("status", False)))
-        message = data.get("mensaje") or data.get("message") or "VM eliminada"
-        
-        return {"success": success, "message": message}
+        por_nombre = {r.get("nombre_vm"): r for r in data.get("results", [])}
+        if not por_nombre:
+            return todas_fallidas(data.get("error") or data.get("mensaje") or "Sin resultados del teardown")
+
+        resultados = []
+        for instancia in instancias:
+            r = por_nombre.get(instancia["nombre"], {})
+            resultados.append({
+                "vm_nombre": instancia["nombre"],
+                "success": bool(r.get("success", False)),
+                "message": r.get("mensaje") or r.get("error") or "Sin resultado del teardown"
+            })
+        return resultados
         
     except Exception as e:
-        return {"success": False, "message": str(e)}
+        return todas_fallidas(str(e))
 
 def liberar_recursos_red(id_slice: int):
     """Libera VLANs y VNCs (solo Linux)"""
@@ -1823,6 +2008,23 @@ def guardar_interfaces_tap(nombre_vm: str, interfaces: list, id_slice: int):
         print(f"❌ Error guardando TAPs: {e}")
         return 0
 
+# ======================================
+# ENDPOINT: TRAZAS POR SLICE
+# ======================================
+
+@app.get("/slices/{id_slice}/trace")
+def slice_trace(id_slice: int):
+    """
+    Waterfall de las trazas de un slice (verify, deploy, delete): cada etapa
+    con su servicio, desplazamiento y duración. "texto" trae la cascada lista
+    para imprimir.
+    """
+    try:
+        trazas = tracing.trazas_con_atributo("slice_id", id_slice)
+        return {"success": True, "slice_id": id_slice, "total": len(trazas), "trazas": trazas}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 # ======================================
 # ENDPOINT RAÍZ
 # ======================================
@@ -1836,7 +2038,8 @@ def root():
         "endpoints": {
             "/placement/verify": "POST - Verificar viabilidad",
             "/placement/deploy": "POST - Desplegar slice",
-            "/placement/delete": "POST - Eliminar slice"
+            "/placement/delete": "POST - Eliminar slice",
+            "/slices/{id_slice}/trace": "GET - Waterfall de tiempos por etapa"
         }
     }
 
@@ -3,6 +3,7 @@ import os
 import json
 import pika
 import uuid
+import tracing
 
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
@@ -33,7 +34,8 @@ def publish_to_network(message: dict):
         routing_key=QUEUE_NETWORK,
         body=body,
         properties=pika.BasicProperties(
-            delivery_mode=1  # no persistente
+            delivery_mode=1,  # no persistente
+            headers=tracing.inject_headers()  # traceparent W3C
         ),
     )
     conn.close()
@@ -74,6 +76,7 @@ def rpc_call_network(request: dict, timeout: int = 10):
         properties=pika.BasicProperties(
             reply_to=callback_queue,
             correlation_id=corr_id,
+            headers=tracing.inject_headers(),  # traceparent W3C
         ),
         body=json.dumps(request),
     )
@@ -119,6 +122,7 @@ def rpc_call_vm_placement(request: dict, timeout: int = 10):
         properties=pika.BasicProperties(
             reply_to=callback_queue,
             correlation_id=corr_id,
+            headers=tracing.inject_headers(),  # traceparent W3C
         ),
         body=json.dumps(request),
     )
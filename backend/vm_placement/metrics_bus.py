@@ -0,0 +1,145 @@
+"""
+Bus de métricas sobre RabbitMQ (exchanges fanout).
+
+    monitoring_service ──metrics.samples──▶ analytics_service ──metrics.snapshots──▶ vm_placement
+
+Cada publicador y cada suscriptor usa su propia conexión pika en su propio
+hilo (BlockingConnection no es thread-safe) y se reconecta solo si RabbitMQ
+se cae. Los mensajes son efímeros: si nadie escucha, se pierden; el estado
+completo siempre puede reconstruirse desde la fuente (HTTP / CSV).
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+import pika
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+RABBITMQ_USER = os.getenv("RABBITMQ_USER", "admin")
+RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "admin")
+
+SAMPLES_EXCHANGE = os.getenv("METRICS_SAMPLES_EXCHANGE", "metrics.samples")
+SNAPSHOTS_EXCHANGE = os.getenv("METRICS_SNAPSHOTS_EXCHANGE", "metrics.snapshots")
+
+RECONNECT_DELAY = 5
+
+
+def _connect():
+    credentials = pika.PlainCredentials(RABBITMQ_USER, RABBITMQ_PASS)
+    params = pika.ConnectionParameters(host=RABBITMQ_HOST, credentials=credentials, heartbeat=30)
+    return pika.BlockingConnection(params)
+
+
+class Publisher:
+    """
+    Publica dicts JSON en un exchange fanout desde un hilo dedicado.
+    publish() nunca bloquea: si la cola local se llena, descarta el mensaje.
+    """
+
+    def __init__(self, exchange, max_pending=1000):
+        self.exchange = exchange
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.connected = False
+        self.published = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name=f"pub-{exchange}", daemon=True)
+        self.thread.start()
+
+    def publish(self, message, headers=None):
+        try:
+            self.pending.put_nowait((message, headers))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            try:
+                conn = _connect()
+                ch = conn.channel()
+                ch.exchange_declare(exchange=self.exchange, exchange_type="fanout", durable=False)
+                self.connected = True
+                print(f"🐇 Publicando métricas en exchange '{self.exchange}'")
+
+                while True:
+                    try:
+                        message, headers = self.pending.get(timeout=1)
+                    except queue.Empty:
+                        conn.process_data_events(0)  # mantener heartbeats
+                        continue
+                    ch.basic_publish(
+                        exchange=self.exchange,
+                        routing_key="",
+                        body=json.dumps(message),
+                        properties=pika.BasicProperties(
+                            content_type="application/json",
+                            delivery_mode=1,  # no persistente
+                            headers=headers
+                        )
+                    )
+                    self.published += 1
+
+            except Exception as e:
+                self.connected = False
+                print(f"⚠️ Publicador '{self.exchange}' desconectado: {e}. Reintentando en {RECONNECT_DELAY}s")
+                time.sleep(RECONNECT_DELAY)
+
+    def stats(self):
+        return {
+            "exchange": self.exchange,
+            "connected": self.connected,
+            "published": self.published,
+            "dropped": self.dropped,
+            "pending": self.pending.qsize()
+        }
+
+
+class Subscriber:
+    """
+    Consume un exchange fanout con una cola exclusiva y efímera y llama
+    callback(message: dict, headers: dict) por cada mensaje, en su propio hilo.
+    """
+
+    def __init__(self, exchange, callback):
+        self.exchange = exchange
+        self.callback = callback
+        self.connected = False
+        self.received = 0
+        self.last_message_at = None
+        self.thread = threading.Thread(target=self._run, name=f"sub-{exchange}", daemon=True)
+        self.thread.start()
+
+    def _on_message(self, ch, method, props, body):
+        try:
+            self.callback(json.loads(body), props.headers or {})
+            self.received += 1
+            self.last_message_at = time.time()
+        except Exception as e:
+            print(f"⚠️ Error procesando mensaje de '{self.exchange}': {e}")
+
+    def _run(self):
+        while True:
+            try:
+                conn = _connect()
+                ch = conn.channel()
+                ch.exchange_declare(exchange=self.exchange, exchange_type="fanout", durable=False)
+                result = ch.queue_declare(queue="", exclusive=True, auto_delete=True)
+                ch.queue_bind(exchange=self.exchange, queue=result.method.queue)
+                ch.basic_consume(queue=result.method.queue, on_message_callback=self._on_message, auto_ack=True)
+                self.connected = True
+                print(f"🐇 Suscrito a exchange '{self.exchange}'")
+                ch.start_consuming()
+
+            except Exception as e:
+                self.connected = False
+                print(f"⚠️ Suscriptor '{self.exchange}' desconectado: {e}. Reintentando en {RECONNECT_DELAY}s")
+                time.sleep(RECONNECT_DELAY)
+
+    def stats(self):
+        return {
+            "exchange": self.exchange,
+            "connected": self.connected,
+            "received": self.received,
+            "last_message_at": self.last_message_at
+        }
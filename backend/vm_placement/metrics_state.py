@@ -0,0 +1,101 @@
+"""
+Estado de métricas en memoria para VM Placement.
+
+Se suscribe al exchange de snapshots que publica analytics_service (una fila
+por worker cada ciclo, mismas columnas que el CSV) y guarda los últimos
+PLACEMENT_WINDOW_MINUTES por worker. Las funciones de vm_placement_core
+arman su DataFrame desde aquí en lugar de releer el CSV en cada request;
+el CSV queda como respaldo (arranque en frío o push caído).
+
+Cada snapshot trae además "uso_zonas": el uso real de lo reservado por zona
+(p95 de CPU/RAM por VM) que calcula analytics con las métricas por instancia.
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+from metrics_bus import Subscriber, SNAPSHOTS_EXCHANGE
+
+PLACEMENT_WINDOW_MINUTES = int(os.getenv("PLACEMENT_WINDOW_MINUTES", "15"))
+PUSH_STALE_SECONDS = int(os.getenv("PUSH_STALE_SECONDS", "30"))
+LIMA_TZ = ZoneInfo("America/Lima")
+
+_lock = threading.Lock()
+_por_worker = {}          # worker → deque[(ts, fila)]
+_subscriber = None
+_cache = {"version": -1, "df": None}
+_uso_zonas = {"timestamp": None, "zonas": {}}
+_version = 0
+
+
+def _on_snapshot(message, headers):
+    global _version
+    ts = float(message["timestamp"])
+    corte = ts - PLACEMENT_WINDOW_MINUTES * 60
+    timestamp = datetime.fromtimestamp(ts, LIMA_TZ).strftime("%Y-%m-%d %H:%M:%S")
+
+    with _lock:
+        for row in message.get("rows", []):
+            serie = _por_worker.setdefault(row.get("worker_nombre", ""), deque())
+            serie.append((ts, {**row, "timestamp": timestamp}))
+            while serie and serie[0][0] < corte:
+                serie.popleft()
+        if "uso_zonas" in message:
+            _uso_zonas.update({"timestamp": ts, "zonas": message["uso_zonas"] or {}})
+        _version += 1
+
+
+def iniciar():
+    """Arranca la suscripción (una sola vez por proceso)"""
+    global _subscriber
+    if _subscriber is None:
+        _subscriber = Subscriber(SNAPSHOTS_EXCHANGE, _on_snapshot)
+
+
+def listo():
+    """True si hay snapshots recientes por push"""
+    if _subscriber is None or not _subscriber.connected:
+        return False
+    ultimo = _subscriber.last_message_at
+    return ultimo is not None and time.time() - ultimo <= PUSH_STALE_SECONDS and bool(_por_worker)
+
+
+def dataframe():
+    """
+    DataFrame con la ventana reciente (columnas del CSV). Se reconstruye
+    solo cuando llegó un snapshot nuevo; entre snapshots se reutiliza.
+    """
+    with _lock:
+        if _cache["version"] == _version:
+            return _cache["df"].copy()
+        filas = [fila for serie in _por_worker.values() for _, fila in serie]
+        version = _version
+
+    df = pd.DataFrame(filas)
+    with _lock:
+        _cache.update({"version": version, "df": df})
+    return df.copy()
+
+
+def uso_zona(zona):
+    """Uso real por VM de la zona ({instancias, cpu_uso_p95, ram_uso_p95}) o None si no está al día"""
+    with _lock:
+        if _uso_zonas["timestamp"] is None or time.time() - _uso_zonas["timestamp"] > PUSH_STALE_SECONDS:
+            return None
+        return _uso_zonas["zonas"].get(zona)
+
+
+def stats():
+    with _lock:
+        muestras = sum(len(serie) for serie in _por_worker.values())
+    return {
+        "push": _subscriber.stats() if _subscriber else {"enabled": False},
+        "workers": len(_por_worker),
+        "muestras_en_ventana": muestras,
+        "uso_zonas": dict(_uso_zonas)
+    }
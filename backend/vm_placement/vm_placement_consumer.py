@@ -2,6 +2,10 @@
 import pika
 import json
 import os
+import time
+import metrics_state
+import tracing
+from prometheus_client import Counter, Histogram, start_http_server
 from vm_placement_core import (
     obtener_unico_csv,
     run_vm_placement,
@@ -15,8 +19,27 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "admin")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "admin")
 RPC_QUEUE_VMPLACEMENT = os.getenv("RPC_QUEUE_VMPLACEMENT", "rpc_vm_placement")
+PLACEMENT_METRICS_PORT = int(os.getenv("PLACEMENT_METRICS_PORT", "9102"))
+
+# =============================
+# MÉTRICAS PROMETHEUS
+# =============================
+decisiones_placement = Counter(
+    "placement_decisions_total", "Decisiones de VM Placement",
+    ["zona", "resultado", "modo"]
+)
+latencia_placement = Histogram(
+    "placement_decision_duration_seconds", "Tiempo de cada decisión de VM Placement",
+    ["zona"], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
 
 print("🐇 Iniciando VM Placement RPC Consumer...")
+
+# Snapshots de analytics por push (el CSV queda como respaldo)
+metrics_state.iniciar()
+# /metrics en formato Prometheus (el consumer no tiene servidor HTTP propio)
+start_http_server(PLACEMENT_METRICS_PORT)
+print(f"📈 Métricas Prometheus en :{PLACEMENT_METRICS_PORT}/metrics")
 print(f"Host RabbitMQ: {RABBITMQ_HOST}")
 print(f"Cola RPC: {RPC_QUEUE_VMPLACEMENT}")
 
@@ -24,8 +47,18 @@ print(f"Cola RPC: {RPC_QUEUE_VMPLACEMENT}")
 # HANDLER DEL RPC
 # =============================
 def on_request(ch, method, props, body):
+    # Span hijo del traceparent que trae el mensaje (slice_manager → verify)
+    traceparent = (props.headers or {}).get("traceparent")
+    with tracing.span("placement.evaluar", parent=traceparent) as span:
+        response = evaluar_request(ch, method, props, body)
+        span.set("can_deploy", bool(response.get("can_deploy")))
+        span.set("modo", response.get("modo"))
+
+def evaluar_request(ch, method, props, body):
     print("[RPC VM-PLACEMENT] Request recibido:", body)
     response = None  # por si algo raro pasa
+    inicio = time.perf_counter()
+    zona = "desconocida"
 
     try:
         # 1) Parsear el JSON del body
@@ -38,11 +71,13 @@ def on_request(ch, method, props, body):
                 "error": f"JSON inválido: {e}"
             }
         else:
+            zona = str(slice_data.get("zonadisponibilidad") or "BE").upper()
+            tracing.anotar(slice_id=slice_data.get("id_slice"), zona=zona)
             # 2) Toda la lógica de VM Placement protegida
             try:
                 ruta_csv = obtener_unico_csv()
 
-                if ruta_csv is None:
+                if ruta_csv is None and not metrics_state.listo():
                     response = {
                         "can_deploy": False,
                         "placement_plan": [],
@@ -147,6 +182,15 @@ def on_request(ch, method, props, body):
                 "error": "Error inesperado: response vacío en consumer"
             }
 
+        if response.get("can_deploy"):
+            resultado = "aceptado"
+        elif "placement_plan" in response and "modo" in response:
+            resultado = "rechazado"   # se evaluó y no hay capacidad
+        else:
+            resultado = "error"
+        decisiones_placement.labels(zona, resultado, response.get("modo", "ninguno")).inc()
+        latencia_placement.labels(zona).observe(time.perf_counter() - inicio)
+
         ch.basic_publish(
             exchange="",
             routing_key=props.reply_to,
@@ -159,6 +203,8 @@ def on_request(ch, method, props, body):
         ch.basic_ack(delivery_tag=method.delivery_tag)
         print("📤 [RPC VM-PLACEMENT] Respuesta enviada.")
 
+    return response
+
 
 # ==============================
 # MAIN LOOP (CON CREDENCIALES)
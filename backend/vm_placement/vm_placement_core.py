@@ -1,6 +1,9 @@
+import os
 import pandas as pd
 from pathlib import Path
 
+import metrics_state
+
 
 METRICS_DIR = Path("/app/metrics_storage")
 
@@ -51,12 +54,52 @@ UMBRAL_ZONAS = {
     }
 }
 
+# Factores dinámicos: ajustar factor_cpu/factor_ram con el uso real por VM
+# de la zona (p95 de lo reservado, publicado por analytics). Acotados a
+# [FACTOR_MIN_RATIO, FACTOR_MAX_RATIO] veces el factor estático.
+FACTORES_DINAMICOS = os.getenv("PLACEMENT_FACTORES_DINAMICOS", "false").lower() == "true"
+FACTORES_MIN_INSTANCIAS = int(os.getenv("PLACEMENT_FACTORES_MIN_INSTANCIAS", "3"))
+FACTOR_MIN_RATIO = float(os.getenv("PLACEMENT_FACTOR_MIN_RATIO", "0.5"))
+FACTOR_MAX_RATIO = float(os.getenv("PLACEMENT_FACTOR_MAX_RATIO", "2.0"))
+
 # Mapeo: zona de disponibilidad → workers que se deben evaluar
 ZONA_A_WORKER = {
     "BE": "server2",
     "HP": ["server3", "server4"],
     "UHP": ["worker1", "worker2", "worker3"]
 }
+# ================== FACTORES DE SOBREPROVISIÓN ==================
+def _refinar_factor(estatico, uso_p95):
+    """
+    Si las VMs usan en p95 un uso_p95% de lo reservado, caben ~100/uso_p95
+    por unidad física. Se acota alrededor del factor estático y nunca baja de 1.
+    """
+    if not uso_p95 or uso_p95 <= 0:
+        return estatico * FACTOR_MAX_RATIO
+    observado = 100.0 / uso_p95
+    return max(1.0, min(max(observado, estatico * FACTOR_MIN_RATIO), estatico * FACTOR_MAX_RATIO))
+
+def factores_zona(zona):
+    """
+    (factor_cpu, factor_ram, factor_storage) de la zona. Con
+    PLACEMENT_FACTORES_DINAMICOS y suficientes VMs medidas, CPU y RAM se
+    ajustan con el uso real; storage siempre es el estático.
+    """
+    cfg = ZONAS_DISPONIBILIDAD[zona]
+    f_cpu, f_ram, f_sto = cfg["factor_cpu"], cfg["factor_ram"], cfg["factor_storage"]
+    if not FACTORES_DINAMICOS:
+        return f_cpu, f_ram, f_sto
+
+    uso = metrics_state.uso_zona(zona)
+    if not uso or uso.get("instancias", 0) < FACTORES_MIN_INSTANCIAS:
+        return f_cpu, f_ram, f_sto
+
+    f_cpu_real = _refinar_factor(f_cpu, uso.get("cpu_uso_p95"))
+    f_ram_real = _refinar_factor(f_ram, uso.get("ram_uso_p95")) if uso.get("ram_uso_p95") is not None else f_ram
+    print(f"📐 Factores zona {zona} ajustados por uso real ({uso['instancias']} VMs): "
+          f"CPU {f_cpu} → {f_cpu_real:.2f}, RAM {f_ram} → {f_ram_real:.2f}")
+    return f_cpu_real, f_ram_real, f_sto
+
 # ================== FUNCIONES DE LECTURA ==================
 def obtener_unico_csv():
     archivos = list(METRICS_DIR.glob("*.csv"))
@@ -66,12 +109,21 @@ def obtener_unico_csv():
         print(f"⚠️ Advertencia: hay más de un CSV, usando el primero: {archivos[0]}")
     return archivos[0]
 
+def leer_metricas(ruta_csv):
+    """
+    DataFrame de métricas: desde el estado en memoria (snapshots por push)
+    si está al día; si no, del CSV en el volumen compartido.
+    """
+    if metrics_state.listo():
+        return metrics_state.dataframe()
+    return pd.read_csv(ruta_csv)
+
 
 
 # ================== FUNCIONES DE CÁLCULO ==================
 
 def obtener_libres_actual(ruta_csv):
-    df = pd.read_csv(ruta_csv)
+    df = leer_metricas(ruta_csv)
 
     # aseguramos orden por timestamp
     df = df.sort_values(by="timestamp")
@@ -148,15 +200,35 @@ def parse_ram_to_gb(ram_str):
             print(f"⚠️ Error parseando RAM sin unidad: '{ram_str}'")
             return 1.0
 
+def recursos_vm(vm):
+    """
+    (cpu, ram_gb, storage_gb) de una VM. Usa las columnas numéricas que envía
+    slice_manager (cpu_count, ram_mb, storage_gb); parsea los strings solo si
+    el payload no las trae.
+    """
+    if vm.get("ram_mb") is not None and vm.get("cpu_count") is not None and vm.get("storage_gb") is not None:
+        return int(vm["cpu_count"]), vm["ram_mb"] / 1024.0, float(vm["storage_gb"])
+
+    storage_str = str(vm["storage"]).strip().lower().replace(" ", "")
+    if "gb" in storage_str:
+        sto_gb = float(storage_str.replace("gb", ""))
+    elif "mb" in storage_str:
+        sto_gb = float(storage_str.replace("mb", "")) / 1024.0
+    else:
+        try:
+            sto_gb = float(storage_str)
+        except ValueError:
+            print(f"⚠️ Error parseando storage: '{vm['storage']}'")
+            sto_gb = 10.0  # Default 10GB
+    return int(vm["cpu"]), parse_ram_to_gb(vm["ram"]), sto_gb
+
 def evaluar_workers(slice_req, workers_libres, zona):
     """
     Evalúa recursos de cada worker dado el requerimiento del slice y la zona.
     """
     resultados = {}
 
-    f_cpu = ZONAS_DISPONIBILIDAD[zona]["factor_cpu"]
-    f_ram = ZONAS_DISPONIBILIDAD[zona]["factor_ram"]
-    f_sto = ZONAS_DISPONIBILIDAD[zona]["factor_storage"]
+    f_cpu, f_ram, f_sto = factores_zona(zona)
 
     for worker, libres in workers_libres.items():
 
@@ -216,9 +288,10 @@ def evaluar_slice_con_csv(ruta_csv, slice_data):
     workers_libres = obtener_libres_actual(ruta_csv)
 
     # === Cálculo de recursos del slice =====
-    total_cpu = sum(int(vm["cpu"]) for vm in slice_data["instancias"])
-    total_ram = sum(parse_ram_to_gb(vm["ram"]) for vm in slice_data["instancias"])
-    total_storage = sum(float(vm["storage"].lower().replace("gb", "")) for vm in slice_data["instancias"])
+    recursos = [recursos_vm(vm) for vm in slice_data["instancias"]]
+    total_cpu = sum(r[0] for r in recursos)
+    total_ram = sum(r[1] for r in recursos)
+    total_storage = sum(r[2] for r in recursos)
 
     slice_req = {
         "cpu_req": total_cpu,
@@ -261,7 +334,7 @@ def analizar_worker_10min(file_path, worker_objetivo, umbral,
     existe al menos un intervalo continuo donde cpu_utilizado_bd >= umbral
     con duración mayor a limite_segundos.
     """
-    df = pd.read_csv(file_path)
+    df = leer_metricas(file_path)
     df["timestamp"] = pd.to_datetime(df["timestamp"])
 
     df = df[df["worker_nombre"] == worker_objetivo].sort_values("timestamp")
@@ -308,7 +381,7 @@ def evaluar_intervalos_zona(ruta_csv, zona, workers_zona):
 
     ventana_min = 10  # siempre 10 minutos
 
-    df = pd.read_csv(ruta_csv)
+    df = leer_metricas(ruta_csv)
     df["timestamp"] = pd.to_datetime(df["timestamp"])
 
     resultados_intervalo = {}
@@ -350,7 +423,7 @@ def competir_workers(file_path, workers_a_competir):
     if not workers_a_competir:
         return {"ganadores": [], "scores": {}}
 
-    df = pd.read_csv(file_path)
+    df = leer_metricas(file_path)
     df["timestamp"] = pd.to_datetime(df["timestamp"])
     df = df.sort_values("timestamp")
 
@@ -552,23 +625,7 @@ def normalizar_instancias(instancias):
     """
     vms = []
     for idx, vm in enumerate(instancias):
-        cpu = int(vm["cpu"])
-        
-        # 🟢 USAR parse_ram_to_gb EN LUGAR DE CONVERSIÓN MANUAL
-        ram_gb = parse_ram_to_gb(vm["ram"])
-        
-        # 🟢 MEJORAR PARSEO DE STORAGE
-        storage_str = str(vm["storage"]).strip().lower().replace(" ", "")
-        if "gb" in storage_str:
-            sto_gb = float(storage_str.replace("gb", ""))
-        elif "mb" in storage_str:
-            sto_gb = float(storage_str.replace("mb", "")) / 1024.0
-        else:
-            try:
-                sto_gb = float(storage_str)
-            except ValueError:
-                print(f"⚠️ Error parseando storage: '{vm['storage']}'")
-                sto_gb = 10.0  # Default 10GB
+        cpu, ram_gb, sto_gb = recursos_vm(vm)
 
         vms.append({
             "index": idx,
@@ -595,9 +652,7 @@ def asignar_vms_max_localidad(vms, workers_libres, zona):
         vms_restantes (lista): VMs que NO se pudieron asignar.
     """
     # Factores de sobreprovisión por zona
-    f_cpu = ZONAS_DISPONIBILIDAD[zona]["factor_cpu"]
-    f_ram = ZONAS_DISPONIBILIDAD[zona]["factor_ram"]
-    f_sto = ZONAS_DISPONIBILIDAD[zona]["factor_storage"]
+    f_cpu, f_ram, f_sto = factores_zona(zona)
 
     # Copiamos capacidades para no modificar el dict original
     capacidades = {}
@@ -2,7 +2,9 @@
 import psutil
 import socket
 import json
+import os
 import time
+import gzip
 import requests
 from datetime import datetime
 
@@ -10,40 +12,343 @@ from datetime import datetime
 # CONFIGURACIÓN
 # ===========================
 HEADNODE_URL = "http://192.168.201.1:5000/metrics"  # IP del Headnode
+HEADNODE_BATCH_URL = HEADNODE_URL + "/batch"
 INTERVAL = 10  # segundos entre envíos (igual en todos los workers)
 
+# Período de muestreo local de CPU (puede ser < 1s); se agrega por INTERVAL
+SAMPLE_INTERVAL = float(os.getenv("DAEMON_SAMPLE_INTERVAL", "1.0"))
+
+# Muestras que se acumulan antes de enviar (1 = enviar cada ciclo)
+BATCH_SIZE = int(os.getenv("DAEMON_BATCH_SIZE", "1"))
+# Máximo de muestras por request al vaciar el spool
+BATCH_MAX = 500
+
+# Cada cuántos ciclos QemuTracker vuelve a clasificar todos los PIDs (no solo los nuevos)
+QEMU_RESCAN_CYCLES = int(os.getenv("DAEMON_QEMU_RESCAN_CYCLES", "6"))
+
+# Spool en disco: muestras que no se pudieron enviar (NDJSON, una por línea)
+SPOOL_PATH = os.getenv("DAEMON_SPOOL_PATH", "/var/lib/metrics-daemon/spool.ndjson")
+SPOOL_MAX_BYTES = int(os.getenv("DAEMON_SPOOL_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Sesión persistente: reutiliza la conexión TCP (keep-alive) entre envíos
+session = requests.Session()
+batch_disponible = True   # se desactiva si el headnode no tiene /metrics/batch
+
+# ===========================
+# MUESTREO DE CPU: deltas de /proc/stat
+# ===========================
+def read_proc_stat():
+    """(total, ocioso) en jiffies de la línea 'cpu' agregada de /proc/stat"""
+    with open("/proc/stat") as f:
+        campos = [int(v) for v in f.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal (guest ya va dentro de user)
+    total = sum(campos[:8])
+    ocioso = campos[3] + campos[4]
+    return total, ocioso
+
+class CpuSampler:
+    """
+    Uso de CPU del host sin bloquear: cada sample() compara contra la lectura
+    anterior de /proc/stat. Se acumulan las muestras de la ventana y
+    flush() devuelve promedio (delta de toda la ventana), máximo y p95.
+    """
+
+    def __init__(self):
+        self.inicio = self.ultimo = read_proc_stat()
+        self.valores = []
+
+    def sample(self):
+        actual = read_proc_stat()
+        total = actual[0] - self.ultimo[0]
+        if total > 0:
+            self.valores.append(100.0 * (1 - (actual[1] - self.ultimo[1]) / total))
+        self.ultimo = actual
+
+    def flush(self):
+        self.sample()
+        total = self.ultimo[0] - self.inicio[0]
+        promedio = 100.0 * (1 - (self.ultimo[1] - self.inicio[1]) / total) if total > 0 else 0.0
+        ordenados = sorted(self.valores) or [promedio]
+        resultado = {
+            "cpu_percent": round(promedio, 1),
+            "cpu_percent_max": round(ordenados[-1], 1),
+            "cpu_percent_p95": round(ordenados[max(0, -(-len(ordenados) * 95 // 100) - 1)], 1),
+            "cpu_samples": len(self.valores)
+        }
+        self.inicio = self.ultimo
+        self.valores = []
+        return resultado
+
+# ===========================
+# PROCESOS QEMU: PIDs cacheados + métricas por VM
+# ===========================
+def vm_name_from_cmdline(cmdline):
+    """
+    Nombre de la VM desde el argumento -name de qemu (name o guest=name,...);
+    si no hay -name, el nombre del disco (vms-disk/<nombre_vm>.qcow2).
+    """
+    if "-name" in cmdline:
+        i = cmdline.index("-name")
+        if i + 1 < len(cmdline):
+            valor = cmdline[i + 1].split(",")[0]
+            return valor[len("guest="):] if valor.startswith("guest=") else valor
+    for arg in cmdline:
+        for opcion in arg.split(","):
+            if opcion.startswith("file=") and opcion.endswith(".qcow2"):
+                return os.path.basename(opcion)[:-len(".qcow2")]
+    return None
+
+def tap_ifnames_from_cmdline(cmdline):
+    """Interfaces TAP de la VM (-netdev tap,ifname=...)"""
+    return [
+        opcion[len("ifname="):]
+        for arg in cmdline
+        for opcion in arg.split(",")
+        if opcion.startswith("ifname=")
+    ]
+
+class QemuTracker:
+    """
+    Mantiene el conjunto de PIDs qemu sin recorrer la tabla de procesos con
+    psutil cada ciclo: solo se lee /proc/<pid>/comm de los PIDs nuevos desde
+    el refresco anterior; los PIDs que desaparecen salen del cache.
+    Un PID nuevo que no era qemu se vuelve a mirar en el ciclo siguiente
+    (fork de vm_create.sh antes del exec de qemu), y cada QEMU_RESCAN_CYCLES
+    se reclasifican todos (PID reutilizado por otro proceso).
+    Por cada VM reporta CPU (delta de cpu_times), RSS, IO de disco del
+    proceso y tráfico de sus interfaces TAP.
+    """
+
+    def __init__(self):
+        self.vistos = set()      # PIDs ya clasificados (qemu o no)
+        self.recientes = set()   # PIDs no qemu vistos por primera vez en el refresco anterior
+        self.procesos = {}       # pid → {"proc", "name", "taps", "cpu", "io", "net", "t"}
+        self.ciclos = 0
+
+    def refresh(self):
+        actuales = {int(d) for d in os.listdir("/proc") if d.isdigit()}
+        self.ciclos += 1
+        if self.ciclos % QEMU_RESCAN_CYCLES == 0:
+            # is_running() compara create_time: detecta un PID qemu reutilizado
+            for pid, estado in list(self.procesos.items()):
+                if not estado["proc"].is_running():
+                    self.procesos.pop(pid)
+            candidatos = actuales - self.procesos.keys()
+        else:
+            candidatos = (actuales - self.vistos) | (self.recientes & actuales)
+        recientes = set()
+        for pid in candidatos:
+            try:
+                with open(f"/proc/{pid}/comm") as f:
+                    if "qemu" not in f.read():
+                        if pid not in self.vistos:
+                            recientes.add(pid)
+                        continue
+                proc = psutil.Process(pid)
+                cmdline = proc.cmdline()
+                self.procesos[pid] = {"proc": proc, "name": vm_name_from_cmdline(cmdline),
+                                      "taps": tap_ifnames_from_cmdline(cmdline),
+                                      "cpu": None, "io": None, "net": None, "t": None}
+            except (OSError, psutil.Error):
+                continue
+        for pid in self.vistos - actuales:
+            self.procesos.pop(pid, None)
+        self.vistos = actuales
+        self.recientes = recientes
+
+    def collect(self):
+        """Métricas por proceso qemu desde la llamada anterior"""
+        self.refresh()
+        vms = []
+        ahora = time.monotonic()
+        nics = psutil.net_io_counters(pernic=True) if self.procesos else {}
+        for pid, estado in list(self.procesos.items()):
+            proc = estado["proc"]
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    rss = proc.memory_info().rss
+                    try:
+                        io = proc.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        io = None
+            except psutil.NoSuchProcess:
+                self.procesos.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+
+            cpu_total = cpu.user + cpu.system
+            # Lo que el TAP envía lo recibe la VM, y viceversa
+            taps = [nics[tap] for tap in estado["taps"] if tap in nics]
+            net = (sum(t.bytes_sent for t in taps), sum(t.bytes_recv for t in taps)) if taps else None
+
+            vm = {"pid": pid, "name": estado["name"], "cpu_time_s": round(cpu_total, 2),
+                  "rss_mb": round(rss / (1024**2), 1), "cpu_percent": None,
+                  "read_bps": None, "write_bps": None, "net_rx_bps": None, "net_tx_bps": None}
+            if estado["t"] is not None:
+                dt = ahora - estado["t"]
+                if dt > 0:
+                    # % de un núcleo, como top (una VM con 2 vCPU llega a 200%)
+                    vm["cpu_percent"] = round(100.0 * (cpu_total - estado["cpu"]) / dt, 1)
+                    if io is not None and estado["io"] is not None:
+                        vm["read_bps"] = int((io.read_bytes - estado["io"].read_bytes) / dt)
+                        vm["write_bps"] = int((io.write_bytes - estado["io"].write_bytes) / dt)
+                    if net is not None and estado["net"] is not None:
+                        vm["net_rx_bps"] = int((net[0] - estado["net"][0]) / dt)
+                        vm["net_tx_bps"] = int((net[1] - estado["net"][1]) / dt)
+            estado.update({"cpu": cpu_total, "io": io, "net": net, "t": ahora})
+            vms.append(vm)
+        return vms
+
+cpu_sampler = None
+qemu_tracker = QemuTracker()
+
 # ===========================
 # FUNCIÓN: obtener métricas del worker
 # ===========================
 def get_metrics():
-    qemu_count = len([p for p in psutil.process_iter(['name']) if 'qemu' in (p.info['name'] or '')])
     mem = psutil.virtual_memory()
     disk = psutil.disk_usage('/')
+    vms = qemu_tracker.collect()
 
-    return {
+    metrics = {
         "hostname": socket.gethostname(),
         "timestamp_sent": datetime.utcnow().isoformat(),          # Hora UTC exacta del envío
-        "cpu_percent": psutil.cpu_percent(interval=1),            # Uso CPU (%)
         "cpu_count": psutil.cpu_count(logical=True),              # Núcleos
         "ram_percent": mem.percent,                               # Uso RAM (%)
         "ram_total_gb": round(mem.total / (1024**3), 2),          # RAM total
         "disk_percent": disk.percent,                             # Uso disco (%)
         "disk_free_gb": round(disk.free / (1024**3), 2),          # Disco libre
-        "qemu_count": qemu_count                                  # Cantidad de VMs (procesos qemu)
+        "qemu_count": len(vms),                                   # Cantidad de VMs (procesos qemu)
+        "vms": vms                                                # CPU/RSS/IO por proceso qemu
     }
+    # Uso CPU (%): promedio de la ventana + máximo y p95 de las submuestras
+    metrics.update(cpu_sampler.flush())
+    return metrics
 
 # ===========================
 # FUNCIÓN: enviar métricas
 # ===========================
-def send_to_headnode(data):
-    try:
-        response = requests.post(HEADNODE_URL, json=data, timeout=5)
-        if response.status_code == 200:
-            print(f"✅ [{data['hostname']}] Métricas enviadas correctamente.")
+def post_batch(samples, replay=False):
+    """
+    Envía varias muestras en un solo request (NDJSON comprimido con gzip).
+    Si el headnode no soporta /metrics/batch, cae a un POST por muestra.
+    replay=True marca muestras del spool (el headnode las archiva como backfill).
+    Devuelve True si todas fueron aceptadas.
+    """
+    global batch_disponible
+    extra = {"X-Metrics-Replay": "1"} if replay else {}
+    if batch_disponible:
+        body = gzip.compress("".join(json.dumps(s) + "\n" for s in samples).encode(), compresslevel=6)
+        response = session.post(
+            HEADNODE_BATCH_URL,
+            data=body,
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip", **extra},
+            timeout=10
+        )
+        if response.status_code == 404:
+            print("ℹ️ Headnode sin /metrics/batch, enviando una muestra por request")
+            batch_disponible = False
+        elif response.status_code == 200:
+            return True
         else:
+            print(f"⚠️ Error {response.status_code} en batch: {response.text}")
+            return False
+
+    for data in samples:
+        response = session.post(HEADNODE_URL, json=data, headers=extra, timeout=5)
+        if response.status_code != 200:
             print(f"⚠️ [{data['hostname']}] Error {response.status_code}: {response.text}")
-    except Exception as e:
-        print(f"❌ [{data['hostname']}] Error al enviar datos: {e}")
+            return False
+    return True
+
+def spool_append(samples):
+    """Guarda en disco las muestras que no se pudieron enviar"""
+    try:
+        if os.path.exists(SPOOL_PATH) and os.path.getsize(SPOOL_PATH) >= SPOOL_MAX_BYTES:
+            print(f"⚠️ Spool lleno ({SPOOL_MAX_BYTES} bytes), se descartan {len(samples)} muestra(s)")
+            return
+        os.makedirs(os.path.dirname(SPOOL_PATH), exist_ok=True)
+        with open(SPOOL_PATH, "a") as f:
+            for data in samples:
+                f.write(json.dumps(data) + "\n")
+    except OSError as e:
+        print(f"❌ No se pudo escribir el spool: {e}")
+
+def spool_replay():
+    """
+    Reenvía el spool en orden, en bloques de BATCH_MAX. Si un bloque falla,
+    el resto queda en disco para el siguiente ciclo.
+    Devuelve True si el spool quedó vacío.
+    """
+    if not os.path.exists(SPOOL_PATH):
+        return True
+    pendientes, corruptas = [], []
+    try:
+        with open(SPOOL_PATH, errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    pendientes.append(json.loads(line))
+                except ValueError:
+                    corruptas.append(line if line.endswith("\n") else line + "\n")
+    except OSError as e:
+        print(f"❌ No se pudo leer el spool: {e}")
+        return False
+    if corruptas:
+        # Línea truncada (daemon muerto a mitad de escritura): se aparta y no se reintenta
+        print(f"⚠️ Spool: {len(corruptas)} línea(s) corrupta(s) movidas a {SPOOL_PATH}.bad")
+        try:
+            with open(SPOOL_PATH + ".bad", "a") as f:
+                f.writelines(corruptas)
+        except OSError as e:
+            print(f"❌ No se pudo guardar las líneas corruptas: {e}")
+
+    enviados = 0
+    try:
+        while enviados < len(pendientes):
+            bloque = pendientes[enviados:enviados + BATCH_MAX]
+            if not post_batch(bloque, replay=True):
+                break
+            enviados += len(bloque)
+    except requests.RequestException as e:
+        print(f"❌ Error reenviando spool: {e}")
+
+    try:
+        if enviados == len(pendientes):
+            os.remove(SPOOL_PATH)
+        else:
+            tmp = SPOOL_PATH + ".tmp"
+            with open(tmp, "w") as f:
+                for data in pendientes[enviados:]:
+                    f.write(json.dumps(data) + "\n")
+            os.replace(tmp, SPOOL_PATH)
+    except OSError as e:
+        print(f"❌ No se pudo actualizar el spool: {e}")
+        return False
+    if enviados:
+        print(f"🔁 Spool: {enviados} muestra(s) reenviadas, {len(pendientes) - enviados} pendientes")
+    return enviados == len(pendientes)
+
+def send_to_headnode(samples):
+    """
+    El spool se vacía antes de enviar las muestras nuevas: así el headnode
+    recibe todo en orden de timestamp y las reenviadas no llegan detrás de
+    una muestra más reciente. Mientras quede spool, las nuevas van al final.
+    """
+    hostname = samples[0]["hostname"]
+    if not spool_replay():
+        spool_append(samples)
+        return
+    try:
+        if post_batch(samples):
+            print(f"✅ [{hostname}] {len(samples)} muestra(s) enviadas correctamente.")
+            return
+    except requests.RequestException as e:
+        print(f"❌ [{hostname}] Error al enviar datos: {e}")
+    spool_append(samples)
 
 # ===========================
 # LOOP PRINCIPAL
@@ -57,10 +362,22 @@ if __name__ == "__main__":
     if drift > 0:
         time.sleep(INTERVAL - drift)
 
+    cpu_sampler = CpuSampler()
+    qemu_tracker.collect()   # línea base para los deltas por VM
+
+    buffer = []
     while True:
-        metrics = get_metrics()
-        send_to_headnode(metrics)
+        # Submuestras de CPU hasta el siguiente ciclo exacto
+        siguiente = (time.time() // INTERVAL + 1) * INTERVAL
+        while True:
+            restante = siguiente - time.time()
+            if restante <= 0:
+                break
+            time.sleep(min(SAMPLE_INTERVAL, restante))
+            if siguiente - time.time() > 0:
+                cpu_sampler.sample()
 
-        # Esperar hasta el siguiente ciclo exacto
-        drift = time.time() % INTERVAL
-        time.sleep(INTERVAL - drift)
+        buffer.append(get_metrics())
+        if len(buffer) >= BATCH_SIZE:
+            send_to_headnode(buffer)
+            buffer = []
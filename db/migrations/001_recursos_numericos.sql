@@ -0,0 +1,38 @@
+-- Columnas numéricas de recursos para bases ya desplegadas
+-- (slice_db.sql ya las incluye para instalaciones nuevas).
+--
+-- cpu/ram/storage siguen siendo la fuente ("1", "512MB", "10GB"); MySQL
+-- mantiene cpu_count, ram_mb y storage_gb al insertar/actualizar.
+-- Un valor que no es número (+ MB/GB) deja la columna en NULL en lugar de
+-- hacer fallar el INSERT; slice_manager rechaza esas instancias al verificar.
+
+ALTER TABLE `instancia`
+  ADD COLUMN `cpu_count` int GENERATED ALWAYS AS (CASE WHEN REPLACE(`cpu`, ' ', '') REGEXP '^[0-9]+$' THEN CAST(REPLACE(`cpu`, ' ', '') AS UNSIGNED) END) STORED,
+  ADD COLUMN `ram_mb` int GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'MB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'GB', ''), ' ', '') AS DECIMAL(10,2)) * 1024
+      WHEN REPLACE(`ram`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`ram`, ' ', '') AS DECIMAL(10,2)) * 1024
+    END) STORED,
+  ADD COLUMN `storage_gb` decimal(10,2) GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'MB', ''), ' ', '') AS DECIMAL(10,2)) / 1024
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'GB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(`storage`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`storage`, ' ', '') AS DECIMAL(10,2))
+    END) STORED,
+  ADD KEY `idx_instancia_slice_recursos` (`slice_idslice`, `worker_idworker`, `cpu_count`, `ram_mb`, `storage_gb`);
+
+ALTER TABLE `worker`
+  ADD COLUMN `cpu_count` int GENERATED ALWAYS AS (CASE WHEN REPLACE(`cpu`, ' ', '') REGEXP '^[0-9]+$' THEN CAST(REPLACE(`cpu`, ' ', '') AS UNSIGNED) END) STORED,
+  ADD COLUMN `ram_mb` int GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'MB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'GB', ''), ' ', '') AS DECIMAL(10,2)) * 1024
+      WHEN REPLACE(`ram`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`ram`, ' ', '') AS DECIMAL(10,2)) * 1024
+    END) STORED,
+  ADD COLUMN `storage_gb` decimal(10,2) GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'MB', ''), ' ', '') AS DECIMAL(10,2)) / 1024
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'GB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(`storage`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`storage`, ' ', '') AS DECIMAL(10,2))
+    END) STORED;
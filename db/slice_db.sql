@@ -116,6 +116,19 @@ CREATE TABLE `worker` (
   `cpu` varchar(45) DEFAULT NULL,
   `ram` varchar(45) DEFAULT NULL,
   `storage` varchar(45) DEFAULT NULL,
+  `cpu_count` int GENERATED ALWAYS AS (CASE WHEN REPLACE(`cpu`, ' ', '') REGEXP '^[0-9]+$' THEN CAST(REPLACE(`cpu`, ' ', '') AS UNSIGNED) END) STORED,
+  `ram_mb` int GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'MB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'GB', ''), ' ', '') AS DECIMAL(10,2)) * 1024
+      WHEN REPLACE(`ram`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`ram`, ' ', '') AS DECIMAL(10,2)) * 1024
+    END) STORED,
+  `storage_gb` decimal(10,2) GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'MB', ''), ' ', '') AS DECIMAL(10,2)) / 1024
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'GB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(`storage`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`storage`, ' ', '') AS DECIMAL(10,2))
+    END) STORED,
   PRIMARY KEY (`idworker`)
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb3;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -190,12 +203,27 @@ CREATE TABLE `instancia` (
   `platform` varchar(20) DEFAULT 'linux' COMMENT 'Plataforma donde se despliega: linux | openstack',
   `instance_id` varchar(100) DEFAULT NULL COMMENT 'UUID de la instancia en OpenStack (solo para platform=openstack)',
   `console_url` varchar(500) DEFAULT NULL COMMENT 'URL de consola VNC/noVNC para acceso remoto',
+  -- Versiones numéricas de cpu/ram/storage (calculadas por MySQL, no se escriben)
+  `cpu_count` int GENERATED ALWAYS AS (CASE WHEN REPLACE(`cpu`, ' ', '') REGEXP '^[0-9]+$' THEN CAST(REPLACE(`cpu`, ' ', '') AS UNSIGNED) END) STORED,
+  `ram_mb` int GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'MB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(UPPER(`ram`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`ram`), 'GB', ''), ' ', '') AS DECIMAL(10,2)) * 1024
+      WHEN REPLACE(`ram`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`ram`, ' ', '') AS DECIMAL(10,2)) * 1024
+    END) STORED,
+  `storage_gb` decimal(10,2) GENERATED ALWAYS AS (
+    CASE
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?MB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'MB', ''), ' ', '') AS DECIMAL(10,2)) / 1024
+      WHEN REPLACE(UPPER(`storage`), ' ', '') REGEXP '^[0-9]+([.][0-9]+)?GB$' THEN CAST(REPLACE(REPLACE(UPPER(`storage`), 'GB', ''), ' ', '') AS DECIMAL(10,2))
+      WHEN REPLACE(`storage`, ' ', '') REGEXP '^[0-9]+([.][0-9]+)?$' THEN CAST(REPLACE(`storage`, ' ', '') AS DECIMAL(10,2))
+    END) STORED,
   
   PRIMARY KEY (`idinstancia`,`slice_idslice`),
   KEY `fk_instancia_slice1_idx` (`slice_idslice`),
   KEY `fk_instancia_imagen1_idx` (`imagen_idimagen`),
   KEY `fk_instancia_vnc1_idx` (`vnc_idvnc`),
   KEY `fk_instancia_worker1_idx` (`worker_idworker`),
+  KEY `idx_instancia_slice_recursos` (`slice_idslice`, `worker_idworker`, `cpu_count`, `ram_mb`, `storage_gb`),
 
   CONSTRAINT `fk_instancia_imagen1` FOREIGN KEY (`imagen_idimagen`) REFERENCES `imagen` (`idimagen`),
   CONSTRAINT `fk_instancia_slice1` FOREIGN KEY (`slice_idslice`) REFERENCES `slice` (`idslice`),
@@ -211,7 +239,7 @@ CREATE TABLE `instancia` (
 
 LOCK TABLES `instancia` WRITE;
 /*!40000 ALTER TABLE `instancia` DISABLE KEYS */;
-INSERT INTO `instancia` VALUES
+INSERT INTO `instancia` (`idinstancia`, `slice_idslice`, `nombre`, `estado`, `cpu`, `ram`, `storage`, `salidainternet`, `imagen_idimagen`, `ip`, `vnc_idvnc`, `worker_idworker`, `process_id`, `platform`, `instance_id`, `console_url`) VALUES
 (1,19,'VM1','STOPPED','1','1GB','10GB',0,1,NULL,NULL,NULL,NULL,'linux',NULL, NULL),
 (2,19,'VM2','STOPPED','1','1GB','10GB',0,1,NULL,NULL,NULL,NULL,'linux',NULL, NULL),
 (3,19,'VM3','STOPPED','1','1GB','10GB',0,1,NULL,NULL,NULL,NULL,'linux',NULL, NULL);
@@ -318,4 +346,26 @@ CREATE TABLE `interfaces_tap` (
 ) ENGINE=InnoDB AUTO_INCREMENT=1 DEFAULT CHARSET=utf8mb3;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
+--
+-- Table structure for table `worker_uso`
+-- Recursos reservados por worker (instancias de slices RUNNING).
+-- slice_manager aplica deltas en la misma transacción que cambia el estado
+-- del slice; analytics recalcula todo periódicamente para corregir deriva.
+--
+
+DROP TABLE IF EXISTS `worker_uso`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!50503 SET character_set_client = utf8mb4 */;
+CREATE TABLE `worker_uso` (
+  `worker_idworker` int NOT NULL,
+  `cpu_reservado` int NOT NULL DEFAULT 0,
+  `ram_reservado_gb` decimal(10,2) NOT NULL DEFAULT 0,
+  `storage_reservado_gb` decimal(10,2) NOT NULL DEFAULT 0,
+  `instancias_running` int NOT NULL DEFAULT 0,
+  `actualizado` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`worker_idworker`),
+  CONSTRAINT `fk_worker_uso_worker1` FOREIGN KEY (`worker_idworker`) REFERENCES `worker` (`idworker`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 -- Dump completed on 2025-10-12  7:01:41
\ No newline at end of file
@@ -1,12 +1,14 @@
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from models import db, User, Slice, Rol, Instancia, Imagen, Vnc, Worker, Enlace, Vlan
 import os
+import re
 import json
 from datetime import datetime
 import logging
 import sys
 import requests
 from utils.novnc_manager import ensure_tunnel_and_token
+import tracing
 
 AUTH_SERVICE_URL = "http://auth:8080/login"
 VERIFY_URL = "http://auth:8080/verify"
@@ -47,6 +49,25 @@ def can_access_slice(user, slice_obj):
     # Regular users (usuariofinal, investigador) can only access their own slices
     return user in slice_obj.usuarios
 
+_RECURSO_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*(MB|GB)?$', re.IGNORECASE)
+
+def normalizar_recursos_vm(cpu, ram, storage):
+    """
+    Valida y normaliza los recursos de una VM antes de guardarla:
+    cpu → "2", ram/storage → "512MB" / "10GB" (sin unidad = GB).
+    Lanza ValueError si algún valor no es un número (+ MB/GB).
+    """
+    cpu_str = str(cpu).strip()
+    if not cpu_str.isdigit() or int(cpu_str) < 1:
+        raise ValueError(f'CPU inválida: {cpu!r}')
+    normalizados = [str(int(cpu_str))]
+    for nombre, valor in (('RAM', ram), ('Storage', storage)):
+        match = _RECURSO_RE.match(str(valor).strip())
+        if not match or float(match.group(1)) <= 0:
+            raise ValueError(f'Valor de {nombre} inválido: {valor!r} (use p.ej. 512MB o 10GB)')
+        normalizados.append(f'{match.group(1)}{(match.group(2) or "GB").upper()}')
+    return tuple(normalizados)
+
 def get_user_slices(user):
     """Get slices that user can access based on their role"""
     if not user:
@@ -427,6 +448,7 @@ def create_slice():
                 vm_cpu = request.form.get(f'vm_{i}_cpu', '1')
                 vm_ram = request.form.get(f'vm_{i}_ram', '1GB')
                 vm_storage = request.form.get(f'vm_{i}_storage', '10GB')
+                vm_cpu, vm_ram, vm_storage = normalizar_recursos_vm(vm_cpu, vm_ram, vm_storage)
                 vm_internet = request.form.get(f'vm_{i}_internet') == 'on'
                 
                 # 🔵 AHORA EL COMBO MANDA EL ID DE LA IMAGEN: 1, 2, 3
@@ -644,6 +666,7 @@ def stop_slice(slice_id):
     })
 """
 @app.route('/delete_slice/<int:slice_id>', methods=['POST'])
+@tracing.trazar("frontend.delete_slice")
 def delete_slice(slice_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
@@ -710,12 +733,14 @@ def delete_slice(slice_id):
             
             SLICE_MANAGER_URL = os.getenv("SLICE_MANAGER_URL", "http://slice-manager:8000")
             payload = {"id_slice": slice_id}
+            tracing.anotar(slice_id=slice_id)
             
             try:
                 response = requests.post(
                     f"{SLICE_MANAGER_URL}/placement/delete",
                     json=payload,
-                    timeout=120
+                    timeout=120,
+                    headers=tracing.inject_headers()
                 )
                 
                 if response.status_code == 200:
@@ -959,6 +984,7 @@ def update_slice(slice_id):
             vm_cpu = request.form.get(f'new_vm_{i}_cpu', '1')
             vm_ram = request.form.get(f'new_vm_{i}_ram', '1GB')
             vm_storage = request.form.get(f'new_vm_{i}_storage', '10GB')
+            vm_cpu, vm_ram, vm_storage = normalizar_recursos_vm(vm_cpu, vm_ram, vm_storage)
             vm_image_name = request.form.get(f'new_vm_{i}_image', 'ubuntu:latest')
             vm_internet = request.form.get(f'new_vm_{i}_internet') == 'on'  # 🟢 Corregido checkbox
             
@@ -1042,6 +1068,7 @@ def update_slice(slice_id):
 
 
 @app.route('/deploy_slice/<int:slice_id>', methods=['POST'])
+@tracing.trazar("frontend.deploy_slice")
 def deploy_slice(slice_id):
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
@@ -1090,12 +1117,14 @@ def deploy_slice(slice_id):
         }
         
         app.logger.info(f"🚀 Desplegando slice {slice_id} en plataforma: {platform.upper()} (zona {zona})")
+        tracing.anotar(slice_id=slice_id, platform=platform)
         
         # 1️⃣ VERIFICAR VIABILIDAD
         verify_response = requests.post(
             f"{SLICE_MANAGER_URL}/placement/verify",
             json=payload,
-            timeout=30
+            timeout=30,
+            headers=tracing.inject_headers()
         )
         
         if verify_response.status_code != 200:
@@ -1146,7 +1175,8 @@ def deploy_slice(slice_id):
         deploy_response = requests.post(
             f"{SLICE_MANAGER_URL}/placement/deploy",
             json=deploy_payload,
-            timeout=120
+            timeout=120,
+            headers=tracing.inject_headers()
         )
         
         if deploy_response.status_code != 200:
@@ -1576,15 +1606,18 @@ def api_analytics_summary():
 
 @app.route('/api/analytics/metrics/export/<fecha>')
 def api_analytics_export(fecha):
-    """Proxy para exportar CSV"""
+    """Proxy para exportar CSV (streaming, reenvía ?end=&columns=&workers=&gzip=)"""
     import requests
     try:
-        resp = requests.get(f'http://10.20.12.161:5030/metrics/export/{fecha}', timeout=10)
+        params = dict(request.args)
+        params['start'] = fecha
+        resp = requests.get('http://10.20.12.161:5030/metrics/export', params=params, stream=True, timeout=10)
         from flask import Response
         return Response(
-            resp.content,
-            mimetype='text/csv',
-            headers={'Content-Disposition': f'attachment; filename=metrics_{fecha}.csv'}
+            resp.iter_content(chunk_size=64 * 1024),
+            status=resp.status_code,
+            content_type=resp.headers.get('Content-Type', 'text/csv'),
+            headers={'Content-Disposition': resp.headers.get('Content-Disposition', f'attachment; filename=metrics_{fecha}.csv')}
         )
     except Exception as e:
         return {"error": str(e)}, 500
@@ -1860,6 +1893,7 @@ def import_topology():
             vm_cpu = vm_data.get('cpu', '1')
             vm_ram = vm_data.get('ram', '1GB')
             vm_storage = vm_data.get('storage', '10GB')
+            vm_cpu, vm_ram, vm_storage = normalizar_recursos_vm(vm_cpu, vm_ram, vm_storage)
             vm_internet = vm_data.get('salidainternet', False)
             vm_image_id = vm_data.get('imagen_id', 1)
             
@@ -1954,6 +1988,13 @@ def import_topology():
             'details': str(e)
         }), 400
         
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': f'Topología inválida: {str(e)}'
+        }), 400
+        
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"❌ Error importando topología: {str(e)}")
@@ -1,137 +1,193 @@
 #!/usr/bin/env python3
 import json
 import sys
-import subprocess
-import time
+import shlex
+from ssh_worker import run_worker
 
 # ===========================================================
 # Cargar argumentos del Hybrid Driver
 # ===========================================================
+# Formato simple (una VM):
+#   {"nombre_vm", "worker", "process_id", "interfaces_tap", "delete_disk"}
+# Formato batch (varias VMs del mismo worker):
+#   {"worker", "vms": [{"nombre_vm", "process_id", "interfaces_tap", "delete_disk"}, ...]}
 try:
     data = json.loads(sys.argv[1])
 except Exception as e:
     print(json.dumps({"success": False, "error": f"JSON inválido: {e}"}))
     sys.exit(1)
 
-nombre_vm = data.get("nombre_vm")
 worker = data.get("worker")
-process_id = data.get("process_id")
-interfaces_tap = data.get("interfaces_tap", [])
-delete_disk = data.get("delete_disk", False)
+vms = data.get("vms")
+batch_mode = vms is not None
+if not batch_mode:
+    vms = [{
+        "nombre_vm": data.get("nombre_vm"),
+        "process_id": data.get("process_id"),
+        "interfaces_tap": data.get("interfaces_tap", []),
+        "delete_disk": data.get("delete_disk", False)
+    }]
 
 # ===========================================================
 # Configuración interna del Headnode
 # ===========================================================
-# --- Configuración desde Variables de Entorno ---
-SSH_KEY_WORKER = "/home/ubuntu/.ssh/id_rsa_orch"
-USER_WORKER = "ubuntu"
 OVS_BRIDGE = "br-int"
+DISK_DIR = "/var/lib/qemu-images/vms-disk"
+KILL_WAIT_TENTHS = 50   # espera máxima a que QEMU muera: 50 x 0.1s
 
 # ===========================================================
-# Helper para ejecutar comandos en el worker
+# Script remoto de teardown (idempotente)
 # ===========================================================
-def run_worker(cmd):
-    ssh_cmd = (
-        f"ssh -i {SSH_KEY_WORKER} -o BatchMode=yes -o StrictHostKeyChecking=no "
-        f"{USER_WORKER}@{worker} \"{cmd}\""
-    )
-    result = subprocess.run(ssh_cmd, shell=True, capture_output=True, text=True)
-    return result.stdout.strip(), result.stderr.strip(), result.returncode
+# Se envía completo por stdin a `bash -s`: una sola conexión SSH por batch.
+# Cada VM imprime una línea JSON con su resultado.
+TEARDOWN_SCRIPT = r'''
+BRIDGE=__BRIDGE__
+DISK_DIR=__DISK_DIR__
+KILL_WAIT=__KILL_WAIT__
 
-warnings = []
-taps_eliminadas = 0
-proceso_eliminado = False
+teardown_vm() {
+    local vm="$1" pid="$2" delete_disk="$3"
+    shift 3
+    local taps="$*"
+    local proceso=false warning=""
 
-# ===========================================================
-# 1. Matar proceso QEMU
-# ===========================================================
-if process_id:
-    kill_cmd = f"sudo kill -9 {process_id} 2>&1"
-    _, stderr, rc = run_worker(kill_cmd)
-    if rc == 0 or "No such process" in stderr:
-        proceso_eliminado = True
-    else:
-        warnings.append(f"Error matando PID {process_id}: {stderr}")
-else:
-    find_kill = (
-        f"sudo pkill -9 -f 'qemu.*{nombre_vm}' 2>&1; echo $? "
-    )
-    stdout, _, _ = run_worker(find_kill)
-    exit_code = stdout.split("\n")[-1]
-    if exit_code == "0":
-        proceso_eliminado = True
-    else:
-        warnings.append(f"No se encontró proceso QEMU para {nombre_vm}")
+    # 1. Matar QEMU (por PID o por nombre)
+    if [ -z "$pid" ]; then
+        pid=$(pgrep -f "qemu.*${vm}" | tr '\n' ' ')
+    fi
+    if [ -n "$pid" ]; then
+        local alive=1
+        sudo kill -9 $pid 2>/dev/null
+        # Poll hasta que el proceso desaparezca (en lugar de un sleep fijo)
+        for _ in $(seq 1 "$KILL_WAIT"); do
+            alive=0
+            for p in $pid; do
+                sudo kill -0 "$p" 2>/dev/null && alive=1
+            done
+            [ "$alive" -eq 0 ] && break
+            sleep 0.1
+        done
+        if [ "$alive" -eq 0 ]; then
+            proceso=true
+        else
+            warning="Proceso QEMU ($pid) sigue vivo tras kill"
+        fi
+    else
+        warning="No se encontró proceso QEMU para ${vm}"
+    fi
 
-if proceso_eliminado:
-    time.sleep(1)
+    # 2. Eliminar TAPs (explícitas o búsqueda automática)
+    if [ -z "$taps" ]; then
+        taps=$(ip -o link show | grep -oP "${vm}-tap[0-9]+" | sort -u | tr '\n' ' ')
+    fi
+    local n_taps=0
+    for tap in $taps; do
+        sudo ovs-vsctl --if-exists del-port "$BRIDGE" "$tap"
+        sudo ip link delete "$tap" 2>/dev/null || true
+        n_taps=$((n_taps + 1))
+    done
 
-# ===========================================================
-# 2. Eliminar TAPs
-# ===========================================================
-if interfaces_tap:
-    # TAPs proporcionadas explícitamente
-    for tap in interfaces_tap:
-        delete_cmd = (
-            f"sudo ovs-vsctl --if-exists del-port {OVS_BRIDGE} {tap}; "
-            f"sudo ip link delete {tap} 2>/dev/null || true"
+    # 3. Eliminar disco (opcional)
+    local disco=false
+    if [ "$delete_disk" = "1" ]; then
+        sudo rm -f "${DISK_DIR}/${vm}.qcow2" && disco=true
+    fi
+
+    # 4. Limpiar archivo PID
+    local pid_file=false
+    sudo rm -f "/var/run/${vm}.pid" && pid_file=true
+
+    printf '{"nombre_vm": "%s", "proceso_eliminado": %s, "taps_eliminadas": %d, "disco_eliminado": %s, "pid_file_eliminado": %s, "warning": "%s"}\n' \
+        "$vm" "$proceso" "$n_taps" "$disco" "$pid_file" "$warning"
+}
+'''
+
+
+def build_script(vm_list):
+    script = (
+        TEARDOWN_SCRIPT
+        .replace("__BRIDGE__", shlex.quote(OVS_BRIDGE))
+        .replace("__DISK_DIR__", shlex.quote(DISK_DIR))
+        .replace("__KILL_WAIT__", str(KILL_WAIT_TENTHS))
+    )
+    for vm in vm_list:
+        taps = " ".join(shlex.quote(t) for t in (vm.get("interfaces_tap") or []))
+        script += (
+            f"teardown_vm {shlex.quote(vm['nombre_vm'])} "
+            f"{shlex.quote(str(vm.get('process_id') or ''))} "
+            f"{'1' if vm.get('delete_disk') else '0'} {taps}\n"
         )
-        _, _, _ = run_worker(delete_cmd)
-        taps_eliminadas += 1
-else:
-    # Búsqueda automática
-    find_cmd = f"ip link show | grep -oP '{nombre_vm}-tap[0-9]+' || true"
-    stdout, _, _ = run_worker(find_cmd)
-    if stdout.strip():
-        tap_list = stdout.strip().split("\n")
-        for tap in tap_list:
-            if tap:
-                delete_cmd = (
-                    f"sudo ovs-vsctl --if-exists del-port {OVS_BRIDGE} {tap}; "
-                    f"sudo ip link delete {tap} 2>/dev/null || true"
-                )
-                run_worker(delete_cmd)
-                taps_eliminadas += 1
+    return script
+
+
+def parse_results(stdout):
+    results = {}
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not (line.startswith("{") and line.endswith("}")):
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        results[item["nombre_vm"]] = item
+    return results
+
+
+def build_vm_response(vm_name, item):
+    """Respuesta por VM con el mismo formato que la versión paso a paso"""
+    if item is None:
+        return {
+            "success": False,
+            "nombre_vm": vm_name,
+            "error": f"Sin resultado del teardown para {vm_name}"
+        }
+
+    response = {
+        "success": True,
+        "nombre_vm": vm_name,
+        "mensaje": f"VM {vm_name} eliminada",
+        "details": {
+            "proceso_eliminado": item["proceso_eliminado"],
+            "taps_eliminadas": item["taps_eliminadas"],
+            "disco_eliminado": item["disco_eliminado"],
+            "pid_file_eliminado": item["pid_file_eliminado"]
+        }
+    }
+    if item.get("warning"):
+        response["warnings"] = [item["warning"]]
+    return response
 
-# ===========================================================
-# 3. Eliminar disco QCOW2 (opcional)
-# ===========================================================
-disco_eliminado = False
-if delete_disk:
-    disk_path = f"/var/lib/qemu-images/vms-disk/{nombre_vm}.qcow2"
-    delete_cmd = f"sudo rm -f {disk_path} && echo OK || echo FAIL"
-    stdout, _, _ = run_worker(delete_cmd)
-    disco_eliminado = "OK" in stdout
 
 # ===========================================================
-# 4. Limpiar archivo PID en el worker
+# Ejecutar teardown en una sola conexión
 # ===========================================================
-pid_file_eliminado = False
-
-pid_path = f"/var/run/{nombre_vm}.pid"
-clean_pid_cmd = f"sudo rm -f {pid_path}"
-_, _, rc_pid = run_worker(clean_pid_cmd)
-# rm -f devuelve 0 aunque el archivo no exista, así que lo consideramos ok
-if rc_pid == 0:
-    pid_file_eliminado = True
-else:
-    warnings.append(f"No se pudo eliminar PID file {pid_path}")
-    
+vms = [vm for vm in vms if vm.get("nombre_vm")]
+if not worker or not vms:
+    print(json.dumps({"success": False, "error": "Faltan parámetros: worker, nombre_vm"}))
+    sys.exit(0)
+
+stdout, stderr, rc = run_worker(worker, "bash -s", input_data=build_script(vms))
+results = parse_results(stdout)
+
+if rc != 0 and not results:
+    print(json.dumps({
+        "success": False,
+        "error": f"Error ejecutando teardown en worker {worker}: {stderr or stdout}"
+    }))
+    sys.exit(0)
+
 # ===========================================================
 # Respuesta final al driver
 # ===========================================================
-response = {
-    "success": True,
-    "mensaje": f"VM {nombre_vm} eliminada",
-    "details": {
-        "proceso_eliminado": proceso_eliminado,
-        "taps_eliminadas": taps_eliminadas,
-        "disco_eliminado": disco_eliminado,
-        "pid_file_eliminado": pid_file_eliminado 
-    }
-}
-
-if warnings:
-    response["warnings"] = warnings
+vm_responses = [build_vm_response(vm["nombre_vm"], results.get(vm["nombre_vm"])) for vm in vms]
 
-print(json.dumps(response))
\ No newline at end of file
+if batch_mode:
+    print(json.dumps({
+        "success": all(r["success"] for r in vm_responses),
+        "worker": worker,
+        "total": len(vm_responses),
+        "results": vm_responses
+    }))
+else:
+    print(json.dumps(vm_responses[0]))
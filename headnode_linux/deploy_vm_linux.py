@@ -1,7 +1,18 @@
 #!/usr/bin/env python3
 import json
+import os
 import sys
-import subprocess
+from ssh_worker import run_worker
+
+os.environ.setdefault("SERVICE_NAME", "headnode_linux")
+import tracing
+
+# Los spans vuelven al driver en el JSON de salida (campo "spans")
+tracing.capturar()
+# Opcional: vm_create.sh recibe el traceparent por entorno (sus VLANs son args
+# variables). `sudo VAR=... script` exige SETENV en la regla de sudoers del
+# worker; sin ella sudo rechaza el comando, por eso viene desactivado.
+TRACE_PROPAGATE_WORKER = os.getenv("TRACE_PROPAGATE_WORKER", "false").lower() == "true"
 
 # ===========================
 # Cargar argumentos del driver
@@ -22,8 +33,6 @@ cpus = data.get("cpus")
 disco_gb = data.get("disco_gb")
 
 # --- Configuración desde Variables de Entorno ---
-SSH_KEY_WORKER = "/home/ubuntu/.ssh/id_rsa_orch"
-USER_WORKER = "ubuntu"
 OVS_BRIDGE = "br-int"
 
 # ===========================
@@ -31,37 +40,30 @@ OVS_BRIDGE = "br-int"
 # ===========================
 vlan_args = " ".join(vlans)
 
-remote_cmd = (
-    f"sudo /home/ubuntu/vm_create.sh "
-    f"{nombre_vm} {OVS_BRIDGE} {puerto_vnc} {imagen} "
-    f"{ram_mb} {cpus} {disco_gb} {vlan_args}"
-)
-
-ssh_cmd = (
-    f"ssh -i {SSH_KEY_WORKER} -o BatchMode=yes -o StrictHostKeyChecking=no "
-    f"{USER_WORKER}@{worker} \"{remote_cmd}\""
-)
-
 # ===========================
-# Ejecutar en worker
+# Ejecutar en worker (conexión multiplexada)
 # ===========================
-result = subprocess.run(
-    ssh_cmd,
-    shell=True,
-    capture_output=True,
-    text=True
-)
-
-stdout = result.stdout.strip()
-stderr = result.stderr.strip()
+with tracing.span("headnode.deploy_vm_linux", parent=data.get("traceparent"), vm=nombre_vm, worker=worker):
+    with tracing.span("worker.vm_create.sh", vm=nombre_vm, worker=worker) as span:
+        env_traza = f"TRACEPARENT={span.traceparent()} " if TRACE_PROPAGATE_WORKER and tracing.TRACING_ENABLED else ""
+        remote_cmd = (
+            f"sudo {env_traza}/home/ubuntu/vm_create.sh "
+            f"{nombre_vm} {OVS_BRIDGE} {puerto_vnc} {imagen} "
+            f"{ram_mb} {cpus} {disco_gb} {vlan_args}"
+        )
+        stdout, stderr, returncode = run_worker(worker, remote_cmd)
+        span.set("returncode", returncode)
+        if returncode != 0:
+            span.status = "error"
 
 # ===========================
 # Error SSH
 # ===========================
-if result.returncode != 0:
+if returncode != 0:
     print(json.dumps({
         "success": False,
-        "error": f"Error ejecutando en worker {worker}: {stderr or stdout}"
+        "error": f"Error ejecutando en worker {worker}: {stderr or stdout}",
+        "spans": tracing.spans_capturados()
     }))
     sys.exit(0)
 
@@ -81,5 +83,6 @@ print(json.dumps({
     "success": True,
     "pid": pid,
     "worker": worker,
-    "stdout": stdout
+    "stdout": stdout,
+    "spans": tracing.spans_capturados()
 }))
\ No newline at end of file
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import os
+import subprocess
+
+# ===========================================================
+# Conexiones SSH persistentes Headnode → Worker
+# ===========================================================
+# Los scripts del headnode son procesos de vida corta, pero el master de
+# OpenSSH (ControlPersist) sobrevive entre ejecuciones: la primera llamada a
+# un worker paga el handshake, las siguientes solo abren un canal nuevo.
+SSH_KEY_WORKER = "/home/ubuntu/.ssh/id_rsa_orch"
+USER_WORKER = "ubuntu"
+SSH_CONTROL_DIR = os.getenv("SSH_CONTROL_DIR", "/tmp/ssh-mux-workers")
+SSH_CONTROL_PERSIST = os.getenv("SSH_CONTROL_PERSIST", "600")
+
+os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+
+_SSH_BASE = (
+    f"ssh -i {SSH_KEY_WORKER} -o BatchMode=yes -o StrictHostKeyChecking=no "
+    f"-o ConnectTimeout=10 "
+    f"-o ControlPath={SSH_CONTROL_DIR}/%C -o ControlPersist={SSH_CONTROL_PERSIST} "
+    f"-o ServerAliveInterval=15 -o ServerAliveCountMax=3"
+)
+
+
+def ensure_master(worker):
+    """Verifica el master del worker (socket local) y lo levanta si no existe"""
+    check = subprocess.run(
+        f"{_SSH_BASE} -O check {USER_WORKER}@{worker}",
+        shell=True, capture_output=True, text=True
+    )
+    if check.returncode == 0:
+        return True
+
+    # stdout/stderr a DEVNULL: el master queda en background y no debe heredar pipes
+    opened = subprocess.run(
+        f"{_SSH_BASE} -o ControlMaster=yes -f -N {USER_WORKER}@{worker}",
+        shell=True,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return opened.returncode == 0
+
+
+def run_worker(worker, cmd, input_data=None):
+    """
+    Ejecuta cmd en el worker sobre el master compartido.
+    Con ControlMaster=no, si el master no está disponible ssh conecta directo.
+    input_data (opcional) se envía por stdin, p.ej. un script para `bash -s`.
+    """
+    ensure_master(worker)
+    ssh_cmd = f"{_SSH_BASE} -o ControlMaster=no {USER_WORKER}@{worker} \"{cmd}\""
+    result = subprocess.run(ssh_cmd, shell=True, capture_output=True, text=True, input=input_data)
+    return result.stdout.strip(), result.stderr.strip(), result.returncode